@@ -1,46 +1,112 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException, Form, Response
-from app.core.image_processor import process_image_kmeans
-from app.core.export_processor import create_embroidery_file
-from typing import Dict, Any, List
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, Form, Request, Response
+from app.core.image_processor import process_image_kmeans, run_segmentation
+from app.core.cleanup import cleanup_options
+from app.core.palette import catalog_option
+from app.core.export_processor import run_export, export_key, export_etag, production_headers, sidecar_zip
+from app.core.cache import etag_matches
+from app.core.executor import heavy_lane, QueueFull, TaskTimeout, timing_headers
+from app.core.wire import MEDIA_TYPE as WIRE_MEDIA_TYPE, CONTOUR_QUANTUM, negotiate, encode_layers
+from app.core.metrics import stage
+from app.api.timing import TimedRoute
+from app.api.schemas import ExportRequest, design_body, design_openapi
+from typing import Dict, Any, List, Optional
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
-class ExportRequest(BaseModel):
-    layers: List[Dict[str, Any]]
-    format: str = "dst"
+def _executor_error(e: Exception) -> HTTPException:
+    if isinstance(e, QueueFull):
+        return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    return HTTPException(status_code=504, detail=str(e))
 
 @router.post("/process-image")
 async def process_image(
+    http_request: Request,
+    response: Response,
     file: UploadFile = File(...),
-    k: int = Form(5)
+    k: int = Form(5),
+    mode: str = Form("exact"),
+    sample_size: int = Form(100_000),
+    seed: Optional[int] = Form(None),
+    measure_memory: bool = Form(False),
+    tiled: bool = Form(False),
+    memory_cap: Optional[int] = Form(None),
+    min_area: Optional[int] = Form(None),
+    vertex_budget: Optional[int] = Form(None),
+    catalog: Optional[str] = Form(None)
 ) -> Dict[str, Any]:
     """
     Endpoint to process an uploaded image and return K-Means segmented vector paths.
+    mode="sampled" trades a little color error for much lower latency and memory;
+    the response "stats" reports both so the trade-off can be chosen per request.
+    mode="palette" quantizes straight to up to k threads of a thread `catalog` (k=0: no
+    limit) and every layer carries its "thread" id.
+    tiled=True processes very large artwork in overlapping tiles under `memory_cap` bytes.
+    Regions under `min_area` pixels are merged into their neighbours and the contours are
+    kept within `vertex_budget` vertices (0 turns either off); "stats"."cleanup" reports
+    regions and vertices before and after.
+    With Accept: application/x-embro-geometry the layers come back in the binary wire format.
     """
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image")
     
     try:
         contents = await file.read()
-        result = process_image_kmeans(contents, k)
+        min_area, vertex_budget = cleanup_options(min_area, vertex_budget)
+        catalog = catalog_option(mode, catalog)
+        # Tiled jobs fan out to the heavy lane's workers themselves, so they run on a thread
+        result, timing = await run_segmentation(
+            None if tiled else heavy_lane, process_image_kmeans, contents,
+            k=k, mode=mode, sample_size=sample_size, seed=seed, measure_memory=measure_memory,
+            tiled=tiled, memory_cap=memory_cap, min_area=min_area, vertex_budget=vertex_budget,
+            catalog=catalog
+        )
+        headers = timing_headers(timing) if timing else {}
+        response.headers["Vary"] = "Accept"
+        wire = negotiate(http_request.headers.get("accept"), CONTOUR_QUANTUM)
+        if wire:
+            meta = {key: value for key, value in result.items() if key != "layers"}
+            with stage("serialize.wire"):
+                content = encode_layers(result["layers"], meta, **wire)
+            return Response(content, media_type=WIRE_MEDIA_TYPE, headers={**headers, "Vary": "Accept"})
+        response.headers.update(headers)
         return result
+    except (QueueFull, TaskTimeout) as e:
+        raise _executor_error(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/export-embroidery")
-async def export_embroidery(request: ExportRequest):
+@router.post("/export-embroidery", openapi_extra=design_openapi(ExportRequest))
+async def export_embroidery(http_request: Request, request: ExportRequest = Depends(design_body(ExportRequest))):
     """
-    Takes JSON layers and generates a binary stitch file.
+    Takes layers (JSON or the binary wire format) and generates a binary stitch file.
+    Results are cached by design hash; the ETag allows conditional re-exports (304).
+    With sidecar=True the response is a zip with the file and its stats as export.json.
     """
     try:
-        file_bytes = create_embroidery_file(request.layers, request.format)
+        knockdown = {"margin": request.knockdown_margin} if request.knockdown else None
+        etag = export_etag(export_key("fill", request.layers, request.format, knockdown), "zip" if request.sidecar else "")
+        if etag_matches(http_request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+        entry, timing = await run_export(heavy_lane, "fill", request.layers, request.format, knockdown)
         
+        content = entry["content"]
         media_type = "application/octet-stream"
         filename = f"export.{request.format}"
+        if request.sidecar:
+            content, media_type = sidecar_zip(content, filename, entry["meta"]), "application/zip"
+            filename = "export.zip"
         
-        return Response(content=file_bytes, media_type=media_type, headers={
-            "Content-Disposition": f"attachment; filename={filename}"
+        return Response(content=content, media_type=media_type, headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            "ETag": etag,
+            **production_headers(entry["meta"]["production"]),
+            "X-Cache": "miss" if timing else "hit",
+            **(timing_headers(timing) if timing else {}),
         })
+    except (QueueFull, TaskTimeout) as e:
+        raise _executor_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
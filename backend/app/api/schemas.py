@@ -0,0 +1,52 @@
+from typing import Any, Callable, Dict, List, Optional, Type, TypeVar
+
+from fastapi import HTTPException, Request
+from pydantic import BaseModel, Field, ValidationError
+
+from app.core.wire import MEDIA_TYPE as WIRE_MEDIA_TYPE, is_wire, decode as decode_wire
+
+class DesignRequest(BaseModel):
+    """Body of /export: the design layers and the stitch file format."""
+    layers: List[Dict[str, Any]]
+    format: str = "dst"
+    # Zip the file with its stats (export.json / design.json)
+    sidecar: bool = False
+
+class ExportRequest(DesignRequest):
+    """Body of /export-embroidery (fill pipeline)."""
+    # Drop fill hidden under later layers, keeping knockdown_margin units of overlap
+    knockdown: bool = False
+    knockdown_margin: Optional[float] = Field(None, ge=0)
+
+Model = TypeVar("Model", bound=BaseModel)
+
+def design_body(model: Type[Model]) -> Callable:
+    """
+    Dependency parsing a `model` from a JSON body or from the binary wire format
+    (Content-Type application/x-embro-geometry, the other fields in its header meta).
+    Both go through the same validation: 422 for invalid fields, 400 for an unreadable body.
+    """
+    async def parse(http_request: Request) -> Model:
+        try:
+            if is_wire(http_request.headers.get("content-type")):
+                payload = decode_wire(await http_request.body())
+            else:
+                payload = await http_request.json()
+            return model.model_validate(payload)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid request body: {e}")
+    return parse
+
+def design_openapi(model: Type[BaseModel]) -> Dict[str, Any]:
+    """openapi_extra documenting a design_body(model) route's body (it is read from the request, not declared)."""
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": model.model_json_schema()},
+                WIRE_MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}},
+            },
+        }
+    }
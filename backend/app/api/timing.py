@@ -0,0 +1,10 @@
+from fastapi.routing import APIRoute
+
+from app.core.metrics import timed_endpoint
+
+
+class TimedRoute(APIRoute):
+    """Route whose endpoint is timed for Server-Timing / metrics (see app.core.metrics)."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, timed_endpoint(endpoint), **kwargs)
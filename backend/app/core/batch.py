@@ -0,0 +1,67 @@
+from typing import Any, Dict, List
+
+from app.stitch_engine import (
+    generate_satin_column_industrial,
+    generate_tatami_fill,
+    generate_applique_steps
+)
+
+BATCH_JOB_TYPES = ("satin", "tatami", "applique")
+
+
+def run_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    One generation job, answered in the same shape as its single endpoint:
+    satin -> {"stitches"}, tatami -> {"stitches"}, applique -> {"steps"}.
+    """
+    job_type = job.get("type")
+    if job_type == "satin":
+        stitches = generate_satin_column_industrial(
+            job["path"], job.get("width", 4.0), job.get("density", 0.4), short_stitches=True
+        )
+        return {"stitches": stitches.tolist()}
+    if job_type == "tatami":
+        stitches = generate_tatami_fill(
+            job["polygon"], job.get("density_start", 0.4), job.get("density_end", 0.4), job.get("angle", 0)
+        )
+        return {"stitches": stitches.tolist()}
+    if job_type == "applique":
+        return {"steps": generate_applique_steps(job["polygon"])}
+    raise ValueError(f"Unknown job type: {job_type!r} (expected one of {', '.join(BATCH_JOB_TYPES)})")
+
+
+def run_jobs(jobs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Runs a chunk of jobs in order. A failing job yields {"error": ...} instead of
+    aborting the rest of the chunk.
+    """
+    results = []
+    for job in jobs:
+        try:
+            results.append(run_job(job))
+        except KeyError as e:
+            results.append({"error": f"Missing field {e}"})
+        except Exception as e:
+            results.append({"error": str(e) or type(e).__name__})
+    return results
+
+
+def job_cost(job: Dict[str, Any]) -> int:
+    """Rough cost estimate: number of input vertices."""
+    points = job.get("path") or job.get("polygon") or []
+    return len(points) + 1 if isinstance(points, list) else 1
+
+
+def split_jobs(jobs: List[Dict[str, Any]], n_chunks: int) -> List[List[int]]:
+    """
+    Balances job indices over at most `n_chunks` chunks: longest jobs first, each to the
+    currently lightest chunk. Indices inside a chunk stay in input order.
+    """
+    n_chunks = max(1, min(int(n_chunks), len(jobs)))
+    chunks: List[List[int]] = [[] for _ in range(n_chunks)]
+    loads = [0] * n_chunks
+    for i in sorted(range(len(jobs)), key=lambda i: -job_cost(jobs[i])):
+        c = loads.index(min(loads))
+        chunks[c].append(i)
+        loads[c] += job_cost(jobs[i])
+    return [sorted(chunk) for chunk in chunks if chunk]
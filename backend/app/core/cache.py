@@ -0,0 +1,245 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+# Environment configuration (per uvicorn worker for memory, shared for disk)
+DEFAULT_MEMORY_BYTES = int(os.environ.get("EMBRO_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+DEFAULT_DISK_DIR = os.environ.get("EMBRO_CACHE_DIR") or None
+DEFAULT_DISK_BYTES = int(os.environ.get("EMBRO_CACHE_DISK_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+EXPORT_MEMORY_BYTES = int(os.environ.get("EMBRO_EXPORT_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+
+
+def content_key(data: bytes, **params) -> str:
+    """
+    Content-addressed key: SHA-256 of the payload plus every parameter that
+    influences the result (canonical JSON, sorted keys).
+    """
+    h = hashlib.sha256(data)
+    if params:
+        h.update(json.dumps(params, sort_keys=True, separators=(",", ":"), default=str).encode())
+    return h.hexdigest()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    True if an If-None-Match header value covers `etag` (weak comparison, "*" matches all).
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag.removeprefix("W/"):
+            return True
+    return False
+
+
+def estimate_nbytes(value: Any) -> int:
+    """
+    Size used for byte-based eviction: exact for arrays and bytes, pickled size otherwise.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class LRUByteCache:
+    """
+    In-memory LRU bounded by total bytes rather than entry count.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MEMORY_BYTES):
+        self.max_bytes = int(max_bytes)
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Any, nbytes: Optional[int] = None):
+        size = estimate_nbytes(value) if nbytes is None else int(nbytes)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self.bytes -= self._sizes[key]
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._sizes[key] = size
+            self.bytes += size
+            while self.bytes > self.max_bytes and self._data:
+                old_key, _ = self._data.popitem(last=False)
+                self.bytes -= self._sizes.pop(old_key)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._data),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class DiskCache:
+    """
+    Pickle-per-entry directory cache shared by every worker process on the host.
+    Writes are atomic (temp file + os.replace); eviction drops least recently
+    used files (by mtime, refreshed on read) once the directory exceeds max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_DISK_BYTES):
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        os.makedirs(directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._writes_since_sweep = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path, None)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            return
+        self._writes_since_sweep += 1
+        if self._writes_since_sweep >= 32:
+            self.sweep()
+
+    def sweep(self):
+        """Evicts oldest entries until the directory fits in max_bytes."""
+        self._writes_since_sweep = 0
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".pkl"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        total = sum(e[1] for e in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(os.path.join(self.directory, name))
+                self.evictions += 1
+            except OSError:
+                pass
+            total -= size
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class TieredCache:
+    """
+    Memory LRU in front of an optional shared disk tier. Disk hits are promoted to memory.
+    """
+
+    def __init__(self, memory_bytes: int = DEFAULT_MEMORY_BYTES, disk_dir: Optional[str] = None,
+                 disk_bytes: int = DEFAULT_DISK_BYTES):
+        self.memory = LRUByteCache(memory_bytes)
+        self.disk = DiskCache(disk_dir, disk_bytes) if disk_dir else None
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.put(key, value)
+        return value
+
+    def put(self, key: str, value: Any, nbytes: Optional[int] = None):
+        nbytes = estimate_nbytes(value) if nbytes is None else int(nbytes)
+        self.memory.put(key, value, nbytes)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "memory": self.memory.stats(),
+            "disk": self.disk.stats() if self.disk is not None else None,
+        }
+
+
+# Decoded / color-converted images, keyed by image hash + color space.
+# Memory only: re-decoding is cheaper than reading a raw bitmap back from disk.
+image_cache = LRUByteCache(DEFAULT_MEMORY_BYTES // 2)
+
+# Segmentation results (JSON-ready dicts), keyed by image hash + every parameter.
+segmentation_cache = TieredCache(
+    DEFAULT_MEMORY_BYTES // 2,
+    os.path.join(DEFAULT_DISK_DIR, "segmentation") if DEFAULT_DISK_DIR else None,
+    DEFAULT_DISK_BYTES,
+)
+
+# Exported stitch files ({"content": bytes, "meta", "etag", "compute_ms"}), keyed by
+# a canonical hash of layers + pipeline + format (see export_processor.export_key).
+export_cache = TieredCache(
+    EXPORT_MEMORY_BYTES,
+    os.path.join(DEFAULT_DISK_DIR, "export") if DEFAULT_DISK_DIR else None,
+    DEFAULT_DISK_BYTES,
+)
+
+# Digitized stitch blocks of single layers, keyed by the layer's geometry + settings
+# (see export_processor.layer_key), so a re-export only regenerates edited layers.
+layer_cache = TieredCache(
+    DEFAULT_MEMORY_BYTES // 2,
+    os.path.join(DEFAULT_DISK_DIR, "layers") if DEFAULT_DISK_DIR else None,
+    DEFAULT_DISK_BYTES,
+)
@@ -0,0 +1,215 @@
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import shapely
+
+from app.core.contours import connected_regions
+from app.core.metrics import timed
+
+# Segmentation cleanup. Photos cluster into thousands of speckles and every region costs
+# every later stage (fill, underlay, branching, trims), so two passes run before the
+# layers leave segmentation:
+# 1. Speckle merging on the label map: connected regions under the minimum area are
+#    handed to the surrounding clusters. Every speckle pixel takes the label of its
+#    nearest surviving pixel (one labelled distance transform), which is what growing
+#    the neighbouring regions into the hole by repeated dilation would give.
+# 2. A total vertex budget on the traced contours: every ring is Douglas-Peucker
+#    simplified with one global tolerance, the smallest (by bisection) that brings the
+#    vertex count under budget. Rings that collapse are dropped, a region with its holes.
+
+# Regions smaller than this (pixels) are merged into their neighbours, 0 turns merging off
+CLEANUP_MIN_AREA = int(os.environ.get("EMBRO_CLEANUP_MIN_AREA", 16))
+
+# Total contour vertices per segmentation, 0 turns the budget off
+CLEANUP_VERTEX_BUDGET = int(os.environ.get("EMBRO_CLEANUP_VERTEX_BUDGET", 60_000))
+
+# Regions under 3 pixels never make a contour (extract_region_contours min_points), so
+# they are not counted as regions before cleanup either
+TRACEABLE_AREA = 3
+
+# Bisection steps on the tolerance (the bracket starts one doubling wide)
+BUDGET_STEPS = 8
+
+
+def cleanup_options(min_area: Optional[int], vertex_budget: Optional[int]) -> Tuple[int, int]:
+    """(min_area, vertex_budget) with the defaults filled in; negative values are an error."""
+    min_area = CLEANUP_MIN_AREA if min_area is None else int(min_area)
+    vertex_budget = CLEANUP_VERTEX_BUDGET if vertex_budget is None else int(vertex_budget)
+    if min_area < 0 or vertex_budget < 0:
+        raise ValueError("min_area and vertex_budget must not be negative")
+    return min_area, vertex_budget
+
+
+@timed("cleanup.speckles")
+def merge_speckles(
+    label_map: np.ndarray,
+    num_labels: int,
+    min_area: int,
+    protect_border: bool = False
+) -> Tuple[np.ndarray, Dict[str, int]]:
+    """
+    Label map with every 8-connected region under `min_area` pixels relabelled from its
+    nearest larger neighbours, plus {"regions": regions of TRACEABLE_AREA pixels or more
+    before merging, "speckles", "pixels_merged"}. With protect_border, regions touching
+    the map edge are kept (a tile only sees part of them). The input is not modified.
+
+    Regions come from one run-length labelling of the whole map (connected_regions), not
+    one pass per label. With merging off (`min_area` 0) nothing is labelled and "regions"
+    is 0: the caller counts the regions it traces instead.
+    """
+    if min_area <= 0:
+        return label_map, {"regions": 0, "speckles": 0, "pixels_merged": 0}
+
+    h, w = label_map.shape
+    components = connected_regions(label_map)
+    x0, y0, x1, y1 = components["bbox"].T
+    area = components["area"]
+    label = components["component_label"]
+    valid = (label >= 0) & (label < num_labels)
+    is_small = valid & (area < min_area)
+    if protect_border:
+        is_small &= (x0 > 0) & (y0 > 0) & (x1 < w) & (y1 < h)
+
+    stats = {
+        "regions": int(np.count_nonzero(valid & (area >= TRACEABLE_AREA))),
+        "speckles": int(np.count_nonzero(is_small)),
+        "pixels_merged": 0,
+    }
+    if stats["speckles"] == 0:
+        return label_map, stats
+    # Runs tile the map in raster order: the mask is every run's flag over its length
+    run_lengths = components["run_ends"] - components["run_starts"]
+    small = np.repeat(is_small[components["run_component"]].astype(np.uint8), run_lengths).reshape(h, w)
+    pixels = int(np.count_nonzero(small))
+    if pixels == h * w:
+        return label_map, stats
+
+    # Zero pixels (the survivors) are numbered in raster order from 1
+    _, nearest = cv2.distanceTransformWithLabels(small, cv2.DIST_L2, 5, labelType=cv2.DIST_LABEL_PIXEL)
+    survivors = label_map.ravel()[np.flatnonzero(small.ravel() == 0)]
+    merged = np.array(label_map, copy=True)
+    is_small = small.view(bool)
+    merged[is_small] = survivors[nearest[is_small] - 1]
+    stats["pixels_merged"] = pixels
+    return merged, stats
+
+
+def _ring_arrays(regions: List[List[Dict[str, Any]]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Every ring of every region, closed, as one coordinate array: (coords, ring index per
+    point, region index per ring). Regions are numbered across labels, exteriors first.
+    """
+    coords, sizes, region_of = [], [], []
+    for r, region in enumerate(region for label_regions in regions for region in label_regions):
+        for points in (region["exterior"], *region["holes"]):
+            coords += points
+            coords.append(points[0])
+            sizes.append(len(points) + 1)
+            region_of.append(r)
+    if not coords:
+        return np.empty((0, 2)), np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    ring_of = np.repeat(np.arange(len(sizes)), sizes)
+    return np.array(coords, dtype=np.float64), ring_of, np.asarray(region_of)
+
+
+def _vertices(lines: np.ndarray) -> np.ndarray:
+    """Open vertex count per closed ring, 0 for rings that collapsed below a triangle."""
+    count = shapely.get_num_coordinates(lines) - 1
+    return np.where(count >= 3, count, 0)
+
+
+@timed("cleanup.budget")
+def simplify_to_budget(
+    regions: List[List[Dict[str, Any]]],
+    vertex_budget: int
+) -> Tuple[List[List[Dict[str, Any]]], Dict[str, Any]]:
+    """
+    Regions (per label, as extract_region_contours returns them) simplified with the
+    smallest single tolerance that keeps the total vertex count within `vertex_budget`,
+    plus {"vertices": before, "tolerance": pixels (0 when already within budget)}.
+    Regions within budget are returned as they are.
+    """
+    coords, ring_of, region_of = _ring_arrays(regions)
+    vertices = len(coords) - len(region_of)
+    stats = {"vertices": vertices, "tolerance": 0.0}
+    if vertex_budget <= 0 or vertices <= vertex_budget:
+        return regions, stats
+
+    lines = shapely.linestrings(coords, indices=ring_of)
+
+    def simplified(tolerance: float) -> Tuple[np.ndarray, int]:
+        result = shapely.simplify(lines, tolerance, preserve_topology=False)
+        return result, int(_vertices(result).sum())
+
+    # Double until the budget holds, then bisect between the last two tolerances
+    low, high = 0.0, 1.0
+    best, count = simplified(high)
+    while count > vertex_budget:
+        low, high = high, high * 2.0
+        best, count = simplified(high)
+    for _ in range(BUDGET_STEPS):
+        middle = (low + high) / 2.0
+        candidate, count = simplified(middle)
+        if count > vertex_budget:
+            low = middle
+        else:
+            high, best = middle, candidate
+    stats["tolerance"] = high
+
+    kept = _vertices(best)
+    points = shapely.get_coordinates(best).astype(np.int64).tolist()
+    sizes = shapely.get_num_coordinates(best)
+    starts = (np.cumsum(sizes) - sizes).tolist()
+    rings = [points[s:s + n] if n else None for s, n in zip(starts, kept.tolist())]
+
+    # Rings back into regions: a region goes with its exterior, a hole on its own
+    first_ring = np.flatnonzero(np.r_[True, region_of[1:] != region_of[:-1]]).tolist() + [len(region_of)]
+    result: List[List[Dict[str, Any]]] = []
+    r = 0
+    for label_regions in regions:
+        cleaned = []
+        for _ in label_regions:
+            exterior, *holes = rings[first_ring[r]:first_ring[r + 1]]
+            r += 1
+            if exterior is not None:
+                cleaned.append({"exterior": exterior, "holes": [hole for hole in holes if hole is not None]})
+        result.append(cleaned)
+    return result, stats
+
+
+def count_vertices(regions: List[List[Dict[str, Any]]]) -> Tuple[int, int]:
+    """(regions, vertices) over all labels, holes included."""
+    count = vertices = 0
+    for label_regions in regions:
+        for region in label_regions:
+            count += 1
+            vertices += len(region["exterior"]) + sum(len(hole) for hole in region["holes"])
+    return count, vertices
+
+
+def cleanup_report(
+    min_area: int,
+    vertex_budget: int,
+    speckles: Dict[str, int],
+    budget: Dict[str, Any],
+    regions: List[List[Dict[str, Any]]]
+) -> Dict[str, Any]:
+    """
+    The "cleanup" entry of segmentation stats: regions before (connected regions of the
+    raw label map that would trace; the traced regions when merging is off) and after,
+    vertices as traced from the merged map and after the budget.
+    """
+    count, vertices = count_vertices(regions)
+    return {
+        "min_area": min_area,
+        "vertex_budget": vertex_budget,
+        "regions_before": speckles["regions"],
+        "regions_after": count,
+        "speckles_merged": speckles["speckles"],
+        "pixels_merged": speckles["pixels_merged"],
+        "vertices_before": budget["vertices"],
+        "vertices_after": vertices,
+        "tolerance": budget["tolerance"],
+    }
@@ -0,0 +1,278 @@
+import cv2
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def label_runs(label_map: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Run-length encodes every row of a label map in one pass.
+    Returns parallel arrays (row, x_start, x_end_exclusive, label), sorted by row then x.
+    """
+    h, w = label_map.shape
+    change = np.ones((h, w), dtype=bool)
+    change[:, 1:] = label_map[:, 1:] != label_map[:, :-1]
+    rows, starts = np.nonzero(change)
+
+    # A run ends where the next one starts, or at the row end
+    ends = np.empty_like(starts)
+    ends[:-1] = starts[1:]
+    last_in_row = np.ones(len(rows), dtype=bool)
+    last_in_row[:-1] = rows[1:] != rows[:-1]
+    ends[last_in_row] = w
+
+    return rows, starts, ends, label_map[rows, starts]
+
+
+def _union_components(n: int, u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    """
+    Connected components of a graph with n nodes and edges (u, v): min-label propagation
+    with pointer jumping, fully vectorized. Returns a root id per node.
+    """
+    parent = np.arange(n)
+    if len(u) == 0:
+        return parent
+    while True:
+        pu, pv = parent[u], parent[v]
+        m = np.minimum(pu, pv)
+        new_parent = parent.copy()
+        np.minimum.at(new_parent, pu, m)
+        np.minimum.at(new_parent, pv, m)
+        # Pointer jumping until every node points at a fixed point
+        while True:
+            jumped = new_parent[new_parent]
+            if np.array_equal(jumped, new_parent):
+                break
+            new_parent = jumped
+        if np.array_equal(new_parent, parent):
+            return parent
+        parent = new_parent
+
+
+def connected_regions(label_map: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    8-connected components of a multi-label map (pixels join when they touch, diagonals
+    included, and share a label), the same connectivity findContours uses for foreground.
+
+    Work is proportional to the number of row runs, i.e. to total boundary length,
+    instead of one full-image pass per label. Returns the runs with their component
+    id plus, per component: label, pixel area and bounding box (x0, y0, x1, y1, exclusive).
+    """
+    rows, starts, ends, labels = label_runs(label_map)
+    w = label_map.shape[1]
+    n = len(rows)
+
+    # Candidate neighbours of each run among the runs of the previous row: those
+    # overlapping [start - 1, end + 1) (diagonal contact counts).
+    # Runs tile every row, so global keys row*w + x are strictly increasing.
+    key_start = rows * w + starts
+    key_end = rows * w + ends
+    b = np.nonzero(rows > 0)[0]
+    prev_base = (rows[b] - 1) * w
+    first = np.searchsorted(key_end, prev_base + np.maximum(starts[b] - 1, 0), side='right')
+    last = np.searchsorted(key_start, prev_base + np.minimum(ends[b] + 1, w), side='left') - 1
+    counts = np.maximum(last - first + 1, 0)
+
+    b_rep = np.repeat(b, counts)
+    offs = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    a_rep = np.repeat(first, counts) + offs
+    same = labels[a_rep] == labels[b_rep]
+
+    root = _union_components(n, a_rep[same], b_rep[same])
+    # Roots are fixed points; number them in order without sorting
+    is_root = root == np.arange(n)
+    comp_of_run = (np.cumsum(is_root) - 1)[root]
+    n_comp = int(is_root.sum())
+
+    x0 = np.full(n_comp, np.iinfo(np.int64).max)
+    y0 = np.full(n_comp, np.iinfo(np.int64).max)
+    x1 = np.zeros(n_comp, dtype=np.int64)
+    y1 = np.zeros(n_comp, dtype=np.int64)
+    np.minimum.at(x0, comp_of_run, starts)
+    np.minimum.at(y0, comp_of_run, rows)
+    np.maximum.at(x1, comp_of_run, ends)
+    np.maximum.at(y1, comp_of_run, rows + 1)
+
+    comp_label = np.empty(n_comp, dtype=labels.dtype)
+    comp_label[comp_of_run] = labels
+
+    area = np.zeros(n_comp, dtype=np.int64)
+    np.add.at(area, comp_of_run, ends - starts)
+
+    return {
+        "run_rows": rows, "run_starts": starts, "run_ends": ends, "run_component": comp_of_run,
+        "component_label": comp_label,
+        "area": area,
+        "bbox": np.column_stack([x0, y0, x1, y1]),
+    }
+
+
+# Components whose bounding box fits in one of these square cells (with a 1 px
+# margin on every side) are packed into an atlas and traced with a single
+# findContours call per cell size instead of one call each.
+ATLAS_CELL_SIZES = (8, 16, 32, 64)
+
+# Rough cost of handling one row run relative to one pixel of one full-image mask
+# scan. Above k * pixels / RUN_COST_RATIO runs (photo-like noise) the per-label
+# masks are cheaper than labelling the components.
+RUN_COST_RATIO = 300
+
+
+def _emit_regions(result, contours, hierarchy, labels, shift, epsilon_ratio, min_points):
+    """
+    Appends the regions of one RETR_CCOMP trace to `result`.
+    `labels` holds the cluster of every contour (-1 to skip it) and `shift`, if given,
+    the (n, 2) translation back to image coordinates. Translation and list conversion
+    run once over all contours instead of once per contour.
+    """
+    if epsilon_ratio is not None:
+        contours = [cv2.approxPolyDP(c, epsilon_ratio * cv2.arcLength(c, True), True) for c in contours]
+    n = len(contours)
+    lengths = np.fromiter((len(c) for c in contours), dtype=np.int64, count=n)
+    parent = hierarchy[:, 3]
+
+    is_outer = parent == -1
+    keep = (lengths >= min_points) & (labels >= 0)
+    # A hole survives only together with its outer boundary
+    keep &= is_outer | keep[np.maximum(parent, 0)]
+    idx = np.nonzero(keep)[0]
+    if len(idx) == 0:
+        return
+
+    points = np.concatenate([contours[i] for i in idx.tolist()]).reshape(-1, 2)
+    if shift is not None:
+        points = points + np.repeat(shift[idx], lengths[idx], axis=0)
+    flat = points.tolist()
+    bounds = np.concatenate([[0], np.cumsum(lengths[idx])]).tolist()
+
+    regions = {}
+    for j, i in enumerate(idx.tolist()):
+        polygon = flat[bounds[j]:bounds[j + 1]]
+        if is_outer[i]:
+            region = {"exterior": polygon, "holes": []}
+            regions[i] = region
+            result[labels[i]].append(region)
+        else:
+            regions[int(parent[i])]["holes"].append(polygon)
+
+
+def _trace_atlas(regions, comps, cell, num_labels, result, epsilon_ratio, min_points, offset=(0, 0)):
+    """
+    Packs the given components into a grid of `cell` x `cell` slots, traces the whole
+    atlas once and maps every contour back to its component by slot.
+    """
+    m = len(comps)
+    cols = int(np.ceil(np.sqrt(m)))
+    rows = int(np.ceil(m / cols))
+    atlas = np.zeros((rows * cell, cols * cell), dtype=np.uint8)
+
+    slot_of_comp = np.full(len(regions["bbox"]), -1, dtype=np.int64)
+    slot_of_comp[comps] = np.arange(m)
+    bbox = regions["bbox"]
+
+    # Rasterize every run of the selected components straight into its slot
+    run_slot = slot_of_comp[regions["run_component"]]
+    sel = run_slot >= 0
+    slot = run_slot[sel]
+    comp = regions["run_component"][sel]
+    origin_y = (slot // cols) * cell + 1 - bbox[comp, 1]
+    origin_x = (slot % cols) * cell + 1 - bbox[comp, 0]
+    starts, ends = regions["run_starts"][sel], regions["run_ends"][sel]
+    lengths = ends - starts
+    pix_run = np.repeat(np.arange(len(lengths)), lengths)
+    pix_x = starts[pix_run] + np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    atlas[regions["run_rows"][sel][pix_run] + origin_y[pix_run], pix_x + origin_x[pix_run]] = 255
+
+    contours, hierarchy = cv2.findContours(atlas, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+    if hierarchy is None:
+        return
+
+    # Every contour (holes included) lies inside the slot of its component
+    first = np.array([c[0, 0] for c in contours])
+    s = (first[:, 1] // cell) * cols + first[:, 0] // cell
+    c = comps[s]
+    labels = regions["component_label"][c].astype(np.int64)
+    labels[labels >= num_labels] = -1
+    shift = np.column_stack([
+        bbox[c, 0] - (s % cols) * cell - 1 + offset[0],
+        bbox[c, 1] - (s // cols) * cell - 1 + offset[1],
+    ])
+    _emit_regions(result, contours, hierarchy[0], labels, shift, epsilon_ratio, min_points)
+
+
+def _trace_label_masks(label_map, num_labels, result, epsilon_ratio, min_points, offset=(0, 0)):
+    """One mask and one RETR_CCOMP trace per label (fragmented label maps)."""
+    for label in range(num_labels):
+        mask = cv2.compare(label_map, label, cv2.CMP_EQ)
+        contours, hierarchy = cv2.findContours(mask, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
+        if hierarchy is None:
+            continue
+        _emit_regions(result, contours, hierarchy[0], np.full(len(contours), label), None,
+                      epsilon_ratio, min_points)
+
+
+def extract_region_contours(
+    label_map: np.ndarray,
+    num_labels: int,
+    epsilon_ratio: Optional[float] = None,
+    min_points: int = 3,
+    offset: Tuple[int, int] = (0, 0)
+) -> List[List[Dict[str, Any]]]:
+    """
+    Contours of every connected region, grouped by cluster label, holes included.
+
+    The label map is labelled once. Small components are packed into atlases and traced
+    in bulk; larger ones are traced inside their own bounding box. RETR_CCOMP keeps the
+    hole hierarchy. Returns, for each label in range(num_labels), a list of
+    {"exterior": [[x, y], ...], "holes": [[[x, y], ...], ...]}.
+    Contours are optionally simplified with approxPolyDP(epsilon_ratio * arcLength) and
+    dropped below `min_points` vertices. `offset` (x, y) is added to every point, for
+    label maps that are a tile of a larger image.
+
+    Very fragmented maps (more row runs than the per-label scans would cost, see
+    RUN_COST_RATIO) are traced with one mask per label instead; the output is the same.
+    """
+    label_map = np.ascontiguousarray(label_map, dtype=np.int32)
+    result: List[List[Dict[str, Any]]] = [[] for _ in range(num_labels)]
+
+    h, w = label_map.shape
+    run_count = h + int(np.count_nonzero(label_map[:, 1:] != label_map[:, :-1]))
+    if run_count * RUN_COST_RATIO > num_labels * h * w:
+        _trace_label_masks(label_map, num_labels, result, epsilon_ratio, min_points, offset)
+        return result
+
+    regions = connected_regions(label_map)
+
+    # A region needs at least `min_points` pixels to produce that many contour vertices
+    bbox = regions["bbox"]
+    size = np.maximum(bbox[:, 2] - bbox[:, 0], bbox[:, 3] - bbox[:, 1])
+    pending = regions["area"] >= min_points
+
+    for cell in ATLAS_CELL_SIZES:
+        comps = np.nonzero(pending & (size <= cell - 2))[0]
+        pending[comps] = False
+        if len(comps):
+            _trace_atlas(regions, comps, cell, num_labels, result, epsilon_ratio, min_points, offset)
+
+    large = np.nonzero(pending)[0]
+    if len(large) == 0:
+        return result
+
+    # Component id per pixel, expanded from the runs in one pass
+    run_lengths = regions["run_ends"] - regions["run_starts"]
+    comp_dtype = np.uint16 if len(bbox) < 2 ** 16 else np.int32
+    comp_map = np.repeat(regions["run_component"].astype(comp_dtype), run_lengths).reshape(label_map.shape)
+
+    labels = regions["component_label"][large].tolist()
+    for c, label, (bx0, by0, bx1, by1) in zip(large.tolist(), labels, bbox[large].tolist()):
+        if label < 0 or label >= num_labels:
+            continue
+        mask = (comp_map[by0:by1, bx0:bx1] == c).astype(np.uint8) * 255
+
+        contours, hierarchy = cv2.findContours(mask, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE,
+                                               offset=(bx0 + offset[0], by0 + offset[1]))
+        if hierarchy is None:
+            continue
+        _emit_regions(result, contours, hierarchy[0], np.full(len(contours), label), None,
+                      epsilon_ratio, min_points)
+
+    return result
@@ -0,0 +1,165 @@
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from app.core.stitch_buffer import StitchBuffer, STITCH
+from app.core.production_stats import MM_PER_UNIT
+from app.core.metrics import timed
+
+# Stitch density of an assembled design: every stitch (from the previous needle
+# position, like production_stats) is rasterized into a coverage grid of thread length
+# per area, and cells above a threshold are grouped into hotspot regions. Stacked
+# layers, underlay under fill and branching connectors all add up in the grid, so
+# hotspots are where needles break. Segments are sampled at most a cell apart and every
+# sample carries its share of the segment length into one bincount; there is no
+# loop over stitches.
+
+# Grid cell side in mm
+DENSITY_CELL_MM = float(os.environ.get("EMBRO_DENSITY_CELL_MM", 1.0))
+
+# Hotspot threshold in mm of thread per mm^2. A 0.4 mm tatami is 2.5, a 0.4 mm satin
+# column about as much; three of them stacked on one spot is too much.
+DENSITY_THRESHOLD = float(os.environ.get("EMBRO_DENSITY_THRESHOLD", 7.5))
+
+# The cell grows (by whole factors) instead of the grid growing past this
+DENSITY_MAX_CELLS = 4_000_000
+
+# Reported hotspots, densest first
+MAX_HOTSPOTS = 50
+
+
+def density_grid(
+    coords: np.ndarray,
+    commands: np.ndarray,
+    cell_mm: float = DENSITY_CELL_MM
+) -> Tuple[np.ndarray, np.ndarray, float]:
+    """
+    Coverage grid of a stitch stream: (HxW thread mm per mm^2, grid origin in units,
+    cell side in mm). Row i, column j covers origin + (j, i) * cell. `cell_mm` is
+    enlarged when the design would need more than DENSITY_MAX_CELLS cells.
+    """
+    coords = np.asarray(coords).reshape(-1, 2)
+    stitch_idx = np.flatnonzero(np.asarray(commands) == STITCH)
+    if len(stitch_idx) == 0:
+        return np.zeros((0, 0)), np.zeros(2), cell_mm
+    # Per column in the buffer's dtype (float32): the grid needs cell precision only
+    previous = np.maximum(stitch_idx - 1, 0)
+    x0, y0 = coords[previous, 0], coords[previous, 1]
+    dx, dy = coords[stitch_idx, 0] - x0, coords[stitch_idx, 1] - y0
+
+    origin = np.array([min(x0.min(), (x0 + dx).min()), min(y0.min(), (y0 + dy).min())], dtype=np.float64)
+    extent = np.array([max(x0.max(), (x0 + dx).max()), max(y0.max(), (y0 + dy).max())], dtype=np.float64) - origin
+    cell = cell_mm / MM_PER_UNIT
+    while np.prod(np.floor(extent / cell) + 1) > DENSITY_MAX_CELLS:
+        cell *= 2.0
+    width, height = (np.floor(extent / cell) + 1).astype(np.int64)
+
+    # Samples at the centers of n equal pieces of each segment, one piece per cell length
+    length = np.hypot(dx, dy)
+    pieces = np.maximum(np.ceil(length / cell), 1).astype(np.int64)
+    if pieces.sum() == len(pieces):
+        segment, t = slice(None), 0.5
+    else:
+        segment = np.repeat(np.arange(len(pieces)), pieces)
+        first = np.cumsum(pieces) - pieces
+        t = ((np.arange(len(segment)) - first[segment] + 0.5) / pieces[segment]).astype(dx.dtype)
+    col = ((x0 - origin[0])[segment] + t * dx[segment]) * (1.0 / cell)
+    row = ((y0 - origin[1])[segment] + t * dy[segment]) * (1.0 / cell)
+    index = np.clip(row.astype(np.int64), 0, height - 1) * width + np.clip(col.astype(np.int64), 0, width - 1)
+
+    weight = (length * (MM_PER_UNIT / pieces))[segment]
+    grid = np.bincount(index, weights=weight, minlength=width * height)
+    cell_mm = cell * MM_PER_UNIT
+    return grid.reshape(height, width) / (cell_mm * cell_mm), origin, cell_mm
+
+
+def hotspots(
+    grid: np.ndarray,
+    origin: np.ndarray,
+    cell_mm: float,
+    threshold: float = DENSITY_THRESHOLD,
+    limit: int = MAX_HOTSPOTS
+) -> list:
+    """
+    Connected regions (8-neighbourhood) of cells above `threshold`, densest first:
+    [{"bbox": [x0, y0, x1, y1] in units, "center": [x, y], "area_mm2", "peak", "mean"}].
+    """
+    if grid.size == 0:
+        return []
+    mask = (grid > threshold).astype(np.uint8)
+    n, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    if n <= 1:
+        return []
+    label = labels.ravel()
+    inside = label > 0
+    values = grid.ravel()[inside]
+    peak = np.zeros(n)
+    np.maximum.at(peak, label[inside], values)
+    total = np.bincount(label[inside], weights=values, minlength=n)
+
+    cell = cell_mm / MM_PER_UNIT
+    regions = []
+    for r in np.argsort(-peak[1:])[:limit] + 1:
+        x, y, w, h, cells = stats[r]
+        regions.append({
+            "bbox": [float(origin[0] + x * cell), float(origin[1] + y * cell),
+                     float(origin[0] + (x + w) * cell), float(origin[1] + (y + h) * cell)],
+            "center": [float(origin[0] + (centroids[r][0] + 0.5) * cell), float(origin[1] + (centroids[r][1] + 0.5) * cell)],
+            "area_mm2": float(cells * cell_mm * cell_mm),
+            "peak": float(peak[r]),
+            "mean": float(total[r] / cells),
+        })
+    return regions
+
+
+def heatmap_png(grid: np.ndarray, threshold: float = DENSITY_THRESHOLD, max_side: int = 1024) -> bytes:
+    """
+    Heatmap of a coverage grid as PNG: black is bare, the threshold maps to the middle of
+    the color scale and everything at twice the threshold or more to its top. Cells are
+    scaled up by a whole factor while the image stays within `max_side` pixels.
+    """
+    if grid.size == 0:
+        grid = np.zeros((1, 1))
+    scaled = np.clip(grid * (127.5 / threshold), 0, 255).astype(np.uint8)
+    image = cv2.applyColorMap(scaled, cv2.COLORMAP_INFERNO)
+    factor = max(1, max_side // max(grid.shape))
+    if factor > 1:
+        image = cv2.resize(image, None, fx=factor, fy=factor, interpolation=cv2.INTER_NEAREST)
+    ok, png = cv2.imencode(".png", image)
+    if not ok:
+        raise ValueError("Could not encode the density heatmap")
+    return png.tobytes()
+
+
+@timed("density")
+def density_report(
+    buffer: StitchBuffer,
+    cell_mm: Optional[float] = None,
+    threshold: Optional[float] = None,
+    heatmap: bool = False
+) -> Dict[str, Any]:
+    """
+    Density report of an assembled stitch buffer: {"cell_mm", "threshold", "peak",
+    "mean" (over covered cells), "covered_mm2", "over_threshold_mm2", "hotspots"} in mm
+    of thread per mm^2, plus "heatmap" (PNG bytes) when asked for.
+    """
+    cell_mm = DENSITY_CELL_MM if cell_mm is None else float(cell_mm)
+    threshold = DENSITY_THRESHOLD if threshold is None else float(threshold)
+    if not (cell_mm > 0 and threshold > 0):
+        raise ValueError("Density cell_mm and threshold must be positive")
+    grid, origin, cell_mm = density_grid(buffer.coords, buffer.commands, cell_mm)
+    covered = grid[grid > 0]
+    report = {
+        "cell_mm": cell_mm,
+        "threshold": threshold,
+        "peak": float(covered.max()) if len(covered) else 0.0,
+        "mean": float(covered.mean()) if len(covered) else 0.0,
+        "covered_mm2": float(len(covered) * cell_mm * cell_mm),
+        "over_threshold_mm2": float((covered > threshold).sum() * cell_mm * cell_mm),
+        "hotspots": hotspots(grid, origin, cell_mm, threshold),
+    }
+    if heatmap:
+        report["heatmap"] = heatmap_png(grid, threshold)
+    return report
@@ -0,0 +1,269 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple
+
+import numpy as np
+
+from app.core.metrics import collect_stages, record_stage, record_stages
+
+# "process" (default) runs tasks in worker processes; "thread" keeps them in this
+# process on a thread pool (development, debugging, platforms without fork).
+EXECUTOR_MODE = os.environ.get("EMBRO_EXECUTOR_MODE", "process")
+
+_CPUS = os.cpu_count() or 1
+
+# Modules every worker imports before its first task. With the forkserver start
+# method they are loaded once in the server and inherited by every forked worker.
+WARM_MODULES = [
+    "numpy",
+    "cv2",
+    "shapely",
+    "pyembroidery",
+    "app.stitch_engine",
+    "app.core.image_processor",
+    "app.core.export_processor",
+    "app.core.batch",
+]
+
+
+class QueueFull(Exception):
+    """The lane already holds its maximum number of queued + running tasks."""
+
+
+class TaskTimeout(Exception):
+    """The task did not finish within the lane timeout."""
+
+
+def _warm_worker():
+    import importlib
+    for name in WARM_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _timed_call(fn: Callable, args: tuple, kwargs: dict, submitted_at: float) -> Tuple[Any, float, float, Dict[str, float]]:
+    """Runs in the worker: returns (result, queue_wait_s, compute_s, {stage: seconds})."""
+    started_at = time.time()
+    t0 = time.perf_counter()
+    with collect_stages() as stages:
+        result = fn(*args, **kwargs)
+    return result, max(started_at - submitted_at, 0.0), time.perf_counter() - t0, stages
+
+
+class Lane:
+    """
+    A pool of workers with a bounded number of queued + running tasks and a per-task
+    timeout. Cheap interactive requests and heavy jobs go to separate lanes, so a long
+    export never sits in front of a satin preview.
+
+    A timed-out task that already started keeps its worker until it finishes (worker
+    processes cannot be interrupted safely); its slot counts against `max_pending`
+    until then, so the queue bound always reflects real work.
+    """
+
+    def __init__(self, name: str, workers: int, max_pending: int, timeout: float, mode: str = EXECUTOR_MODE):
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self.timeout = float(timeout)
+        self.mode = mode
+        self._pool: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.failures = 0
+        self._wait_ms = deque(maxlen=1024)
+        self._compute_ms = deque(maxlen=1024)
+
+    @property
+    def pool(self) -> Executor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = self._create_pool()
+            return self._pool
+
+    def _create_pool(self) -> Executor:
+        if self.mode == "thread":
+            return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"{self.name}-lane")
+        methods = multiprocessing.get_all_start_methods()
+        if "forkserver" in methods:
+            ctx = multiprocessing.get_context("forkserver")
+            ctx.set_forkserver_preload(WARM_MODULES)
+        else:
+            ctx = multiprocessing.get_context("spawn")
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx, initializer=_warm_worker)
+
+    def start(self):
+        """Creates the pool and spawns its workers ahead of the first request."""
+        pool = self.pool
+        for future in [pool.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _acquire(self):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise QueueFull(f"{self.name} lane is full ({self.max_pending} tasks queued or running)")
+            self.pending += 1
+            self.submitted += 1
+
+    def _release(self, _future=None):
+        with self._lock:
+            self.pending -= 1
+
+    def _submit(self, fn: Callable, args: tuple, kwargs: dict):
+        try:
+            return self.pool.submit(_timed_call, fn, args, kwargs, time.time())
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool once
+            with self._lock:
+                broken, self._pool = self._pool, None
+            if broken is not None:
+                broken.shutdown(wait=False, cancel_futures=True)
+            return self.pool.submit(_timed_call, fn, args, kwargs, time.time())
+
+    async def run_timed(self, fn: Callable, *args, **kwargs) -> Tuple[Any, Dict[str, float]]:
+        """
+        Runs fn(*args, **kwargs) on this lane without blocking the event loop.
+        Returns (result, {"queue_wait_ms", "compute_ms", "stages"}); the stages timed in
+        the worker are also recorded here, in the metrics and the current request trace.
+        Raises QueueFull when the lane is saturated and TaskTimeout after `timeout` seconds.
+        """
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            result, wait_s, compute_s, stages = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise TaskTimeout(f"{self.name} task exceeded {self.timeout:g}s")
+        except Exception:
+            with self._lock:
+                self.failures += 1
+            raise
+
+        return result, self._record(wait_s, compute_s, stages)
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        result, _ = await self.run_timed(fn, *args, **kwargs)
+        return result
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Blocking-code counterpart of run_timed for callers that fan out several tasks
+        from a thread (tiled segmentation): reserves a slot and submits fn(*args, **kwargs).
+        Raises QueueFull when the lane is saturated. The future is resolved with
+        collect(); wait_first() applies the lane timeout to it.
+        """
+        self._acquire()
+        try:
+            future = self._submit(fn, args, kwargs)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        future.deadline = time.monotonic() + self.timeout
+        return future
+
+    def wait_first(self, futures: Iterable[Future]) -> Tuple[Set[Future], Set[Future]]:
+        """
+        (done, not_done) of futures from submit(), as soon as one is done. Raises
+        TaskTimeout when the earliest submitted one exceeds the lane timeout first.
+        """
+        futures = set(futures)
+        remaining = min(future.deadline for future in futures) - time.monotonic()
+        done, not_done = wait(futures, timeout=max(remaining, 0.0), return_when=FIRST_COMPLETED)
+        if not done:
+            with self._lock:
+                self.timeouts += 1
+            raise TaskTimeout(f"{self.name} task exceeded {self.timeout:g}s")
+        return done, not_done
+
+    def collect(self, future: Future) -> Any:
+        """Result of a finished future from submit(), with its timing recorded like run_timed's."""
+        try:
+            result, wait_s, compute_s, stages = future.result()
+        except Exception:
+            with self._lock:
+                self.failures += 1
+            raise
+        self._record(wait_s, compute_s, stages)
+        return result
+
+    def _record(self, wait_s: float, compute_s: float, stages: Dict[str, float]) -> Dict[str, Any]:
+        record_stage(f"{self.name}.queue_wait", wait_s)
+        record_stage(f"{self.name}.compute", compute_s)
+        record_stages(stages)
+        timing = {"queue_wait_ms": wait_s * 1000.0, "compute_ms": compute_s * 1000.0, "stages": stages}
+        with self._lock:
+            self.completed += 1
+            self._wait_ms.append(timing["queue_wait_ms"])
+            self._compute_ms.append(timing["compute_ms"])
+        return timing
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            wait_ms = np.array(self._wait_ms)
+            compute_ms = np.array(self._compute_ms)
+            stats = {
+                "mode": self.mode,
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "timeout_s": self.timeout,
+                "pending": self.pending,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "failures": self.failures,
+            }
+        for key, values in (("queue_wait_ms", wait_ms), ("compute_ms", compute_ms)):
+            stats[key] = {
+                "p50": float(np.percentile(values, 50)) if len(values) else None,
+                "p99": float(np.percentile(values, 99)) if len(values) else None,
+            }
+        return stats
+
+
+def timing_headers(timing: Dict[str, float]) -> Dict[str, str]:
+    return {
+        "X-Queue-Wait-Ms": f"{timing['queue_wait_ms']:.1f}",
+        "X-Compute-Ms": f"{timing['compute_ms']:.1f}",
+    }
+
+
+# Interactive previews (/satin, /tatami, /applique): small tasks, short timeout
+light_lane = Lane(
+    "light",
+    workers=int(os.environ.get("EMBRO_LIGHT_WORKERS", max(1, _CPUS // 4))),
+    max_pending=int(os.environ.get("EMBRO_LIGHT_QUEUE", 64)),
+    timeout=float(os.environ.get("EMBRO_LIGHT_TIMEOUT", 10)),
+)
+
+# Segmentation and export: long CPU-bound jobs
+heavy_lane = Lane(
+    "heavy",
+    workers=int(os.environ.get("EMBRO_HEAVY_WORKERS", max(1, _CPUS - _CPUS // 4))),
+    max_pending=int(os.environ.get("EMBRO_HEAVY_QUEUE", 16)),
+    timeout=float(os.environ.get("EMBRO_HEAVY_TIMEOUT", 120)),
+)
@@ -1,72 +1,91 @@
 import pyembroidery
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple, Optional
 import io
+import json
+import asyncio
+import zipfile
+import time
 import numpy as np
 from shapely.geometry import Polygon, LineString, MultiLineString
 from app.core.stitch_engine import StitchEngine
+from app.core.stitch_buffer import StitchBuffer, COLOR_CHANGE
+from app.core import stitch_writer
+from app.core.cache import content_key, export_cache, layer_cache
+from app.core.production_stats import production_stats
+from app.core.density import density_report
+from app.core.knockdown import knockdown_layers, path_polygon
+from app.core.metrics import count_stitches, stage, timed
 
-def create_embroidery_file(layers: List[Dict[str, Any]], format: str = "dst") -> bytes:
+def buffer_to_pattern(
+    buffer: StitchBuffer,
+    threads: List[pyembroidery.EmbThread] = None,
+    truncate: bool = True
+) -> pyembroidery.EmbPattern:
     """
-    Convert a list of layers (with path coordinates) into a stitch file using CAD/CAM logic.
+    Hands a StitchBuffer to pyembroidery in one step instead of one add_stitch_absolute per point.
     """
     pattern = pyembroidery.EmbPattern()
+    for thread in threads or []:
+        pattern.add_thread(thread)
+    pattern.stitches = buffer.to_stitch_list(truncate)
+    return pattern
+
+def digitize_layer(layer: Dict[str, Any]) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Stitch generation for one layer: per closed path, (underlay, stitches) as Nx2 arrays.
+    Pure per-layer work, so layers can be digitized independently (and in parallel).
+    """
+    blocks = []
     
-    # Scale factor: Fabric.js usually 1px = 1 unit.
-    # Standard embroidery density is often defined in mm.
-    # Assuming 1 px = 0.264 mm (96 DPI) or user defined.
-    # For simplicity, we treat input coordinates as 1/10 mm units (standard embroidery unit).
-    # If input is pixels, we need a conversion factor. Let's assume input is 10x scaled (pixels).
-    SCALE_FACTOR = 1.0 
+    # Get Stitch Settings (defaults if missing)
+    settings = layer.get('settings', {})
+    density = settings.get('density', 4.0) # units (lines spacing)
+    angle = settings.get('angle', 45.0)
+    stitch_length = settings.get('stitchLength', 3.5)
+    pull_comp = settings.get('pullCompensation', 0.0)
+    use_underlay = settings.get('underlay', True)
     
-    for layer in layers:
-        pattern.color_change()
-        
-        # Get Stitch Settings (defaults if missing)
-        settings = layer.get('settings', {})
-        density = settings.get('density', 4.0) # units (lines spacing)
-        angle = settings.get('angle', 45.0)
-        stitch_length = settings.get('stitchLength', 3.5)
-        pull_comp = settings.get('pullCompensation', 0.0)
-        use_underlay = settings.get('underlay', True)
-        
-        raw_paths = layer.get('paths', [])
-        
-        for path in raw_paths:
-            if not path or len(path) < 3:
-                continue
-                
-            # Create Shapely Polygon from path
-            # Ensure path is closed
-            if path[0] != path[-1]:
-                path.append(path[0])
-                
-            poly = Polygon(path)
-            if not poly.is_valid:
-                poly = poly.buffer(0)
+    raw_paths = layer.get('paths', [])
+    # Optional holes per path (same order as 'paths'), so fills skip them
+    raw_holes = layer.get('holes') or []
+    
+    for p_idx, path in enumerate(raw_paths):
+        if not path or len(path) < 3:
+            continue
             
-            # 1. Pull Compensation
-            compensated_poly = StitchEngine.apply_pull_compensation(poly, pull_comp)
+        # Create Shapely Polygon from path
+        # Ensure path is closed
+        if path[0] != path[-1]:
+            path.append(path[0])
             
-            # 2. Underlay Generation (if enabled)
-            if use_underlay:
-                # Center Walk (Stabilizer)
-                # center_walk = StitchEngine.generate_center_walk(compensated_poly)
-                # for p in center_walk:
-                #     pattern.add_stitch_absolute(pyembroidery.STITCH, int(p[0]), int(p[1]))
+        holes = raw_holes[p_idx] if p_idx < len(raw_holes) else []
+        poly = path_polygon(path, holes)
+        
+        # 1. Pull Compensation
+        with stage("pull_compensation"):
+            compensated_poly = StitchEngine.apply_pull_compensation(poly, pull_comp)
+        
+        # 2. Underlay Generation (if enabled)
+        underlay = np.empty((0, 2))
+        if use_underlay:
+            with stage("underlay"):
+                # Center Walk (Stabilizer) along the medial axis
+                center_walk = StitchEngine.generate_center_walk(compensated_poly)
                 
-                # Edge Walk (Contour)
-                edge_walk = StitchEngine.generate_edge_walk(compensated_poly, offset_mm=2.0) # 2 units offset
-                if edge_walk:
-                    pattern.jump(int(edge_walk[0][0]), int(edge_walk[0][1]))
-                    for p in edge_walk:
-                        pattern.add_stitch_absolute(pyembroidery.STITCH, int(p[0]), int(p[1]))
-            
-            # 3. Fill / Stitch Generation based on Style
-            style = settings.get('style', 'tatami').lower()
-            stroke_only = layer.get('isStroke', False) # Frontend can flag if it's just a line
-            
-            stitches = []
-            
+                # Edge Walk (Contour), starting next to where the center walk ends
+                edge_walk = StitchEngine.generate_edge_walk(
+                    compensated_poly, offset_mm=2.0, # 2 units offset
+                    start=center_walk[-1] if len(center_walk) else None
+                )
+                underlay = np.concatenate([center_walk, edge_walk])
+        
+        # 3. Fill / Stitch Generation based on Style
+        style = settings.get('style', 'tatami').lower()
+        stroke_only = layer.get('isStroke', False) # Frontend can flag if it's just a line
+        
+        stitches = np.empty((0, 2))
+        
+        with stage("fill"):
             if stroke_only or style == 'bean':
                 # Treat as line contour
                 if style == 'bean':
@@ -75,15 +94,16 @@ def create_embroidery_file(layers: List[Dict[str, Any]], format: str = "dst") ->
                    if isinstance(boundary, LineString):
                        stitches = StitchEngine.generate_bean_stitch(boundary)
                    elif isinstance(boundary, MultiLineString):
-                       for geom in boundary.geoms:
-                           stitches.extend(StitchEngine.generate_bean_stitch(geom))
+                       stitches = np.concatenate(
+                           [stitches] + [StitchEngine.generate_bean_stitch(geom) for geom in boundary.geoms]
+                       )
                 else:
                     # Simple running stitch (Edge Walk essentially)
                     stitches = StitchEngine.generate_edge_walk(compensated_poly, offset_mm=0)
-            
+        
             elif style == 'satin':
                 stitches = StitchEngine.generate_satin_column(compensated_poly, density=density)
-                
+            
             else: # Default Tatami
                 offset = settings.get('offset', 0.5) # Default brick pattern
                 stitches = StitchEngine.generate_tatami_fill(
@@ -91,22 +111,182 @@ def create_embroidery_file(layers: List[Dict[str, Any]], format: str = "dst") ->
                     density=density, 
                     angle_deg=angle, 
                     stitch_length=stitch_length,
-                    offset=offset
+                    offset=offset,
+                    # Start where the underlay ends: a short connector instead of a trim
+                    start=underlay[-1] if len(underlay) else None
                 )
+        
+        blocks.append((underlay, stitches))
+    
+    return blocks
+
+def _ring(points) -> List[List[float]]:
+    return [[float(x), float(y)] for x, y in points]
+
+def canonical_geometry(layer: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    A layer's paths and holes as the digitizers read them: float coordinates and one
+    hole list per path (missing or short "holes" padded with []). JSON and wire bodies
+    (integer contours, no "holes" key) of one design hash the same through it.
+    """
+    paths = layer.get('paths') or []
+    holes = layer.get('holes') or []
+    return {
+        "paths": [_ring(path) for path in paths],
+        "holes": [[_ring(hole) for hole in (holes[i] if i < len(holes) and holes[i] else [])] for i in range(len(paths))],
+    }
+
+def layer_key(layer: Dict[str, Any]) -> str:
+    """
+    Hash of everything digitize_layer reads (geometry, holes, stroke flag, settings);
+    color and naming changes keep the key, so the layer's stitches are reused.
+    """
+    payload = json.dumps({
+        **canonical_geometry(layer),
+        "isStroke": layer.get('isStroke', False),
+        "settings": layer.get('settings', {}),
+    }, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return content_key(payload, version=EXPORT_CACHE_VERSION)
+
+def _store_layer(key: str, blocks: List[Tuple[np.ndarray, np.ndarray]]):
+    # Cached blocks are shared by later exports: freeze them
+    for underlay, stitches in blocks:
+        underlay.flags.writeable = False
+        stitches.flags.writeable = False
+    layer_cache.put(key, blocks, sum(u.nbytes + s.nbytes for u, s in blocks))
+
+def digitize_layer_cached(layer: Dict[str, Any]) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    digitize_layer memoized by layer_key (in this process's layer cache).
+    """
+    key = layer_key(layer)
+    blocks = layer_cache.get(key)
+    if blocks is None:
+        blocks = digitize_layer(layer)
+        _store_layer(key, blocks)
+    return blocks
+
+async def digitize_layers(lane, layers: List[Dict[str, Any]], on_layer=None) -> Tuple[List[List[Tuple[np.ndarray, np.ndarray]]], Dict[str, Any]]:
+    """
+    Digitizes the layers of a design, regenerating only those missing from the layer cache:
+    misses run on `lane` (app.core.executor.Lane) in parallel, at most one per worker,
+    identical layers once. The cache lives in the serving process.
+    `on_layer(done, total)` is called as layers become available.
+    Returns (blocks per layer, {"layers_reused", "queue_wait_ms", "compute_ms"}).
+    """
+    keys = [layer_key(layer) for layer in layers]
+    digitized = [layer_cache.get(key) for key in keys]
+    pending: Dict[str, List[int]] = {}
+    for i, blocks in enumerate(digitized):
+        if blocks is None:
+            pending.setdefault(keys[i], []).append(i)
+
+    total = len(layers)
+    done = total - sum(len(indices) for indices in pending.values())
+    stats = {"layers_reused": done, "queue_wait_ms": 0.0, "compute_ms": 0.0}
+    if on_layer is not None:
+        on_layer(done, total)
+
+    slots = asyncio.Semaphore(lane.workers)
+
+    async def digitize(key: str, indices: List[int]):
+        nonlocal done
+        async with slots:
+            blocks, timing = await lane.run_timed(digitize_layer, layers[indices[0]])
+        _store_layer(key, blocks)
+        stats["queue_wait_ms"] = max(stats["queue_wait_ms"], timing["queue_wait_ms"])
+        stats["compute_ms"] += timing["compute_ms"]
+        for i in indices:
+            digitized[i] = blocks
+        done += len(indices)
+        if on_layer is not None:
+            on_layer(done, total)
+
+    await asyncio.gather(*(digitize(key, indices) for key, indices in pending.items()))
+    return digitized, stats
+
+async def digitize_design(
+    lane,
+    layers: List[Dict[str, Any]],
+    knockdown: Optional[Dict[str, Any]] = None,
+    on_layer=None
+) -> Tuple[List[List[Tuple[np.ndarray, np.ndarray]]], Dict[str, Any], Optional[Dict[str, Any]]]:
+    """
+    digitize_layers with the optional knockdown pre-pass (app.core.knockdown, options
+    {"margin": units or None}) on `lane`. The original versions of the layers it changed
+    are digitized too (through the layer cache), so the savings can be reported.
+    Returns (blocks per knocked-down layer, digitize_layers stats, None or
+    {"stats": knockdown stats, "original": {layer index: original blocks}}).
+    """
+    if knockdown is None:
+        digitized, stats = await digitize_layers(lane, layers, on_layer)
+        return digitized, stats, None
+    (knocked, knockdown_stats), timing = await lane.run_timed(knockdown_layers, layers, knockdown.get("margin"))
+    changed = knockdown_stats["layers_changed"]
+    digitized, stats = await digitize_layers(lane, knocked + [layers[i] for i in changed], on_layer)
+    stats["queue_wait_ms"] += timing["queue_wait_ms"]
+    stats["compute_ms"] += timing["compute_ms"]
+    original = dict(zip(changed, digitized[len(layers):]))
+    return digitized[:len(layers)], stats, {"stats": knockdown_stats, "original": original}
+
+async def iter_digitized(lane, layers: List[Dict[str, Any]]):
+    """
+    Async iterator of (index, blocks) over the layers in order, each yielded as soon as it
+    and every layer before it are digitized. Misses are scheduled on `lane` up front (at
+    most one per worker, identical layers once) and cached like in digitize_layers;
+    whatever is still running when the iteration stops is cancelled.
+    """
+    keys = [layer_key(layer) for layer in layers]
+    slots = asyncio.Semaphore(lane.workers)
+
+    async def digitize(key: str, layer: Dict[str, Any]):
+        async with slots:
+            blocks = await lane.run(digitize_layer, layer)
+        _store_layer(key, blocks)
+        return blocks
+
+    ready: Dict[str, List[Tuple[np.ndarray, np.ndarray]]] = {}
+    tasks: Dict[str, asyncio.Future] = {}
+    for key, layer in zip(keys, layers):
+        if key in ready or key in tasks:
+            continue
+        blocks = layer_cache.get(key)
+        if blocks is not None:
+            ready[key] = blocks
+        else:
+            tasks[key] = asyncio.ensure_future(digitize(key, layer))
+    try:
+        for i, key in enumerate(keys):
+            yield i, ready[key] if key in ready else await tasks[key]
+    finally:
+        for task in tasks.values():
+            task.cancel()
+
+@timed("assemble")
+def assemble_buffer(digitized_layers: List[List[Tuple[np.ndarray, np.ndarray]]]) -> StitchBuffer:
+    """
+    Joins digitized layers into one StitchBuffer: color change per layer, underlay,
+    then each fill with connector / trim logic and tie-in / tie-out stitches.
+    """
+    buffer = StitchBuffer()
+    
+    for blocks in digitized_layers:
+        buffer.color_change()
+        
+        for underlay, stitches in blocks:
+            if len(underlay):
+                buffer.jump(underlay[0][0], underlay[0][1])
+                buffer.extend(underlay)
             
-            if stitches:
-                # Expert Rule: Tie-In / Tie-Out
-                stitches = StitchEngine.add_tie_stitches(stitches)
-                
+            if len(stitches):
                 # Expert Rule: Auto-Trim / Connector Logic
-                if pattern.stitches:
-                    last_x = pattern.stitches[-1][0]
-                    last_y = pattern.stitches[-1][1]
+                if len(buffer):
+                    last = buffer.last_point().astype(np.float64)
                     curr_x = stitches[0][0]
                     curr_y = stitches[0][1]
-                    
-                    dist = np.sqrt((curr_x - last_x)**2 + (curr_y - last_y)**2)
-                    
+                
+                    dist = np.sqrt((curr_x - last[0])**2 + (curr_y - last[1])**2)
+                
                     # 20 units = 2.0 mm (assuming 1 unit = 0.1mm) 
                     # If inputs are formatted correctly. 
                     # Earlier we said 1px = 1 unit. 
@@ -114,24 +294,28 @@ def create_embroidery_file(layers: List[Dict[str, Any]], format: str = "dst") ->
                         # Interpolate simple line
                         steps = int(dist / 2.0) # 2.0mm stitch length
                         if steps > 0:
-                            for t in np.linspace(0, 1, steps + 1)[1:]:
-                                ix = last_x + (curr_x - last_x) * t
-                                iy = last_y + (curr_y - last_y) * t
-                                pattern.add_stitch_absolute(pyembroidery.STITCH, int(ix), int(iy))
+                            t = np.linspace(0, 1, steps + 1)[1:, None]
+                            buffer.extend(last + (stitches[0] - last) * t)
                     else: # Long jump -> Trim
-                         pattern.trim()
-                         pattern.jump(int(curr_x), int(curr_y))
+                         buffer.trim()
+                         buffer.jump(curr_x, curr_y)
                 else:
-                    pattern.jump(int(stitches[0][0]), int(stitches[0][1]))
+                    buffer.jump(stitches[0][0], stitches[0][1])
 
-                for p in stitches:
-                    pattern.add_stitch_absolute(pyembroidery.STITCH, int(p[0]), int(p[1]))
+                # Expert Rule: Tie-In / Tie-Out (written straight into the buffer)
+                StitchEngine.append_tie_stitches(buffer, stitches)
 
+    return buffer
+
+def thread_usage(buffer: StitchBuffer) -> Tuple[float, float]:
+    """
+    (top, bobbin) thread consumption in meters.
+    """
     # Expert Rule: Thread Consumption Calculation
     # Calculate length of all STITCH commands (ignore JUMP/TRIM for thread usage, mostly)
     total_length_mm = 0
-    if pattern.stitches:
-        arr = np.array([s[:2] for s in pattern.stitches if s[2] == pyembroidery.STITCH])
+    if len(buffer):
+        arr = np.trunc(buffer.stitch_points().astype(np.float64))
         if len(arr) > 1:
             diffs = np.diff(arr, axis=0)
             dists = np.sqrt(np.sum(diffs**2, axis=1))
@@ -141,8 +325,26 @@ def create_embroidery_file(layers: List[Dict[str, Any]], format: str = "dst") ->
 
     top_thread_m = (total_length_mm * 1.05) / 1000.0 # +5% slack
     bobbin_thread_m = (total_length_mm * 0.70) / 1000.0 # ~70% of top
+    return top_thread_m, bobbin_thread_m
 
-    # Write to buffer
+@timed("encode")
+def encode_buffer(
+    buffer: StitchBuffer,
+    format: str = "dst",
+    threads: List[pyembroidery.EmbThread] = None,
+    truncate: bool = True
+) -> bytes:
+    """
+    Writes a StitchBuffer: DST / EXP with the native vectorized writer (same bytes as
+    pyembroidery), other formats, or streams it cannot handle, through pyembroidery.
+    """
+    format = format.lower()
+    if format in stitch_writer.NATIVE_FORMATS and stitch_writer.supports(buffer.commands):
+        coords = np.trunc(buffer.coords) if truncate else buffer.coords
+        return stitch_writer.encode_stitches(coords.astype(np.float64), buffer.commands, format)
+    return encode_pattern(buffer_to_pattern(buffer, threads, truncate), format)
+
+def encode_pattern(pattern: pyembroidery.EmbPattern, format: str = "dst") -> bytes:
     stream = io.BytesIO()
     
     if format.lower() == 'dst':
@@ -151,16 +353,363 @@ def create_embroidery_file(layers: List[Dict[str, Any]], format: str = "dst") ->
         pyembroidery.write_pes(pattern, stream)
     elif format.lower() == 'jef':
         pyembroidery.write_jef(pattern, stream)
+    elif format.lower() == 'exp':
+        pyembroidery.write_exp(pattern, stream)
     else:
         raise ValueError(f"Unsupported format: {format}")
-        
-    # Return both bytes and stats (Handling this by appending stats to a new format or handled by caller)
-    # Since this function signature returns 'bytes', we can't easily return stats without breaking contract.
-    # Hack: If caller expects JSON, handle it there. 
-    # For now, we print it for verification or could smuggle it if needed.
-    # Ideally, returns object { content: bytes, meta: dict }
-    # Let's keep returning bytes but log execution.
-    print(f"Stats: Top={top_thread_m:.2f}m, Bobbin={bobbin_thread_m:.2f}m")
     
     return stream.getvalue()
 
+def _layer_colors(layers: List[Dict[str, Any]]) -> List[str]:
+    return [layer.get('color', '#000000') for layer in layers]
+
+def assembled_stats(
+    buffer: StitchBuffer,
+    colors: List[str],
+    machine: Optional[Dict[str, float]] = None,
+    bins_mm: Optional[List[float]] = None,
+    density: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Production stats of an assemble_buffer result (every layer starts with its color change).
+    """
+    layer_starts = np.flatnonzero(buffer.commands == COLOR_CHANGE)
+    return with_density(production_stats(buffer, layer_starts, colors, machine, bins_mm), buffer, density)
+
+def with_density(stats: Dict[str, Any], buffer: StitchBuffer, density: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Adds the stitch density report (app.core.density) to production stats; `density`
+    holds density_report options (cell_mm, threshold, heatmap).
+    """
+    stats["density"] = density_report(buffer, **(density or {}))
+    return stats
+
+def knockdown_report(
+    knockdown: Dict[str, Any],
+    stats: Dict[str, Any],
+    digitized_layers: List[List[Tuple[np.ndarray, np.ndarray]]],
+    colors: List[str]
+) -> Dict[str, Any]:
+    """
+    Knockdown stats (see digitize_design) plus what it saved: the production counts,
+    thread and sew time of the design assembled with the original layers minus `stats`.
+    """
+    original = knockdown["original"]
+    buffer = assemble_buffer([original.get(i, blocks) for i, blocks in enumerate(digitized_layers)])
+    before = production_stats(buffer, np.flatnonzero(buffer.commands == COLOR_CHANGE), colors)
+    saved = {key: before["counts"][key] - stats["counts"][key] for key in ("stitches", "jumps", "trims")}
+    saved["top_thread_m"] = before["top_thread_m"] - stats["top_thread_m"]
+    saved["sew_time_s"] = before["sew_time"]["total_s"] - stats["sew_time"]["total_s"]
+    return {**knockdown["stats"], "saved": saved}
+
+def encode_digitized(
+    digitized_layers: List[List[Tuple[np.ndarray, np.ndarray]]],
+    format: str = "dst",
+    colors: Optional[List[str]] = None,
+    knockdown: Optional[Dict[str, Any]] = None
+) -> Tuple[bytes, Dict[str, Any]]:
+    """
+    Assembly + encoding stage of create_embroidery_file: (file bytes, thread usage + production stats).
+    With `knockdown` (from digitize_design) the stats report what it saved.
+    """
+    buffer = assemble_buffer(digitized_layers)
+    top_thread_m, bobbin_thread_m = thread_usage(buffer)
+    stats = assembled_stats(buffer, colors or [])
+    if knockdown is not None:
+        stats["knockdown"] = knockdown_report(knockdown, stats, digitized_layers, colors or [])
+    file_bytes = encode_buffer(buffer, format)
+    return file_bytes, {"top_thread_m": top_thread_m, "bobbin_thread_m": bobbin_thread_m, "production": stats}
+
+def create_embroidery_file(layers: List[Dict[str, Any]], format: str = "dst", knockdown: Optional[Dict[str, Any]] = None) -> bytes:
+    """
+    Convert a list of layers (with path coordinates) into a stitch file using CAD/CAM logic.
+    With `knockdown` ({"margin": units or None}) fills hidden under later layers are removed first.
+    """
+    # Scale factor: Fabric.js usually 1px = 1 unit.
+    # Standard embroidery density is often defined in mm.
+    # Assuming 1 px = 0.264 mm (96 DPI) or user defined.
+    # For simplicity, we treat input coordinates as 1/10 mm units (standard embroidery unit).
+    # If input is pixels, we need a conversion factor. Let's assume input is 10x scaled (pixels).
+    SCALE_FACTOR = 1.0 
+    
+    # Digitize every layer (unchanged layers come from the layer cache), then assemble and write to stream.
+    # Thread usage and production stats come with export_fill_pattern (export meta, /analyze).
+    file_bytes, _ = export_fill_pattern(layers, format, knockdown)
+    return file_bytes
+
+def branch_layers(layers: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Branching stage of /export: (reordered layers with connectors, branching stats).
+    """
+    # Imported here: app.stitch_engine pulls in the whole industrial engine
+    from app.stitch_engine import optimize_branching
+
+    # This reorders objects to minimize jumps and adds travel runs if implemented
+    branching_stats = {}
+    optimized_layers = optimize_branching(layers, stats=branching_stats)
+    return optimized_layers, branching_stats
+
+@timed("assemble")
+def build_run_buffer(optimized_layers: List[Dict[str, Any]]) -> Tuple[StitchBuffer, List[pyembroidery.EmbThread], List[int]]:
+    """
+    /export stitch buffer: every path as run stitches, one thread per layer.
+    Returns (buffer, threads, buffer index where each layer starts).
+    """
+    buffer = StitchBuffer()
+    threads = []
+    layer_starts = []
+    
+    for layer in optimized_layers:
+        layer_starts.append(len(buffer))
+        # We need actual stitch points. 
+        # If 'paths' contains vector points, we must digitize them.
+        # If frontend sends 'generatedStitches' (from satin), use them.
+        # For this MVP, let's assume 'paths' are either run stitches or we just jump between them.
+        # REALITY CHECK: Frontend sends 'paths' which are contours. 
+        # We should probably run 'Satin' on them if type is satin, or 'Run' if type is run.
+        # But for simplicity, we treat all points as Run stitches for now unless specified.
+        
+        # Color change for new layer
+        # Parse hex color layer['color'] -> RGB
+        try:
+            h = layer.get('color', '#000000').lstrip('#')
+            rgb = tuple(int(h[i:i+2], 16) for i in (0, 2, 4))
+            threads.append(pyembroidery.EmbThread(rgb[0], rgb[1], rgb[2]))
+        except:
+             threads.append(pyembroidery.EmbThread(0, 0, 0))
+             
+        # Add stitches
+        paths = layer.get('paths', [])
+        for p_idx, path in enumerate(paths):
+            if not path: continue
+            
+            # Jump to start of path
+            buffer.jump(path[0][0], path[0][1])
+            
+            # For now, treat as RUN stitch (simple line)
+            buffer.extend(path)
+                
+            # If closed shape? we don't know, assuming path is just points.
+            
+    return buffer, threads, layer_starts
+
+def encode_run_layers(optimized_layers: List[Dict[str, Any]], format: str = "dst") -> Tuple[bytes, Dict[str, Any]]:
+    """
+    Encoding stage of /export: (file bytes, production stats).
+    """
+    buffer, threads, layer_starts = build_run_buffer(optimized_layers)
+    stats = with_density(production_stats(buffer, layer_starts, _layer_colors(optimized_layers)), buffer)
+    
+    # Save to stream (unknown formats fall back to DST)
+    if format.lower() not in ('dst', 'pes', 'exp'):
+        format = 'dst'
+    return encode_buffer(buffer, format, threads, truncate=False), stats
+
+def export_run_pattern(layers: List[Dict[str, Any]], format: str = "dst") -> Tuple[bytes, Dict[str, Any]]:
+    """
+    /export pipeline: branching order, then every path as run stitches with one thread per layer.
+    Returns (file bytes, {"branching", "production"} stats). Lives here (not in the handler) so it can run in a worker.
+    """
+    # 1. Optimize Order (Branching)
+    optimized_layers, branching_stats = branch_layers(layers)
+    file_bytes, stats = encode_run_layers(optimized_layers, format)
+    return file_bytes, {"branching": branching_stats, "production": stats}
+
+def export_fill_pattern(
+    layers: List[Dict[str, Any]],
+    format: str = "dst",
+    knockdown: Optional[Dict[str, Any]] = None
+) -> Tuple[bytes, Dict[str, Any]]:
+    """
+    create_embroidery_file pipeline returning (file bytes, thread usage + production stats).
+    """
+    if knockdown is None:
+        return encode_digitized([digitize_layer_cached(layer) for layer in layers], format, _layer_colors(layers))
+    knocked, knockdown_stats = knockdown_layers(layers, knockdown.get("margin"))
+    original = {i: digitize_layer_cached(layers[i]) for i in knockdown_stats["layers_changed"]}
+    return encode_digitized(
+        [digitize_layer_cached(layer) for layer in knocked], format, _layer_colors(layers),
+        {"stats": knockdown_stats, "original": original}
+    )
+
+# pipeline name -> worker function (layers, format) -> (file bytes, meta)
+EXPORT_PIPELINES = {
+    # /export: branching order + run stitches, meta = branching + production stats
+    "run": export_run_pattern,
+    # /export-embroidery: per-layer fill / satin / underlay digitizing, meta = thread usage + production stats
+    "fill": export_fill_pattern,
+}
+
+# Part of every export cache key: bump whenever digitizing or the writers change their output
+EXPORT_CACHE_VERSION = "5"
+
+_export_counters = {"hits": 0, "misses": 0, "bytes_saved": 0, "compute_ms_saved": 0.0}
+
+def export_key(pipeline: str, layers: List[Dict[str, Any]], format: str, knockdown: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Canonical design hash: layers (sorted-key JSON, so key order and whitespace do not
+    matter; geometry through canonical_geometry, so neither does int vs float or a missing
+    "holes"), pipeline, format, knockdown options and the cache version.
+    """
+    canonical = [{**layer, **canonical_geometry(layer)} for layer in layers]
+    payload = json.dumps(canonical, sort_keys=True, separators=(",", ":"), default=str).encode()
+    params = {"pipeline": pipeline, "format": format.lower(), "version": EXPORT_CACHE_VERSION}
+    if knockdown is not None:
+        params["knockdown"] = knockdown
+    return content_key(payload, **params)
+
+def export_etag(key: str, variant: str = "") -> str:
+    """Strong ETag of an export; `variant` tells representations of one design apart (e.g. "zip")."""
+    return f'"{key[:40]}-{variant}"' if variant else f'"{key[:40]}"'
+
+def cached_export(key: str) -> Optional[Dict[str, Any]]:
+    """
+    Cached export entry {"content", "meta", "etag", "compute_ms"} or None; counts hit / miss.
+    """
+    entry = export_cache.get(key)
+    if entry is None:
+        _export_counters["misses"] += 1
+        return None
+    _export_counters["hits"] += 1
+    _export_counters["bytes_saved"] += len(entry["content"])
+    _export_counters["compute_ms_saved"] += entry["compute_ms"]
+    return entry
+
+def store_export(key: str, content: bytes, meta: Dict[str, Any], compute_ms: float) -> Dict[str, Any]:
+    entry = {"content": content, "meta": meta, "etag": export_etag(key), "compute_ms": compute_ms}
+    export_cache.put(key, entry)
+    return entry
+
+async def run_export(
+    lane,
+    pipeline: str,
+    layers: List[Dict[str, Any]],
+    format: str = "dst",
+    knockdown: Optional[Dict[str, Any]] = None
+) -> Tuple[Dict[str, Any], Optional[Dict[str, float]]]:
+    """
+    Export through the cache: a hit returns the stored entry, a miss runs the pipeline on
+    `lane` (app.core.executor.Lane) and stores it. Like run_segmentation, the cache lives
+    in the serving process. `knockdown` (fill pipeline only) see digitize_design.
+    Returns (entry, timing) where timing is None for cache hits.
+    """
+    if knockdown is not None and pipeline != "fill":
+        raise ValueError("Knockdown applies to the fill pipeline only")
+    key = export_key(pipeline, layers, format, knockdown)
+    entry = cached_export(key)
+    if entry is not None:
+        return entry, None
+    t0 = time.perf_counter()
+    if pipeline == "fill":
+        # Per-layer memo: only changed layers are digitized again, then assemble + encode
+        digitized, layer_stats, knocked = await digitize_design(lane, layers, knockdown)
+        (content, meta), timing = await lane.run_timed(encode_digitized, digitized, format, _layer_colors(layers), knocked)
+        meta = {**meta, "layers_reused": layer_stats["layers_reused"]}
+        timing = {
+            "queue_wait_ms": layer_stats["queue_wait_ms"] + timing["queue_wait_ms"],
+            "compute_ms": layer_stats["compute_ms"] + timing["compute_ms"],
+        }
+    else:
+        (content, meta), timing = await lane.run_timed(EXPORT_PIPELINES[pipeline], layers, format)
+    count_stitches(f"export.{pipeline}", meta["production"]["counts"]["stitches"])
+    entry = store_export(key, content, meta, (time.perf_counter() - t0) * 1000.0)
+    return entry, timing
+
+def export_cache_stats() -> Dict[str, Any]:
+    lookups = _export_counters["hits"] + _export_counters["misses"]
+    return {
+        **_export_counters,
+        "hit_rate": _export_counters["hits"] / lookups if lookups else None,
+        "tiers": export_cache.stats(),
+    }
+
+def analyze_digitized(
+    digitized_layers: List[List[Tuple[np.ndarray, np.ndarray]]],
+    colors: List[str],
+    machine: Optional[Dict[str, float]] = None,
+    bins_mm: Optional[List[float]] = None,
+    density: Optional[Dict[str, Any]] = None,
+    knockdown: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    /analyze for the fill pipeline: assembles already digitized layers, no encoding.
+    """
+    stats = assembled_stats(assemble_buffer(digitized_layers), colors, machine, bins_mm, density)
+    if knockdown is not None:
+        stats["knockdown"] = knockdown_report(knockdown, stats, digitized_layers, colors)
+    return stats
+
+def analyze_run_layers(
+    layers: List[Dict[str, Any]],
+    machine: Optional[Dict[str, float]] = None,
+    bins_mm: Optional[List[float]] = None,
+    density: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    /analyze for the run pipeline: branching + run-stitch buffer, no encoding.
+    """
+    optimized_layers, branching_stats = branch_layers(layers)
+    buffer, _, layer_starts = build_run_buffer(optimized_layers)
+    stats = production_stats(buffer, layer_starts, _layer_colors(optimized_layers), machine, bins_mm)
+    return {**with_density(stats, buffer, density), "branching": branching_stats}
+
+async def analyze_design(
+    lane,
+    pipeline: str,
+    layers: List[Dict[str, Any]],
+    machine: Optional[Dict[str, float]] = None,
+    bins_mm: Optional[List[float]] = None,
+    density: Optional[Dict[str, Any]] = None,
+    knockdown: Optional[Dict[str, Any]] = None
+) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """
+    Production stats of a design without encoding a file. The fill pipeline reuses the
+    layer cache, so analyzing an exported (or partially edited) design does not re-digitize.
+    `density` holds the density report options (see with_density), `knockdown` the
+    fill-only knockdown options (see digitize_design). Returns (stats, timing).
+    """
+    if knockdown is not None and pipeline != "fill":
+        raise ValueError("Knockdown applies to the fill pipeline only")
+    if pipeline == "fill":
+        digitized, layer_stats, knocked = await digitize_design(lane, layers, knockdown)
+        stats, timing = await lane.run_timed(
+            analyze_digitized, digitized, _layer_colors(layers), machine, bins_mm, density, knocked
+        )
+        stats["layers_reused"] = layer_stats["layers_reused"]
+        return stats, {
+            "queue_wait_ms": layer_stats["queue_wait_ms"] + timing["queue_wait_ms"],
+            "compute_ms": layer_stats["compute_ms"] + timing["compute_ms"],
+        }
+    return await lane.run_timed(analyze_run_layers, layers, machine, bins_mm, density)
+
+def production_headers(stats: Dict[str, Any]) -> Dict[str, str]:
+    """Summary of the production stats as response headers."""
+    headers = {
+        "X-Stitch-Count": str(stats["counts"]["stitches"]),
+        "X-Trim-Count": str(stats["counts"]["trims"]),
+        "X-Color-Change-Count": str(stats["counts"]["color_changes"]),
+        "X-Sew-Time-S": f"{stats['sew_time']['total_s']:.1f}",
+    }
+    if "density" in stats:
+        headers.update(density_headers(stats["density"]))
+    if "knockdown" in stats:
+        headers["X-Knockdown-Saved-Stitches"] = str(stats["knockdown"]["saved"]["stitches"])
+        headers["X-Knockdown-Saved-S"] = f"{stats['knockdown']['saved']['sew_time_s']:.1f}"
+    return headers
+
+def density_headers(density: Dict[str, Any]) -> Dict[str, str]:
+    """Summary of a density report as response headers."""
+    return {
+        "X-Density-Peak": f"{density['peak']:.2f}",
+        "X-Density-Hotspots": str(len(density["hotspots"])),
+    }
+
+def sidecar_zip(content: bytes, filename: str, meta: Dict[str, Any]) -> bytes:
+    """
+    Stitch file plus its metadata sidecar (same name, .json) in one zip archive.
+    """
+    stream = io.BytesIO()
+    with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(filename, content)
+        archive.writestr(filename.rsplit(".", 1)[0] + ".json", json.dumps(meta, indent=2))
+    return stream.getvalue()
@@ -0,0 +1,334 @@
+import bisect
+import heapq
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import shapely
+
+from app.core.polyline import cumulative_lengths
+
+# Fill sequencing for the tatami generators. A row of a concave shape (or of a shape
+# with holes) crosses it in several spans; sewing the spans row by row stitches across
+# every gap. Instead the spans are grouped into sections (chains of overlapping spans,
+# one per row), each section is filled as one serpentine, and consecutive sections are
+# joined by travel runs that stay inside the shape: along section centerlines and
+# through the "portals" where overlapping spans of two sections meet. Everything works
+# in the rotated frame where rows are horizontal (see scanline.scanline_segments).
+
+# Sideways shift (in row spacings) of either span end up to which a section continues
+# through a split or merge; a wider one would turn the serpentine across the notch
+MAX_TURN_ROWS = 4.0
+
+# Travel run stitch length in embroidery units (0.1 mm): a regular running stitch,
+# covered by rows sewn later or lying on top of same-color fill
+TRAVEL_STITCH_LENGTH = 30.0
+
+Node = Tuple[int, int]  # (section, position of a span within the section)
+
+
+def span_sections(
+    rows: np.ndarray,
+    seg_start: np.ndarray,
+    seg_end: np.ndarray,
+    max_turn: float = np.inf,
+    touch: float = 0.0
+) -> Tuple[np.ndarray, List[Tuple[int, int]]]:
+    """
+    Section id per span (spans sorted by row, then x) and the links between sections:
+    pairs (a, b) of overlapping spans in consecutive rows that are not consecutive in
+    one section. Spans closer than `touch` count as overlapping (spike tips, steep thin
+    strokes). Where a row splits or merges, the pair with the widest overlap keeps its
+    section going, provided neither span end shifts by more than `max_turn`. A single
+    overlap is cut too where a span end shifts past `max_turn` at a reflex corner of the
+    outline (see below), so no turn stitch runs along a notch edge.
+    """
+    n = len(rows)
+    if n == 0:
+        return np.empty(0, dtype=np.intp), []
+
+    # Spans of all rows on one increasing axis, so overlaps with the next / previous
+    # row are two searchsorted calls for every span at once
+    base = seg_start.min()
+    stride = seg_end.max() - base + 2.0 * touch + 1.0
+    offset = rows * stride - base
+    key_start, key_end = seg_start + offset, seg_end + offset
+
+    def overlapping(delta: int) -> Tuple[np.ndarray, np.ndarray]:
+        lo = np.searchsorted(key_end, key_start + delta * stride - touch, side="right")
+        hi = np.searchsorted(key_start, key_end + delta * stride + touch, side="left")
+        return lo, np.maximum(hi - lo, 0)
+
+    down_lo, down_n = overlapping(1)
+    _, up_n = overlapping(-1)
+
+    # One overlap on both sides: the section simply continues (most spans), except at
+    # a reflex corner: a span end shifting past the turn limit where the outline bends
+    # inward, i.e. its outward shift grows by more than the turn limit from the row
+    # pair before or into the one after (a notch edge along the rows, an L-shaped
+    # step). Along a convex outline outward shifts only shrink, so round and slanted
+    # tips still turn within the section
+    continues = down_n == 1
+    continues[continues] = up_n[down_lo[continues]] == 1
+    a = np.flatnonzero(continues)
+    b = down_lo[a]
+    outward = np.column_stack([seg_start[a] - seg_start[b], seg_end[b] - seg_end[a]])
+    link_from = np.full(n, -1, dtype=np.intp)
+    link_from[a] = np.arange(len(a))
+    link_into = np.full(n, -1, dtype=np.intp)
+    link_into[b] = np.arange(len(a))
+    # Same end in the row pair before / after each link (index -1: none, NaN never bends)
+    padded = np.vstack([outward, np.full((1, 2), np.nan)])
+    bends = (outward - padded[link_into[a]] > max_turn) | (padded[link_from[b]] - outward > max_turn)
+    step = (np.abs(outward) > max_turn) & bends
+    continues[a[step.any(axis=1)]] = False
+    succ = np.where(continues, down_lo, -1)
+    pred = np.full(n, -1, dtype=np.intp)
+    pred[down_lo[continues]] = np.flatnonzero(continues)
+
+    # Splits and merges: widest overlaps first, at most one successor / predecessor each
+    pairs = sorted(
+        (-(min(seg_end[a], seg_end[b]) - max(seg_start[a], seg_start[b])), int(a), int(b))
+        for a in np.flatnonzero((down_n > 0) & ~continues)
+        for b in range(down_lo[a], down_lo[a] + down_n[a])
+    )
+    for _, a, b in pairs:
+        turn = max(abs(seg_start[a] - seg_start[b]), abs(seg_end[a] - seg_end[b]))
+        if succ[a] < 0 and pred[b] < 0 and turn <= max_turn:
+            succ[a], pred[b] = b, a
+
+    # Chain roots by pointer jumping; sections are numbered in order of their first span
+    root = np.where(pred >= 0, pred, np.arange(n))
+    while True:
+        jumped = root[root]
+        if np.array_equal(jumped, root):
+            break
+        root = jumped
+    heads = np.flatnonzero(pred < 0)
+    section = np.searchsorted(heads, root)
+
+    links = [(a, b) for _, a, b in pairs if pred[b] != a]
+    return section, links
+
+
+def _travel_points(route: List[np.ndarray], spacing: float, tolerance: float) -> np.ndarray:
+    """
+    Run stitches along the route, both end points excluded: the corners of the route
+    (simplified within `tolerance`) are kept so no stitch cuts a bend, straight
+    stretches are split every ~`spacing`.
+    """
+    coords = np.vstack(route)
+    coords = shapely.get_coordinates(shapely.simplify(shapely.linestrings(coords), tolerance))
+    steps = np.diff(coords, axis=0)
+    lengths = np.hypot(steps[:, 0], steps[:, 1])
+    keep = lengths > 0
+    coords, steps, lengths = coords[:-1][keep], steps[keep], lengths[keep]
+    pieces = np.ceil(lengths / spacing).astype(np.intp) if spacing > 0 else np.ones(len(lengths), dtype=np.intp)
+    seg = np.repeat(np.arange(len(lengths)), pieces)
+    offsets = np.cumsum(pieces) - pieces
+    fraction = (np.arange(len(seg)) - offsets[seg]) / pieces[seg]
+    return (coords[seg] + fraction[:, None] * steps[seg])[1:]
+
+
+def plan_fill(
+    rows: np.ndarray,
+    seg_start: np.ndarray,
+    seg_end: np.ndarray,
+    ys: np.ndarray,
+    start: Optional[np.ndarray] = None,
+    travel_length: float = TRAVEL_STITCH_LENGTH,
+    start_right: bool = False
+) -> Dict[str, Any]:
+    """
+    Sewing order of scanline spans: {"order": span indices, "reverse": True where the
+    span is sewn right to left, "travel": {position in order: Kx2 run stitches sewn
+    before that span}, "stats": {"sections", "travel_runs", "travel_length", "jumps"}}.
+
+    Sections are visited greedily, nearest first by in-shape route distance, entering
+    at whichever corner is closest. Without `start` the fill begins at the first row's
+    left end, or its right end with `start_right` (a convex shape comes out as the plain
+    row-by-row serpentine, first row in that direction); with it,
+    a travel run leads from `start` to the nearest section corner. Parts that no route
+    connects (a multipolygon) are reached by a direct hop, counted in "jumps".
+    """
+    spacing = float(ys[1] - ys[0]) if len(ys) > 1 else 0.0
+    section, links = span_sections(rows, seg_start, seg_end, MAX_TURN_ROWS * spacing, spacing)
+    n_sections = int(section.max()) + 1 if len(section) else 0
+    stats = {"sections": n_sections, "travel_runs": 0, "travel_length": 0.0, "jumps": 0}
+    if n_sections == 0 or (n_sections == 1 and start is None):
+        order = np.arange(len(rows))
+        reverse = (np.arange(len(rows)) + start_right) % 2 == 1
+        return {"order": order, "reverse": reverse, "travel": {}, "stats": stats}
+
+    spans_of = np.split(np.argsort(section, kind="stable"), np.cumsum(np.bincount(section))[:-1])
+    position_in = np.empty(len(rows), dtype=np.intp)
+    for spans in spans_of:
+        position_in[spans] = np.arange(len(spans))
+    mid = np.column_stack([(seg_start + seg_end) / 2.0, ys[rows]])
+    along = [cumulative_lengths(mid[spans]) for spans in spans_of]
+
+    def node_of(span: int) -> Node:
+        return int(section[span]), int(position_in[span])
+
+    def point(node: Node) -> np.ndarray:
+        return mid[spans_of[node[0]][node[1]]]
+
+    def corner(node: Node, right: bool) -> np.ndarray:
+        span = spans_of[node[0]][node[1]]
+        return np.array([seg_end[span] if right else seg_start[span], ys[rows[span]]])
+
+    def is_end(node: Node) -> bool:
+        return node[1] == 0 or node[1] == len(spans_of[node[0]]) - 1
+
+    # Route graph: nodes on section centerlines (both ends of every section, every
+    # link end, the start's span); edges along the centerline between neighbouring
+    # nodes of a section and across each link through its portal
+    stops = [{0, len(spans) - 1} for spans in spans_of]
+    crossings: Dict[Node, List[Tuple[Node, float, np.ndarray]]] = {}
+    for a, b in links:
+        portal = np.array([
+            (max(seg_start[a], seg_start[b]) + min(seg_end[a], seg_end[b])) / 2.0,
+            (ys[rows[a]] + ys[rows[b]]) / 2.0,
+        ])
+        cost = float(np.hypot(*(portal - mid[a])) + np.hypot(*(mid[b] - portal)))
+        u, v = node_of(a), node_of(b)
+        stops[u[0]].add(u[1])
+        stops[v[0]].add(v[1])
+        crossings.setdefault(u, []).append((v, cost, portal))
+        crossings.setdefault(v, []).append((u, cost, portal))
+
+    if start is not None:
+        # The lead-in enters the graph at the span nearest to `start`
+        start = np.asarray(start, dtype=np.float64).reshape(2)
+        gap = np.maximum(np.maximum(seg_start - start[0], start[0] - seg_end), 0.0)
+        start_node = node_of(int(np.argmin(np.hypot(gap, ys[rows] - start[1]))))
+        stops[start_node[0]].add(start_node[1])
+    stops = [sorted(ks) for ks in stops]
+
+    def neighbours(node: Node) -> Iterator[Tuple[Node, float, Optional[np.ndarray]]]:
+        s, k = node
+        ks = stops[s]
+        i = bisect.bisect_left(ks, k)
+        for j in (i - 1, i + 1):
+            if 0 <= j < len(ks):
+                yield (s, ks[j]), abs(along[s][ks[j]] - along[s][k]), None
+        yield from crossings.get(node, ())
+
+    def nearest_entry(sources: Dict[Node, Tuple[float, List[np.ndarray]]]):
+        """
+        Dijkstra from `sources` ({node: (cost, route points ending at the node)}),
+        stopped once nothing is closer than the best entry found so far. Returns
+        (route points up to the entry corner, section end node, enter from the right)
+        or None when no unsewn section is reachable.
+        """
+        dist = {node: cost for node, (cost, _) in sources.items()}
+        prev: Dict[Node, Tuple[Node, Optional[np.ndarray]]] = {}
+        heap = [(cost, node) for node, cost in dist.items()]
+        heapq.heapify(heap)
+        best = None
+        while heap:
+            d, u = heapq.heappop(heap)
+            if best is not None and d >= best[0]:
+                break
+            if d > dist[u]:
+                continue
+            if remaining[u[0]] and is_end(u):
+                for right in (False, True):
+                    cost = d + float(np.hypot(*(corner(u, right) - point(u))))
+                    if best is None or cost < best[0]:
+                        best = (cost, u, right)
+            for v, w, portal in neighbours(u):
+                if d + w < dist.get(v, np.inf):
+                    dist[v] = d + w
+                    prev[v] = (u, portal)
+                    heapq.heappush(heap, (d + w, v))
+        if best is None:
+            return None
+
+        _, target, right = best
+        # Walk back to the source, collecting parts last to first
+        parts, node = [corner(target, right)[None]], target
+        while node in prev:
+            before, portal = prev[node]
+            if portal is not None:
+                parts.append(np.vstack([portal, point(node)]))
+            else:
+                # Along the section's centerline, `before` excluded
+                spans = spans_of[node[0]]
+                if node[1] > before[1]:
+                    parts.append(mid[spans[before[1] + 1:node[1] + 1]])
+                else:
+                    parts.append(mid[spans[node[1]:before[1]][::-1]])
+            node = before
+        parts.extend(sources[node][1][::-1])
+        return parts[::-1], target, right
+
+    remaining = np.ones(n_sections, dtype=bool)
+    order_parts, reverse_parts = [], []
+    travel: Dict[int, np.ndarray] = {}
+    position = 0
+
+    if start is None:
+        route, node, right = [], (0, 0), bool(start_right)
+    else:
+        lead = float(np.hypot(*(point(start_node) - start)))
+        route, node, right = nearest_entry({start_node: (lead, [start[None], point(start_node)[None]])})
+
+    while True:
+        if route:
+            run = _travel_points(route, travel_length, spacing / 2.0)
+            if position == 0:
+                # The lead-in starts on `start` itself, so the connector there stays short
+                run = np.vstack([start[None], run])
+            if len(run):
+                travel[position] = run
+            stats["travel_runs"] += 1
+            stats["travel_length"] += float(cumulative_lengths(np.vstack(route))[-1])
+
+        s, k = node
+        spans = spans_of[s] if k == 0 else spans_of[s][::-1]
+        reverse = (np.arange(len(spans)) + right) % 2 == 1
+        order_parts.append(spans)
+        reverse_parts.append(reverse)
+        position += len(spans)
+        remaining[s] = False
+        if not remaining.any():
+            break
+
+        exit_node = (s, len(spans) - 1) if k == 0 else (s, 0)
+        exit_point = corner(exit_node, not reverse[-1])
+        found = nearest_entry({exit_node: (float(np.hypot(*(point(exit_node) - exit_point))),
+                                           [exit_point[None], point(exit_node)[None]])})
+        if found is None:
+            # Disconnected part: hop straight to the nearest corner left
+            candidates = [(float(np.hypot(*(corner(end, r) - exit_point))), end, r)
+                          for t in np.flatnonzero(remaining)
+                          for end in ((int(t), 0), (int(t), len(spans_of[t]) - 1)) for r in (False, True)]
+            _, node, right = min(candidates)
+            route = []
+            stats["jumps"] += 1
+        else:
+            route, node, right = found
+
+    return {
+        "order": np.concatenate(order_parts),
+        "reverse": np.concatenate(reverse_parts),
+        "travel": travel,
+        "stats": stats,
+    }
+
+
+def insert_travel(points: np.ndarray, span_offsets: np.ndarray, travel: List[Tuple[int, np.ndarray]]) -> np.ndarray:
+    """
+    Stitches of spans in sewing order (`points`, span i starting at `span_offsets[i]`)
+    with the travel runs [(span position, Kx2 run)] inserted before those spans.
+    """
+    if not travel:
+        return points
+    # Few runs: slices of the span stitches and the runs, joined in one copy
+    parts, done = [], 0
+    for p, run in travel:
+        at = span_offsets[p]
+        parts.extend((points[done:at], run))
+        done = at
+    parts.append(points[done:])
+    return np.concatenate(parts)
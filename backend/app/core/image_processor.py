@@ -1,20 +1,289 @@
 import cv2
 import numpy as np
-from typing import List, Dict, Any
+import asyncio
+import os
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+from app.core.kmeans import run_kmeans
+from app.core.cache import content_key, image_cache, segmentation_cache
+from app.core.contours import extract_region_contours
+from app.core.tiling import segment_tiled
+from app.core.cleanup import cleanup_options, cleanup_report, merge_speckles, simplify_to_budget
+from app.core.palette import PALETTE_MODE, catalog_option, quantize_to_palette
+from app.core.metrics import stage, timed
+from app.core.executor import QueueFull
 
-def process_image_kmeans(image_bytes: bytes, k: int = 5) -> Dict[str, Any]:
+# Tiled segmentations coordinated at once: each holds a serving-process thread and a
+# decoded image while its tiles run on the heavy lane; more are rejected with QueueFull
+MAX_TILED_JOBS = int(os.environ.get("EMBRO_TILED_JOBS", 2))
+_tiled_jobs = threading.BoundedSemaphore(max(1, MAX_TILED_JOBS))
+
+@timed("decode")
+def decode_image(image_bytes: bytes, conversion: Optional[int] = None, image_hash: Optional[str] = None) -> np.ndarray:
     """
-    Process an image using K-Means clustering to segment colors and extract vector paths.
+    Decodes an image (optionally applying a cv2 color conversion), memoized by content hash
+    so that re-running with a different k skips decoding and conversion.
+    The returned array is shared with the cache and therefore read-only.
     """
-    # Convert bytes to numpy array
+    key = f"{image_hash or content_key(image_bytes)}:{conversion}"
+    cached = image_cache.get(key)
+    if cached is not None:
+        return cached
+
     nparr = np.frombuffer(image_bytes, np.uint8)
     image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    
     if image is None:
         raise ValueError("Could not decode image")
+    if conversion is not None:
+        image = cv2.cvtColor(image, conversion)
+
+    image.flags.writeable = False
+    image_cache.put(key, image, image.nbytes)
+    return image
+
+def _decoded(image_bytes: bytes, conversion: Optional[int], image_hash: str, image: Optional[np.ndarray]) -> np.ndarray:
+    """decode_image, or the already decoded BGR `image` (shipped by run_segmentation) converted alike."""
+    if image is None:
+        return decode_image(image_bytes, conversion, image_hash)
+    return image if conversion is None else cv2.cvtColor(image, conversion)
+
+def segmentation_key(fn: str, image_hash: str, **params) -> str:
+    return content_key(image_hash.encode(), fn=fn, **params)
+
+def _cached_result(key: str) -> Optional[Dict[str, Any]]:
+    cached = segmentation_cache.get(key)
+    if cached is None:
+        return None
+    return {**cached, "cached": True}
+
+async def run_segmentation(lane, fn, image_bytes: bytes, **params) -> Tuple[Dict[str, Any], Optional[Dict[str, float]]]:
+    """
+    Runs a segmentation function off the event loop. The result cache is checked and
+    filled here, in the serving process; the worker only computes (cache=False).
+    Lane runs get the image decoded here too (decode_image, on a thread), so the image
+    cache lives in the serving process and a rerun with another k skips decoding
+    whichever worker it lands on.
+    `lane` is an app.core.executor.Lane, or None to use a thread (tiled jobs, which
+    fan out to the heavy lane themselves); at most MAX_TILED_JOBS such threads run at
+    once, QueueFull beyond.
+    Returns (result, timing) where timing is None for cache hits and thread runs.
+    """
+    image_hash = content_key(image_bytes)
+    key = segmentation_key(fn.__name__, image_hash, **params)
+    cached = _cached_result(key)
+    if cached is not None:
+        return cached, None
+    if lane is None:
+        if not _tiled_jobs.acquire(blocking=False):
+            raise QueueFull(f"Too many tiled segmentations ({MAX_TILED_JOBS} running)")
+        try:
+            result = await asyncio.to_thread(fn, image_bytes, image_hash=image_hash, cache=False, **params)
+        finally:
+            _tiled_jobs.release()
+        timing = None
+    else:
+        image = await asyncio.to_thread(decode_image, image_bytes, None, image_hash)
+        result, timing = await lane.run_timed(fn, None, image_hash=image_hash, image=image, cache=False, **params)
+    segmentation_cache.put(key, result)
+    return result, timing
+
+def _traced_regions(
+    label_map: np.ndarray,
+    num_labels: int,
+    min_area: int,
+    vertex_budget: int,
+    **contour_options
+) -> Tuple[List[List[Dict[str, Any]]], Dict[str, Any]]:
+    """
+    Regions of a label map after the cleanup (app.core.cleanup): speckles merged, contours
+    traced (extract_region_contours options) and held to the vertex budget.
+    Returns (regions per label, the stats "cleanup" entry).
+    """
+    label_map, speckles = merge_speckles(label_map, num_labels, min_area)
+    with stage("contours"):
+        regions = extract_region_contours(label_map, num_labels, **contour_options)
+    if min_area <= 0:
+        # Nothing merged, so nothing labelled: the regions before cleanup are the traced ones
+        speckles["regions"] = sum(map(len, regions))
+    regions, budget = simplify_to_budget(regions, vertex_budget)
+    return regions, cleanup_report(min_area, vertex_budget, speckles, budget, regions)
+
+def segment_image_rgb(
+    image_bytes: bytes,
+    k: int = 5,
+    mode: str = "exact",
+    sample_size: int = 100_000,
+    seed: Optional[int] = None,
+    measure_memory: bool = False,
+    min_area: Optional[int] = None,
+    vertex_budget: Optional[int] = None,
+    catalog: Optional[str] = None,
+    image_hash: Optional[str] = None,
+    image: Optional[np.ndarray] = None,
+    cache: bool = True
+) -> Dict[str, Any]:
+    """
+    RGB K-Means segmentation used by /segmentar: one layer ("capa") per cluster with its contours.
+    mode="palette" skips k-means and quantizes straight to the threads of `catalog`, at
+    most `k` of them (0 for no limit); each capa then carries its "thread" (app.core.palette).
+    Speckles under `min_area` pixels are merged away and the contours are simplified to
+    `vertex_budget` vertices in total (app.core.cleanup, None for the defaults, 0 for off);
+    stats "cleanup" has the counts before and after.
+    `image` is the already decoded BGR image (image_bytes is then not read).
+    With cache=False the result cache is neither read nor written (see run_segmentation).
+    """
+    min_area, vertex_budget = cleanup_options(min_area, vertex_budget)
+    catalog = catalog_option(mode, catalog)
+    image_hash = image_hash or content_key(image_bytes)
+    result_key = segmentation_key(
+        "segment_image_rgb", image_hash, k=k, mode=mode,
+        sample_size=sample_size, seed=seed, measure_memory=measure_memory,
+        min_area=min_area, vertex_budget=vertex_budget, catalog=catalog
+    )
+    cached = _cached_result(result_key) if cache else None
+    if cached is not None:
+        return cached
+
+    if mode == PALETTE_MODE:
+        # 1-2. Leer la imagen (BGR) y asignar cada píxel a su hilo más cercano del catálogo
+        img = _decoded(image_bytes, None, image_hash, image)
+        labels, threads, palette_stats = quantize_to_palette(img, catalog, k)
+        regions, cleanup = _traced_regions(labels, len(threads), min_area, vertex_budget, min_points=3)
+        result = {"capas": _thread_layers(threads, regions), "stats": {**palette_stats, "cleanup": cleanup}}
+        if cache:
+            segmentation_cache.put(result_key, result)
+        return result
+
+    # 1. Leer la imagen
+    img = _decoded(image_bytes, cv2.COLOR_BGR2RGB, image_hash, image)
 
-    # Convert to LAB color space for better perceptual color segmentation
-    image_lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+    # 2. K-Means Clustering (exact, or sample-then-assign with mode="sampled")
+    data = img.reshape((-1, 3)).astype(np.float32)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
+    with stage("kmeans"):
+        labels, centers, kmeans_stats = run_kmeans(
+            data, k, criteria, 10,
+            mode=mode, sample_size=sample_size, seed=seed, measure_memory=measure_memory
+        )
+    
+    centers = np.uint8(centers)
+
+    # 3. Fundir motas pequeñas con sus vecinas y extraer contornos por cada color
+    #    (una sola pasada sobre el mapa de etiquetas), dentro del presupuesto de vértices
+    regions, cleanup = _traced_regions(labels.reshape(img.shape[:2]), len(centers), min_area, vertex_budget, min_points=3)
+    resultado = []
+    for color, cluster_regions in zip(centers, regions):
+        resultado.append({
+            "color": f"#{color[0]:02x}{color[1]:02x}{color[2]:02x}",
+            "paths": [region["exterior"] for region in cluster_regions],
+            "holes": [region["holes"] for region in cluster_regions]
+        })
+
+    result = {"capas": resultado, "stats": {**kmeans_stats, "cleanup": cleanup}}
+    if cache:
+        segmentation_cache.put(result_key, result)
+    return result
+
+def _lab_layers(centers: np.ndarray, regions: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """One layer per non-empty cluster, colored with its LAB center converted to RGB hex."""
+    layers = []
+    for i, cluster_regions in enumerate(regions):
+        # Get the color of this cluster (convert LAB to RGB for frontend)
+        lab_color = np.array([[centers[i]]], dtype=np.uint8)
+        rgb_color = cv2.cvtColor(lab_color, cv2.COLOR_LAB2RGB)[0][0]
+        hex_color = "#{:02x}{:02x}{:02x}".format(rgb_color[0], rgb_color[1], rgb_color[2])
+        
+        if cluster_regions:
+            layers.append({
+                "color": hex_color,
+                "paths": [region["exterior"] for region in cluster_regions],
+                "holes": [region["holes"] for region in cluster_regions]
+            })
+    return layers
+
+def process_image_kmeans(
+    image_bytes: bytes,
+    k: int = 5,
+    mode: str = "exact",
+    sample_size: int = 100_000,
+    seed: Optional[int] = None,
+    measure_memory: bool = False,
+    tiled: bool = False,
+    memory_cap: Optional[int] = None,
+    min_area: Optional[int] = None,
+    vertex_budget: Optional[int] = None,
+    catalog: Optional[str] = None,
+    image_hash: Optional[str] = None,
+    image: Optional[np.ndarray] = None,
+    cache: bool = True
+) -> Dict[str, Any]:
+    """
+    Process an image using K-Means clustering to segment colors and extract vector paths.
+    mode="sampled" fits the centers on a stratified pixel sample and assigns
+    every pixel in one vectorized pass (see app.core.kmeans.run_kmeans).
+    mode="palette" replaces k-means with a lookup of every pixel's nearest thread in
+    `catalog`, at most `k` threads (0 for no limit, see app.core.palette); layers then
+    carry their "thread" and "k" is the number of threads used.
+    tiled=True is meant for very large artwork: centers come from a sample and the image
+    is labelled and traced in overlapping tiles by worker processes, with peak memory
+    kept under `memory_cap` bytes (see app.core.tiling.segment_tiled).
+    Cleanup (app.core.cleanup): regions under `min_area` pixels are merged into their
+    neighbours and the contours are simplified to `vertex_budget` vertices in total
+    (None for the defaults, 0 turns either off); stats "cleanup" reports regions and
+    vertices before and after.
+    Results are cached by image hash + parameters (unless cache=False); the decoded
+    image is cached separately so a change of k only reruns clustering. `image` is the
+    already decoded BGR image (see run_segmentation; image_bytes is then not read).
+    """
+    min_area, vertex_budget = cleanup_options(min_area, vertex_budget)
+    catalog = catalog_option(mode, catalog)
+    image_hash = image_hash or content_key(image_bytes)
+    result_key = segmentation_key(
+        "process_image_kmeans", image_hash, k=k, mode=mode,
+        sample_size=sample_size, seed=seed, measure_memory=measure_memory, tiled=tiled,
+        memory_cap=memory_cap, min_area=min_area, vertex_budget=vertex_budget, catalog=catalog
+    )
+    cached = _cached_result(result_key) if cache else None
+    if cached is not None:
+        return cached
+
+    if tiled:
+        # The full image never goes through decode_image / the image cache here
+        with stage("tiled"):
+            regions, centers, tile_stats, (height, width) = segment_tiled(
+                image_bytes, k, sample_size, seed, memory_cap, epsilon_ratio=0.001, min_area=min_area,
+                palette=mode == PALETTE_MODE, catalog=catalog
+            )
+        regions, budget = simplify_to_budget(regions, vertex_budget)
+        tile_stats["cleanup"] = cleanup_report(min_area, vertex_budget, tile_stats.pop("speckles"), budget, regions)
+        threads = tile_stats.pop("threads", None)
+        result = {
+            "k": len(centers),
+            "layers": _thread_layers(threads, regions) if threads is not None else _lab_layers(np.uint8(centers), regions),
+            "original_size": {"width": width, "height": height},
+            "stats": tile_stats
+        }
+        if cache:
+            segmentation_cache.put(result_key, result)
+        return result
+
+    if mode == PALETTE_MODE:
+        # Straight to thread colors: one table lookup per pixel instead of clustering
+        image = _decoded(image_bytes, None, image_hash, image)
+        labels, threads, palette_stats = quantize_to_palette(image, catalog, k)
+        regions, cleanup = _traced_regions(labels, len(threads), min_area, vertex_budget, epsilon_ratio=0.001)
+        result = {
+            "k": len(threads),
+            "layers": _thread_layers(threads, regions),
+            "original_size": {"width": image.shape[1], "height": image.shape[0]},
+            "stats": {**palette_stats, "cleanup": cleanup}
+        }
+        if cache:
+            segmentation_cache.put(result_key, result)
+        return result
+
+    # Decode and convert to LAB color space for better perceptual color segmentation
+    image_lab = _decoded(image_bytes, cv2.COLOR_BGR2LAB, image_hash, image)
     
     # Reshape the image to a 2D array of pixels
     pixel_values = image_lab.reshape((-1, 3))
@@ -24,55 +293,43 @@ def process_image_kmeans(image_bytes: bytes, k: int = 5) -> Dict[str, Any]:
     criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100, 0.2)
     
     # Perform K-Means clustering
-    _, labels, centers = cv2.kmeans(pixel_values, k, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
+    with stage("kmeans"):
+        labels, centers, kmeans_stats = run_kmeans(
+            pixel_values, k, criteria, 10,
+            mode=mode, sample_size=sample_size, seed=seed, measure_memory=measure_memory
+        )
+    k = len(centers)
     
     # Convert centers back to uint8
     centers = np.uint8(centers)
     
-    # Create the segmented image
-    segmented_data = centers[labels.flatten()]
-    segmented_image = segmented_data.reshape(image_lab.shape)
+    # Contours come straight from the label map: one labelling pass, then each
+    # connected region is traced inside its bounding box (holes kept).
+    # Speckles are merged into the surrounding clusters before tracing.
+    labels_reshaped = labels.reshape((image_lab.shape[0], image_lab.shape[1]))
     
-    # Convert segmented image back to BGR for contour detection setup (logic operates on masks)
-    # Actually we can just work with the labels to create masks for each cluster
+    # Simplify contours (epsilon can be adjusted for fidelity vs path complexity),
+    # then further if they are over the vertex budget
+    regions, cleanup = _traced_regions(labels_reshaped, k, min_area, vertex_budget, epsilon_ratio=0.001)
     
-    labels_reshaped = labels.reshape((image.shape[0], image.shape[1]))
-    
-    paths = []
-    
-    for i in range(k):
-        # Create a binary mask for the current cluster
-        mask = np.uint8(labels_reshaped == i) * 255
-        
-        # Find contours
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        # Get the color of this cluster (convert LAB to RGB for frontend)
-        lab_color = np.array([[centers[i]]], dtype=np.uint8)
-        rgb_color = cv2.cvtColor(lab_color, cv2.COLOR_LAB2RGB)[0][0]
-        hex_color = "#{:02x}{:02x}{:02x}".format(rgb_color[0], rgb_color[1], rgb_color[2])
-        
-        cluster_paths = []
-        for contour in contours:
-            # Simplify contour (epsilon can be adjusted for fidelity vs path complexity)
-            epsilon = 0.001 * cv2.arcLength(contour, True)
-            approx = cv2.approxPolyDP(contour, epsilon, True)
-            
-            # Identify single points or invalid geometries
-            if len(approx) < 3:
-                continue
-                
-            points = approx.reshape(-1, 2).tolist()
-            cluster_paths.append(points)
-            
-        if cluster_paths:
-            paths.append({
-                "color": hex_color,
-                "paths": cluster_paths
-            })
-            
-    return {
+    result = {
         "k": k,
-        "layers": paths,
-        "original_size": {"width": image.shape[1], "height": image.shape[0]}
+        "layers": _lab_layers(centers, regions),
+        "original_size": {"width": image_lab.shape[1], "height": image_lab.shape[0]},
+        "stats": {**kmeans_stats, "cleanup": cleanup}
     }
+    if cache:
+        segmentation_cache.put(result_key, result)
+    return result
+
+def _thread_layers(threads: List[Dict[str, Any]], regions: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """One layer per thread that kept regions, colored with the thread and carrying its catalog entry."""
+    return [
+        {
+            "color": thread["color"],
+            "thread": {"id": thread["id"], "name": thread["name"], "catalog": thread["catalog"]},
+            "paths": [region["exterior"] for region in thread_regions],
+            "holes": [region["holes"] for region in thread_regions]
+        }
+        for thread, thread_regions in zip(threads, regions) if thread_regions
+    ]
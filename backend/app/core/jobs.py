@@ -0,0 +1,193 @@
+import asyncio
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.core.executor import QueueFull
+
+# Export jobs running their stages at the same time (each stage still queues on its lane)
+JOB_CONCURRENCY = int(os.environ.get("EMBRO_JOB_CONCURRENCY", 2))
+# Queued + running jobs accepted before new submissions are rejected
+JOB_MAX_ACTIVE = int(os.environ.get("EMBRO_JOB_MAX_ACTIVE", 32))
+# Seconds a finished job (and its result) is kept for polling / download
+JOB_TTL = float(os.environ.get("EMBRO_JOB_TTL", 600))
+
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+FINISHED_STATES = ("done", "failed", "cancelled")
+
+
+class Job:
+    """
+    State of one background job: status, current stage and its progress, and once
+    done the result bytes. Every update wakes whoever is waiting in `wait_change`.
+    """
+
+    def __init__(self, kind: str, stages: List[str]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.stages = list(stages)
+        self.status = "queued"
+        self.stage: Optional[str] = None
+        self.progress = 0.0
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[bytes] = None
+        self.filename: Optional[str] = None
+        self.media_type = "application/octet-stream"
+        self.meta: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+        self.version = 0
+        self._task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def update(self, **fields):
+        for key, value in fields.items():
+            setattr(self, key, value)
+        self.version += 1
+        # Wake current waiters; later waiters get a fresh event
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def set_stage(self, stage: str, progress: float = 0.0):
+        self.update(stage=stage, progress=progress)
+
+    def set_progress(self, progress: float):
+        self.update(progress=min(max(float(progress), 0.0), 1.0))
+
+    async def wait_change(self, version: int, timeout: Optional[float] = None) -> bool:
+        """Waits until the job moves past `version`; False on timeout."""
+        if self.version != version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = self.finished_at or time.time()
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "stages": self.stages,
+            "progress": self.progress,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_ms": (now - (self.started_at or now)) * 1000.0,
+            "result_bytes": len(self.result) if self.result is not None else None,
+            "meta": self.meta,
+            "error": self.error,
+            "version": self.version,
+        }
+
+
+# A job body: receives its Job to report stages/progress, returns (bytes, filename, meta)
+JobRunner = Callable[[Job], Awaitable[tuple]]
+
+
+class JobManager:
+    """
+    In-process job registry (no broker): at most `max_concurrent` jobs run at once, at most
+    `max_active` are queued or running, finished jobs are dropped `ttl` seconds after they
+    end. State lives in this process, so with several server workers a client has to come
+    back to the worker that accepted its job.
+    """
+
+    def __init__(self, max_concurrent: int = JOB_CONCURRENCY, max_active: int = JOB_MAX_ACTIVE, ttl: float = JOB_TTL):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_active = max(1, int(max_active))
+        self.ttl = float(ttl)
+        self._jobs: Dict[str, Job] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.submitted = 0
+        self.rejected = 0
+
+    def _active(self) -> int:
+        return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def sweep(self):
+        """Drops finished jobs older than the TTL."""
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and now - job.finished_at > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def submit(self, kind: str, stages: List[str], runner: JobRunner) -> Job:
+        """Registers a job and schedules it; raises QueueFull when too many are pending."""
+        self.sweep()
+        if self._active() >= self.max_active:
+            self.rejected += 1
+            raise QueueFull(f"Too many export jobs ({self.max_active} queued or running)")
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        job = Job(kind, stages)
+        self._jobs[job.id] = job
+        self.submitted += 1
+        job._task = asyncio.create_task(self._run(job, runner))
+        return job
+
+    async def _run(self, job: Job, runner: JobRunner):
+        try:
+            async with self._semaphore:
+                job.update(status="running", started_at=time.time())
+                result, filename, meta = await runner(job)
+            job.update(status="done", progress=1.0, result=result, filename=filename,
+                       meta=meta or {}, finished_at=time.time())
+        except asyncio.CancelledError:
+            job.update(status="cancelled", finished_at=time.time())
+        except Exception as e:
+            job.update(status="failed", error=str(e) or type(e).__name__, finished_at=time.time())
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self.sweep()
+        return self._jobs.get(job_id)
+
+    async def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Cancels a queued or running job (its pending lane tasks are cancelled; a stage
+        already running in a worker finishes there and is discarded). A finished job is
+        removed instead. Returns the job, or None if unknown.
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if job.finished:
+            del self._jobs[job_id]
+        elif job._task is not None:
+            job._task.cancel()
+            # The job task only awaits lane futures, so it unwinds right away
+            await asyncio.wait([job._task])
+        return job
+
+    def shutdown(self):
+        for job in self._jobs.values():
+            if job._task is not None and not job._task.done():
+                job._task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        self.sweep()
+        counts = {state: 0 for state in JOB_STATES}
+        for job in self._jobs.values():
+            counts[job.status] += 1
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_active": self.max_active,
+            "ttl_s": self.ttl,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            **counts,
+        }
+
+
+job_manager = JobManager()
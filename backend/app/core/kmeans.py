@@ -0,0 +1,129 @@
+import time
+import tracemalloc
+import cv2
+import numpy as np
+from typing import Any, Dict, Optional, Tuple
+
+KMEANS_MODES = ("exact", "sampled")
+
+# Pixels assigned per chunk in the nearest-center pass (keeps the N x k distance
+# matrix around 8 MB for k=8).
+ASSIGN_CHUNK = 262_144
+
+
+def stratified_sample(n: int, sample_size: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    One random index from each of `sample_size` equal strata of [0, n).
+    Pixels are in scanline order, so strata spread the sample over the whole image.
+    """
+    if sample_size >= n:
+        return np.arange(n)
+    edges = np.linspace(0, n, sample_size + 1)
+    lo = edges[:-1]
+    return np.minimum((lo + rng.random(sample_size) * (edges[1:] - lo)).astype(np.intp), n - 1)
+
+
+def assign_to_centers(pixels: np.ndarray, centers: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Nearest center for every pixel in chunked vectorized passes.
+    Returns (labels, squared_distance).
+    """
+    centers = centers.astype(np.float32)
+    c_sq = np.sum(centers ** 2, axis=1)
+    labels = np.empty(len(pixels), dtype=np.int32)
+    dist_sq = np.empty(len(pixels), dtype=np.float32)
+
+    for start in range(0, len(pixels), ASSIGN_CHUNK):
+        chunk = pixels[start:start + ASSIGN_CHUNK].astype(np.float32)
+        # |x - c|^2 = |x|^2 - 2 x.c + |c|^2 ; |x|^2 is constant per row for the argmin
+        d = c_sq[None, :] - 2.0 * (chunk @ centers.T)
+        idx = np.argmin(d, axis=1)
+        labels[start:start + len(chunk)] = idx
+        x_sq = np.sum(chunk ** 2, axis=1)
+        dist_sq[start:start + len(chunk)] = np.maximum(d[np.arange(len(chunk)), idx] + x_sq, 0.0)
+
+    return labels, dist_sq
+
+
+def _mean_distance(pixels: np.ndarray, centers: np.ndarray, labels: np.ndarray) -> float:
+    """
+    Mean distance of every pixel to its labelled center, in chunked passes
+    (no N x 3 temporaries for the full image).
+    """
+    total = 0.0
+    for start in range(0, len(pixels), ASSIGN_CHUNK):
+        diff = pixels[start:start + ASSIGN_CHUNK] - centers[labels[start:start + ASSIGN_CHUNK]]
+        total += float(np.sqrt(np.einsum("ij,ij->i", diff, diff)).sum(dtype=np.float64))
+    return total / len(pixels) if len(pixels) else 0.0
+
+
+def run_kmeans(
+    pixels: np.ndarray,
+    k: int,
+    criteria: Tuple[int, int, float],
+    attempts: int = 10,
+    mode: str = "exact",
+    sample_size: int = 100_000,
+    seed: Optional[int] = None,
+    measure_memory: bool = False
+) -> Tuple[np.ndarray, np.ndarray, Dict[str, Any]]:
+    """
+    K-Means over an Nx3 float32 pixel array.
+
+    mode="exact":   cv2.kmeans over every pixel (previous behaviour).
+    mode="sampled": fit the centers on a stratified sample of `sample_size` pixels,
+                    then assign every full-resolution pixel to its nearest center.
+
+    Returns (labels (N,), centers (k, 3) float32, stats) where stats reports latency,
+    mean color error (distance pixel -> center, in the clustered color space) and,
+    with `measure_memory`, the peak of numpy/Python allocations seen by tracemalloc.
+    """
+    if mode not in KMEANS_MODES:
+        raise ValueError(f"Unsupported k-means mode: {mode}")
+
+    pixels = np.ascontiguousarray(pixels, dtype=np.float32)
+    n = len(pixels)
+    k = max(1, min(int(k), n))
+
+    tracing = measure_memory and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    elif measure_memory:
+        tracemalloc.reset_peak()
+
+    if seed is not None:
+        cv2.setRNGSeed(int(seed))
+
+    t0 = time.perf_counter()
+    if mode == "sampled" and sample_size < n:
+        rng = np.random.default_rng(seed)
+        sample = pixels[stratified_sample(n, max(int(sample_size), k), rng)]
+        _, _, centers = cv2.kmeans(sample, k, None, criteria, attempts, cv2.KMEANS_RANDOM_CENTERS)
+        t1 = time.perf_counter()
+        labels, dist_sq = assign_to_centers(pixels, centers)
+        used = len(sample)
+        t2 = time.perf_counter()
+        color_error = float(np.mean(np.sqrt(dist_sq))) if n else 0.0
+    else:
+        _, labels, centers = cv2.kmeans(pixels, k, None, criteria, attempts, cv2.KMEANS_RANDOM_CENTERS)
+        t1 = time.perf_counter()
+        labels = labels.ravel()
+        used = n
+        t2 = time.perf_counter()
+        color_error = _mean_distance(pixels, centers, labels)
+
+    stats = {
+        "mode": mode if used < n else "exact",
+        "pixels": n,
+        "fit_pixels": used,
+        "fit_ms": (t1 - t0) * 1000.0,
+        "assign_ms": (t2 - t1) * 1000.0,
+        "latency_ms": (t2 - t0) * 1000.0,
+        "color_error": color_error,
+    }
+    if measure_memory:
+        stats["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        if tracing:
+            tracemalloc.stop()
+
+    return labels, centers, stats
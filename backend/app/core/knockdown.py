@@ -0,0 +1,130 @@
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import shapely
+from shapely import STRtree
+from shapely.geometry import Polygon
+
+from app.core.production_stats import MM_PER_UNIT
+from app.core.metrics import timed
+
+# Occlusion knockdown: layers are sewn in order, so a fill is hidden wherever a later
+# fill covers it. Before digitizing, every fill polygon loses the union of the fills
+# stacked above it; the STRtree over all fill polygons finds those candidates without
+# comparing every pair. The covering shapes are first shrunk by the overlap margin, so
+# the lower fill still runs that far under the upper one and no fabric shows through
+# at the seam when the upper fill pulls in. Outlines (run / bean / stroke layers) are
+# neither clipped nor treated as covering anything.
+
+# Overlap kept under the covering fill, in embroidery units (0.1 mm)
+KNOCKDOWN_MARGIN = float(os.environ.get("EMBRO_KNOCKDOWN_MARGIN", 10.0))
+
+# Styles whose stitches cover the inside of the shape
+KNOCKDOWN_STYLES = ("tatami", "satin")
+
+# Pieces left over by the clipping that are smaller than this (units^2, 1 mm^2) are dropped
+MIN_PART_AREA = 100.0
+
+
+def path_polygon(path: List[List[float]], holes: List[List[List[float]]]) -> Polygon:
+    """Polygon of a layer path and its holes (rings under 3 points skipped), made valid."""
+    polygon = Polygon(path, [h for h in holes if len(h) >= 3])
+    if not polygon.is_valid:
+        polygon = polygon.buffer(0)
+    return polygon
+
+
+def _is_fill(layer: Dict[str, Any]) -> bool:
+    style = str(layer.get('settings', {}).get('style', 'tatami')).lower()
+    return style in KNOCKDOWN_STYLES and not layer.get('isStroke', False)
+
+
+def _rings(parts) -> List[Tuple[List[List[float]], List[List[List[float]]]]]:
+    """(path, holes) per polygon."""
+    return [
+        (shapely.get_coordinates(part.exterior).tolist(), [shapely.get_coordinates(ring).tolist() for ring in part.interiors])
+        for part in parts
+    ]
+
+
+@timed("knockdown")
+def knockdown_layers(
+    layers: List[Dict[str, Any]],
+    margin: Optional[float] = None
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Layers with the hidden parts of their fills removed (a path can split into several
+    or disappear), plus {"margin", "polygons_clipped", "polygons_hidden",
+    "area_removed_mm2", "layers_changed": indices}. Unchanged layers are returned as is.
+    """
+    margin = KNOCKDOWN_MARGIN if margin is None else float(margin)
+    if margin < 0:
+        raise ValueError("Knockdown margin must not be negative")
+    stats = {"margin": margin, "polygons_clipped": 0, "polygons_hidden": 0, "area_removed_mm2": 0.0, "layers_changed": []}
+
+    owners: List[Tuple[int, int]] = []
+    polygons = []
+    for i, layer in enumerate(layers):
+        if not _is_fill(layer):
+            continue
+        raw_holes = layer.get('holes') or []
+        for j, path in enumerate(layer.get('paths', [])):
+            if not path or len(path) < 3:
+                continue
+            polygon = path_polygon(path, raw_holes[j] if j < len(raw_holes) else [])
+            if not polygon.is_empty:
+                owners.append((i, j))
+                polygons.append(polygon)
+    if len(polygons) < 2:
+        return layers, stats
+
+    polygons = np.array(polygons, dtype=object)
+    layer_of = np.array([i for i, _ in owners])
+    covers = shapely.buffer(polygons, -margin) if margin > 0 else polygons
+    tree = STRtree(covers)
+    below, above = tree.query(polygons, predicate="intersects")
+    on_top = layer_of[above] > layer_of[below]
+    order = np.argsort(below[on_top], kind="stable")
+    below, above = below[on_top][order], above[on_top][order]
+    if len(below) == 0:
+        return layers, stats
+
+    # Candidates grouped per covered polygon
+    starts = np.flatnonzero(np.r_[True, below[1:] != below[:-1]])
+    replaced: Dict[Tuple[int, int], List[Tuple[List[List[float]], List[List[List[float]]]]]] = {}
+    for group in np.split(np.arange(len(below)), starts[1:]):
+        k = int(below[group[0]])
+        polygon = polygons[k]
+        occluders = covers[above[group]]
+        if shapely.contains(occluders, polygon).any():
+            parts = []
+        else:
+            remaining = shapely.get_parts(shapely.difference(polygon, shapely.union_all(occluders)))
+            parts = [part for part in remaining if part.geom_type == "Polygon" and part.area >= MIN_PART_AREA]
+        removed = polygon.area - sum(part.area for part in parts)
+        if removed <= 1e-9 * polygon.area:
+            continue
+        replaced[owners[k]] = _rings(parts)
+        stats["area_removed_mm2"] += removed * MM_PER_UNIT * MM_PER_UNIT
+        if parts:
+            stats["polygons_clipped"] += 1
+        else:
+            stats["polygons_hidden"] += 1
+
+    result = list(layers)
+    for i in sorted({i for i, _ in replaced}):
+        layer = layers[i]
+        raw_holes = layer.get('holes') or []
+        paths, holes = [], []
+        for j, path in enumerate(layer.get('paths', [])):
+            parts = replaced.get((i, j))
+            if parts is None:
+                paths.append(path)
+                holes.append(raw_holes[j] if j < len(raw_holes) else [])
+            else:
+                paths.extend(path for path, _ in parts)
+                holes.extend(rings for _, rings in parts)
+        result[i] = {**layer, "paths": paths, "holes": holes}
+        stats["layers_changed"].append(i)
+    return result, stats
@@ -0,0 +1,304 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Hot-path instrumentation: named stages (decode, kmeans, fill, branching, encode, ...)
+# feed per-stage latency histograms, and the stages of one HTTP request are summed into
+# its Server-Timing header. Stages run inside lane workers are collected there and sent
+# back with the task result (see executor._timed_call), so they count in the serving
+# process like local ones. Stages may nest (a "fill" contains its "engine.tatami").
+# Everything is per server process, like the caches and the job registry.
+# EMBRO_METRICS=0 turns it all into no-ops.
+METRICS_ENABLED = os.environ.get("EMBRO_METRICS", "1").lower() not in ("0", "false", "no", "off")
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Stage durations (seconds) of the current request, or of the current lane task
+_trace: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("embro_trace", default=None)
+# True inside lane workers: stages are only collected, the serving process observes them
+_collect_only: contextvars.ContextVar[bool] = contextvars.ContextVar("embro_collect_only", default=False)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram per label value (Prometheus semantics)."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # bucket counts, then +Inf count, then sum
+                series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def snapshot(self) -> Dict[Tuple[str, ...], List[float]]:
+        with self._lock:
+            return {labels: list(series) for labels, series in self._series.items()}
+
+
+class Counter:
+    def __init__(self):
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def snapshot(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+
+stage_seconds = Histogram()
+request_seconds = Histogram()
+requests_total = Counter()
+stitches_total = Counter()
+_in_flight = {"http": 0, "websocket": 0}
+# name -> (help, label names, callable returning {label values: value}), read at scrape time
+_gauges: Dict[str, Tuple[str, Tuple[str, ...], Callable[[], Dict[Tuple[str, ...], float]]]] = {}
+
+
+def record_stage(name: str, seconds: float):
+    """Adds a stage duration to the current trace and (outside workers) its histogram."""
+    trace = _trace.get()
+    if trace is not None:
+        trace[name] = trace.get(name, 0.0) + seconds
+    if not _collect_only.get():
+        stage_seconds.observe((name,), seconds)
+
+
+def record_stages(stages: Optional[Dict[str, float]]):
+    """Stages collected elsewhere (a lane worker) counted as if they ran here."""
+    for name, seconds in (stages or {}).items():
+        record_stage(name, seconds)
+
+
+@contextmanager
+def _timed_stage(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - t0)
+
+
+def stage(name: str):
+    """Context manager timing a named stage (a shared no-op when metrics are disabled)."""
+    return _timed_stage(name) if METRICS_ENABLED else nullcontext()
+
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """Decorator timing every call as stage `name`; returns the function untouched when disabled."""
+    def decorate(fn: Callable) -> Callable:
+        if not METRICS_ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record_stage(name, time.perf_counter() - t0)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def collect_stages():
+    """
+    Used by lane workers around a task: yields a dict that ends up holding the task's
+    stage durations, which are not observed locally (the caller records them).
+    """
+    if not METRICS_ENABLED:
+        yield {}
+        return
+    stages: Dict[str, float] = {}
+    trace_token = _trace.set(stages)
+    collect_token = _collect_only.set(True)
+    try:
+        yield stages
+    finally:
+        _collect_only.reset(collect_token)
+        _trace.reset(trace_token)
+
+
+def count_stitches(source: str, n: int):
+    """Stitch-count counter per generator / endpoint."""
+    if METRICS_ENABLED and n:
+        stitches_total.inc((source,), float(n))
+
+
+def register_gauge(name: str, help: str, labels: Tuple[str, ...], collect: Callable[[], Dict[Tuple[str, ...], float]]):
+    """Gauge evaluated at scrape time (queue depths, active jobs, ...)."""
+    _gauges[name] = (help, labels, collect)
+
+
+@contextmanager
+def websocket_in_flight():
+    _in_flight["websocket"] += 1
+    try:
+        yield
+    finally:
+        _in_flight["websocket"] -= 1
+
+
+def server_timing(stages: Dict[str, float], total: float) -> str:
+    """Server-Timing header value, durations in milliseconds, slowest stages first."""
+    entries = [f"total;dur={total * 1000.0:.1f}"]
+    entries += [f"{name};dur={seconds * 1000.0:.1f}"
+                for name, seconds in sorted(stages.items(), key=lambda item: -item[1])]
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: per-request trace, Server-Timing header, request latency / count per
+    route template, in-flight gauge. "endpoint" is the route body and "serialize" the time
+    from its return to the response start (FastAPI's JSON encoding); see timed_endpoint.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not METRICS_ENABLED or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        trace: Dict[str, float] = {}
+        token = _trace.set(trace)
+        t0 = time.perf_counter()
+        status = 500
+        _in_flight["http"] += 1
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                now = time.perf_counter()
+                handler_end = trace.pop("_handler_end", None)
+                if handler_end is not None:
+                    record_stage("serialize", now - handler_end)
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(trace, now - t0).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _in_flight["http"] -= 1
+            _trace.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            request_seconds.observe((scope["method"], path), time.perf_counter() - t0)
+            requests_total.inc((scope["method"], path, str(status)))
+
+
+def timed_endpoint(endpoint: Callable) -> Callable:
+    """
+    Wraps a route function: its body is the "endpoint" stage and its return time marks
+    the start of "serialize". FastAPI reads the signature through functools.wraps.
+    """
+    if not METRICS_ENABLED or getattr(endpoint, "_embro_timed", False):
+        # include_router re-creates routes from already wrapped endpoints
+        return endpoint
+
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _mark_handler_end(t0)
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                _mark_handler_end(t0)
+    wrapper._embro_timed = True
+    return wrapper
+
+
+def _mark_handler_end(t0: float):
+    now = time.perf_counter()
+    record_stage("endpoint", now - t0)
+    trace = _trace.get()
+    if trace is not None:
+        trace["_handler_end"] = now
+
+
+def _labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+_INF_LABEL = 'le="+Inf"'
+
+
+def _render_histogram(lines: List[str], name: str, help: str, label_names: Tuple[str, ...], histogram: Histogram):
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} histogram")
+    for labels, series in sorted(histogram.snapshot().items()):
+        cumulative = 0.0
+        for bound, count in zip(histogram.buckets, series):
+            cumulative += count
+            le = 'le="%g"' % bound
+            lines.append(f"{name}_bucket{_labels(label_names, labels, le)} {cumulative:g}")
+        cumulative += series[len(histogram.buckets)]
+        lines.append(f"{name}_bucket{_labels(label_names, labels, _INF_LABEL)} {cumulative:g}")
+        lines.append(f"{name}_sum{_labels(label_names, labels)} {series[-1]:.6f}")
+        lines.append(f"{name}_count{_labels(label_names, labels)} {cumulative:g}")
+
+
+def _render_counter(lines: List[str], name: str, help: str, label_names: Tuple[str, ...], counter: Counter):
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} counter")
+    for labels, value in sorted(counter.snapshot().items()):
+        lines.append(f"{name}{_labels(label_names, labels)} {value:g}")
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines: List[str] = []
+    _render_histogram(lines, "embro_stage_duration_seconds", "Time spent per processing stage.",
+                      ("stage",), stage_seconds)
+    _render_histogram(lines, "embro_request_duration_seconds", "HTTP request latency per route.",
+                      ("method", "route"), request_seconds)
+    _render_counter(lines, "embro_requests_total", "HTTP requests per route and status.",
+                    ("method", "route", "status"), requests_total)
+    _render_counter(lines, "embro_stitches_total", "Stitches generated per source.", ("source",), stitches_total)
+
+    lines.append("# HELP embro_in_flight Requests currently being served.")
+    lines.append("# TYPE embro_in_flight gauge")
+    for kind, value in _in_flight.items():
+        lines.append(f'embro_in_flight{{kind="{kind}"}} {value}')
+    for name, (help, label_names, collect) in sorted(_gauges.items()):
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in sorted(collect().items()):
+            lines.append(f"{name}{_labels(label_names, labels)} {value:g}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,252 @@
+import csv
+import json
+import os
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from app.core.kmeans import assign_to_centers
+from app.core.metrics import timed
+
+# Thread-palette quantization: designs end up in catalog thread colors, so instead of
+# clustering and then matching clusters to threads, every pixel goes straight to its
+# nearest catalog thread (CIE LAB distance, delta E 76). The nearest thread of every BGR
+# color, at LUT_BITS per channel, is precomputed once per catalog; quantizing an image is
+# then one table lookup per pixel. With a color limit, threads are picked greedily from
+# the ones the image matched: each step adds the thread that lowers the summed pixel
+# error the most, evaluated on the image's histogram of LUT cells rather than its pixels.
+#
+# Catalogs are JSON ({"name", "threads": [{"id", "name", "hex" or "lab": [L, a, b]}]}) or
+# CSV (columns id, name and hex, or id, name, L, a, b) files named <catalog>.json / .csv,
+# looked up in EMBRO_THREAD_CATALOG_DIR first and in the bundled catalogs/ directory.
+
+BUNDLED_CATALOG_DIR = os.path.join(os.path.dirname(__file__), "catalogs")
+CATALOG_DIR = os.environ.get("EMBRO_THREAD_CATALOG_DIR")
+DEFAULT_CATALOG = os.environ.get("EMBRO_THREAD_CATALOG", "generic")
+
+# Segmentation mode (next to the k-means modes) that quantizes to a catalog
+PALETTE_MODE = "palette"
+
+# Bits per BGR channel of the lookup table: 2^18 cells, every color within 2 levels (of
+# 255) per channel of its cell's center
+LUT_BITS = 6
+
+
+def _lab(bgr: np.ndarray) -> np.ndarray:
+    """CIE LAB (L 0..100) of an (..., 3) uint8 BGR array, as float32."""
+    bgr = np.asarray(bgr, dtype=np.float32).reshape(-1, 1, 3) / 255.0
+    return cv2.cvtColor(bgr, cv2.COLOR_BGR2Lab).reshape(-1, 3)
+
+
+def _hex_bgr(value: str) -> List[int]:
+    h = value.strip().lstrip('#')
+    if len(h) != 6:
+        raise ValueError(f"Invalid thread color: {value}")
+    return [int(h[4:6], 16), int(h[2:4], 16), int(h[0:2], 16)]
+
+
+def _catalog_path(name: str) -> str:
+    if not name or os.path.basename(name) != name or name.startswith('.'):
+        raise ValueError(f"Invalid thread catalog name: {name}")
+    for directory in (CATALOG_DIR, BUNDLED_CATALOG_DIR):
+        for ext in (".json", ".csv"):
+            if directory and os.path.isfile(os.path.join(directory, name + ext)):
+                return os.path.join(directory, name + ext)
+    raise ValueError(f"Unknown thread catalog: {name}")
+
+
+def _read_threads(path: str) -> List[Dict[str, Any]]:
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        return [
+            {"id": row["id"], "name": row.get("name", ""), "hex": row["hex"]} if row.get("hex")
+            else {"id": row["id"], "name": row.get("name", ""), "lab": [float(row["L"]), float(row["a"]), float(row["b"])]}
+            for row in rows
+        ]
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["threads"]
+
+
+@lru_cache(maxsize=16)
+def load_catalog(name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Thread catalog by name: {"name", "ids", "names", "hex" (display colors), "lab" (N, 3)
+    float32}. Threads given only in LAB get the nearest sRGB color as display color.
+    Raises ValueError for unknown or malformed catalogs.
+    """
+    name = name or DEFAULT_CATALOG
+    try:
+        threads = _read_threads(_catalog_path(name))
+        lab = np.empty((len(threads), 3), dtype=np.float32)
+        bgr = np.empty((len(threads), 3), dtype=np.uint8)
+        for i, thread in enumerate(threads):
+            if "lab" in thread:
+                lab[i] = thread["lab"]
+                back = cv2.cvtColor(lab[i].reshape(1, 1, 3), cv2.COLOR_Lab2BGR)
+                bgr[i] = np.clip(np.rint(back.ravel() * 255.0), 0, 255)
+            else:
+                bgr[i] = _hex_bgr(thread["hex"])
+                lab[i] = _lab(bgr[i])[0]
+        ids = [str(thread["id"]) for thread in threads]
+    except (KeyError, TypeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Malformed thread catalog {name}: {e}")
+    if not ids:
+        raise ValueError(f"Thread catalog {name} is empty")
+    return {
+        "name": name,
+        "ids": ids,
+        "names": [str(thread.get("name", "")) for thread in threads],
+        "hex": ["#{:02x}{:02x}{:02x}".format(r, g, b) for b, g, r in bgr.tolist()],
+        "lab": lab,
+    }
+
+
+def _cell_index(bgr: np.ndarray) -> np.ndarray:
+    """LUT cell of every pixel of an (..., 3) uint8 BGR array, flattened."""
+    shift = 8 - LUT_BITS
+    pixels = bgr.reshape(-1, 3)
+    # In place on one int32 array: no full-size temporaries per channel
+    cells = (pixels[:, 0] >> shift).astype(np.int32)
+    for channel in (1, 2):
+        cells <<= LUT_BITS
+        cells |= pixels[:, channel] >> shift
+    return cells
+
+
+@lru_cache(maxsize=1)
+def _cells_lab() -> np.ndarray:
+    """LAB of the center color of every LUT cell."""
+    cells = np.arange(1 << (3 * LUT_BITS))
+    shift = 8 - LUT_BITS
+    mask = (1 << LUT_BITS) - 1
+    bgr = np.column_stack([cells >> (2 * LUT_BITS), (cells >> LUT_BITS) & mask, cells & mask])
+    lab = _lab((bgr << shift) + (1 << shift) // 2)
+    lab.flags.writeable = False
+    return lab
+
+
+@lru_cache(maxsize=4)
+def palette_lut(name: str) -> np.ndarray:
+    """Nearest thread (index into the catalog) of every LUT cell, built once per catalog."""
+    lut, _ = assign_to_centers(_cells_lab(), load_catalog(name)["lab"])
+    lut = lut.astype(np.uint16)
+    lut.flags.writeable = False
+    return lut
+
+
+def _greedy_threads(cell_lab: np.ndarray, counts: np.ndarray, candidates: np.ndarray,
+                    catalog_lab: np.ndarray, colors: int) -> np.ndarray:
+    """
+    Greedy color limit: starting from nothing, repeatedly adds the candidate thread that
+    most lowers the count-weighted distance of every cell to its nearest picked thread.
+    """
+    lab = catalog_lab[candidates]
+    distance = np.sqrt(np.maximum(
+        (cell_lab ** 2).sum(axis=1)[:, None] - 2.0 * (cell_lab @ lab.T) + (lab ** 2).sum(axis=1)[None, :], 0.0))
+    best = np.full(len(cell_lab), np.inf, dtype=np.float32)
+    picked: List[int] = []
+    for _ in range(colors):
+        error = counts @ np.minimum(best[:, None], distance)
+        error[picked] = np.inf
+        pick = int(np.argmin(error))
+        picked.append(pick)
+        best = np.minimum(best, distance[:, pick])
+    return candidates[np.sort(picked)]
+
+
+def palette_tables(
+    bgr: np.ndarray,
+    catalog: Optional[str] = None,
+    colors: int = 0
+) -> Tuple[np.ndarray, np.ndarray, List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Threads for the pixels of a uint8 BGR array (an image or a sample of one) and the
+    tables that quantize any pixel to them: (thread index per LUT cell int32, delta E
+    per LUT cell float32, threads [{"id", "name", "color", "catalog"}] in catalog order,
+    stats {"catalog", "threads_matched", "lut_ms"}).
+
+    Every catalog thread nearest to some pixel is kept; with `colors` > 0 at most that
+    many of them are, picked greedily. Cells (colors) the pixels did not cover go to
+    their nearest kept thread.
+    """
+    colors = int(colors)
+    if colors < 0:
+        raise ValueError("colors must not be negative")
+    t0 = time.perf_counter()
+    entry = load_catalog(catalog)
+    lut = palette_lut(entry["name"])
+    cells_lab = _cells_lab()
+    t1 = time.perf_counter()
+
+    counts = np.bincount(_cell_index(bgr), minlength=len(lut))
+    occupied = np.flatnonzero(counts)
+    matched = np.unique(lut[occupied])
+    if 0 < colors < len(matched):
+        selected = _greedy_threads(cells_lab[occupied], counts[occupied].astype(np.float32), matched, entry["lab"], colors)
+    else:
+        selected = matched
+
+    # Cells whose nearest thread was kept keep it, the others are matched among the kept
+    position = np.full(len(entry["ids"]), -1, dtype=np.int32)
+    position[selected] = np.arange(len(selected))
+    cell_label = position[lut]
+    rest = np.flatnonzero(cell_label < 0)
+    if len(rest):
+        cell_label[rest], _ = assign_to_centers(cells_lab[rest], entry["lab"][selected])
+    cell_error = np.sqrt(((cells_lab - entry["lab"][selected][cell_label]) ** 2).sum(axis=1))
+
+    threads = [
+        {"id": entry["ids"][i], "name": entry["names"][i], "color": entry["hex"][i], "catalog": entry["name"]}
+        for i in selected.tolist()
+    ]
+    stats = {"catalog": entry["name"], "threads_matched": len(matched), "lut_ms": (t1 - t0) * 1000.0}
+    return cell_label, cell_error.astype(np.float32), threads, stats
+
+
+def apply_palette(bgr: np.ndarray, cell_label: np.ndarray, cell_error: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(thread index, delta E) per pixel of an HxWx3 uint8 BGR image, through palette_tables' tables."""
+    cells = _cell_index(bgr)
+    return cell_label[cells].reshape(bgr.shape[:2]), cell_error[cells].reshape(bgr.shape[:2])
+
+
+@timed("palette")
+def quantize_to_palette(
+    bgr: np.ndarray,
+    catalog: Optional[str] = None,
+    colors: int = 0
+) -> Tuple[np.ndarray, List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Nearest-thread labels of an HxWx3 uint8 BGR image, one table lookup per pixel. With
+    `colors` > 0 at most that many threads are used (see palette_tables), 0 keeps every
+    thread the image matched.
+
+    Returns (labels HxW int32 indexing the thread list, threads, stats) where stats
+    mirrors run_kmeans: mode "palette", pixels, latency and mean color error (delta E
+    from pixel to thread), plus the catalog and how many of its threads matched.
+    """
+    t0 = time.perf_counter()
+    cell_label, cell_error, threads, table_stats = palette_tables(bgr, catalog, colors)
+    t1 = time.perf_counter()
+    labels, error = apply_palette(bgr, cell_label, cell_error)
+    t2 = time.perf_counter()
+    stats = {
+        "mode": PALETTE_MODE,
+        **table_stats,
+        "pixels": labels.size,
+        "fit_ms": (t1 - t0) * 1000.0,
+        "assign_ms": (t2 - t1) * 1000.0,
+        "latency_ms": (t2 - t0) * 1000.0,
+        "color_error": float(error.mean(dtype=np.float64)) if labels.size else 0.0,
+    }
+    return labels, threads, stats
+
+
+def catalog_option(mode: str, catalog: Optional[str]) -> Optional[str]:
+    """Catalog a segmentation in `mode` uses: the default one when palette mode names none, None outside palette mode."""
+    if mode != PALETTE_MODE:
+        return None
+    return catalog or DEFAULT_CATALOG
@@ -0,0 +1,54 @@
+import numpy as np
+from typing import Tuple
+
+
+def cumulative_lengths(coords: np.ndarray) -> np.ndarray:
+    """
+    Arc length at every vertex of a polyline (first entry is 0).
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    seg = np.sqrt(np.sum(np.diff(coords, axis=0) ** 2, axis=1))
+    return np.concatenate([[0.0], np.cumsum(seg)])
+
+
+def interpolate_along(coords: np.ndarray, cum: np.ndarray, distances: np.ndarray) -> np.ndarray:
+    """
+    Positions at the given arc-length distances, batched equivalent of
+    LineString.interpolate (distances are clipped to [0, length]).
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    d = np.clip(np.asarray(distances, dtype=np.float64), 0.0, cum[-1])
+    if len(coords) == 1:
+        return np.repeat(coords, len(d), axis=0)
+
+    idx = np.searchsorted(cum, d, side='right') - 1
+    idx = np.clip(idx, 0, len(coords) - 2)
+    seg_len = cum[idx + 1] - cum[idx]
+    t = np.divide(d - cum[idx], seg_len, out=np.zeros_like(d), where=seg_len > 0)
+    return coords[idx] + (coords[idx + 1] - coords[idx]) * t[:, None]
+
+
+def resample_with_normals(
+    coords: np.ndarray,
+    distances: np.ndarray,
+    tangent_step: float = 0.1
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Positions and unit left-normals at every distance in one pass.
+    The tangent is the central difference over +/- tangent_step along the path;
+    degenerate spots get a zero normal.
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    cum = cumulative_lengths(coords)
+    length = cum[-1]
+
+    points = interpolate_along(coords, cum, distances)
+    p1 = interpolate_along(coords, cum, np.maximum(0.0, distances - tangent_step))
+    p2 = interpolate_along(coords, cum, np.minimum(length, distances + tangent_step))
+
+    delta = p2 - p1
+    norm_len = np.sqrt(np.sum(delta ** 2, axis=1))
+    safe = np.where(norm_len == 0, 1.0, norm_len)
+    normals = np.column_stack([-delta[:, 1], delta[:, 0]]) / safe[:, None]
+    normals[norm_len == 0] = 0.0
+    return points, normals
@@ -0,0 +1,136 @@
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.core.stitch_buffer import StitchBuffer, STITCH, JUMP, TRIM, COLOR_CHANGE
+from app.core.metrics import timed
+
+# Coordinates are in embroidery units: 1 unit = 0.1 mm
+MM_PER_UNIT = 0.1
+
+# Thread model shared with export_processor.thread_usage
+TOP_THREAD_SLACK = 1.05
+BOBBIN_RATIO = 0.70
+
+# Sew-time model: machine speed plus fixed penalties per jump / trim / color change.
+# Every key can be overridden per request (see sew_time).
+DEFAULT_MACHINE = {
+    "speed_spm": float(os.environ.get("EMBRO_MACHINE_SPM", 800)),  # stitches per minute
+    "jump_s": 0.1,            # frame move without needle
+    "trim_s": 5.0,            # trim cycle
+    "color_change_s": 12.0,   # needle change (or operator thread change)
+    "max_stitch_mm": 12.1,    # longer stitches are sewn as several (the DST writer splits them)
+}
+
+# Stitch-length histogram edges in mm (the last bin is open-ended)
+DEFAULT_LENGTH_BINS_MM = (0.0, 0.5, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 10.0, 12.1)
+
+
+def sew_time(counts: Dict[str, int], machine: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """
+    Estimated run time in seconds from command counts, with a per-term breakdown.
+    """
+    model = {**DEFAULT_MACHINE, **(machine or {})}
+    breakdown = {
+        "stitching_s": (counts["stitches"] + counts.get("split_stitches", 0)) * 60.0 / model["speed_spm"],
+        "jumps_s": counts["jumps"] * model["jump_s"],
+        "trims_s": counts["trims"] * model["trim_s"],
+        "color_changes_s": counts["color_changes"] * model["color_change_s"],
+    }
+    return {"total_s": sum(breakdown.values()), **breakdown, "machine": model}
+
+
+@timed("production_stats")
+def production_stats(
+    buffer: StitchBuffer,
+    layer_starts: Sequence[int],
+    colors: Sequence[str],
+    machine: Optional[Dict[str, float]] = None,
+    bins_mm: Optional[Sequence[float]] = None
+) -> Dict[str, Any]:
+    """
+    Production statistics of an assembled stitch buffer, all computed on its arrays:
+    command counts (in total and per object), stitch-length histogram, thread per color
+    and estimated sew time.
+
+    `layer_starts[i]` is the buffer index where layer i begins and `colors[i]` its color;
+    layers sharing a color are reported together. Thread is the length of every stitch
+    from the previous needle position (jumps and trims carry none). "split_stitches"
+    counts the extra stitches the writer inserts into stitches longer than the
+    machine's max_stitch_mm.
+    """
+    model = {**DEFAULT_MACHINE, **(machine or {})}
+    commands = buffer.commands
+    coords = buffer.coords.astype(np.float64)
+    n = len(commands)
+
+    is_stitch = commands == STITCH
+    stitch_idx = np.flatnonzero(is_stitch)
+    # A color change before the first stitch only selects the first thread
+    first_stitch = stitch_idx[0] if len(stitch_idx) else n
+    counts = {
+        "stitches": int(len(stitch_idx)),
+        "jumps": int((commands == JUMP).sum()),
+        "trims": int((commands == TRIM).sum()),
+        "color_changes": int((commands[first_stitch:] == COLOR_CHANGE).sum()),
+    }
+
+    # Length of each stitch from the previous buffer position (the needle), per column
+    dx = np.diff(coords[:, 0], prepend=coords[:1, 0])
+    dy = np.diff(coords[:, 1], prepend=coords[:1, 1])
+    lengths_mm = np.hypot(dx[stitch_idx], dy[stitch_idx]) * MM_PER_UNIT
+    splits = np.maximum(np.ceil(lengths_mm / model["max_stitch_mm"]) - 1, 0)
+    counts["split_stitches"] = int(splits.sum())
+
+    edges = np.asarray(bins_mm if bins_mm is not None else DEFAULT_LENGTH_BINS_MM, dtype=np.float64)
+    hist, _ = np.histogram(lengths_mm, bins=np.append(edges, np.inf))
+    length_stats = {
+        "edges_mm": edges.tolist(),
+        "counts": hist.tolist(),
+        "min_mm": float(lengths_mm.min()) if len(lengths_mm) else None,
+        "mean_mm": float(lengths_mm.mean()) if len(lengths_mm) else None,
+        "max_mm": float(lengths_mm.max()) if len(lengths_mm) else None,
+    }
+
+    # Per layer via bincount, then merged by color in order of first use
+    starts = np.asarray(layer_starts, dtype=np.int64)
+    n_layers = len(starts)
+    layer_of = np.clip(np.searchsorted(starts, stitch_idx, side="right") - 1, 0, max(n_layers - 1, 0))
+    layer_mm = np.bincount(layer_of, weights=lengths_mm, minlength=n_layers)
+    layer_stitches = np.bincount(layer_of, minlength=n_layers)
+
+    # Jumps and trims per object (layer)
+    command_layer = np.clip(np.searchsorted(starts, np.arange(n), side="right") - 1, 0, max(n_layers - 1, 0))
+    layer_jumps = np.bincount(command_layer[commands == JUMP], minlength=n_layers)
+    layer_trims = np.bincount(command_layer[commands == TRIM], minlength=n_layers)
+    objects = [
+        {"layer": i, "stitches": int(layer_stitches[i]), "jumps": int(layer_jumps[i]), "trims": int(layer_trims[i])}
+        for i in range(n_layers)
+    ]
+
+    per_color: Dict[str, Dict[str, Any]] = {}
+    for i in range(n_layers):
+        color = colors[i] if i < len(colors) else "#000000"
+        entry = per_color.setdefault(color, {"color": color, "layers": [], "stitches": 0, "thread_mm": 0.0})
+        entry["layers"].append(i)
+        entry["stitches"] += int(layer_stitches[i])
+        entry["thread_mm"] += float(layer_mm[i])
+
+    threads: List[Dict[str, Any]] = []
+    for entry in per_color.values():
+        thread_mm = entry.pop("thread_mm")
+        entry["top_thread_m"] = thread_mm * TOP_THREAD_SLACK / 1000.0
+        entry["bobbin_thread_m"] = thread_mm * BOBBIN_RATIO / 1000.0
+        threads.append(entry)
+
+    total_mm = float(lengths_mm.sum())
+    return {
+        "counts": counts,
+        "stitch_length": length_stats,
+        "threads": threads,
+        "objects": objects,
+        "top_thread_m": total_mm * TOP_THREAD_SLACK / 1000.0,
+        "bobbin_thread_m": total_mm * BOBBIN_RATIO / 1000.0,
+        "sew_time": sew_time(counts, model),
+    }
@@ -0,0 +1,122 @@
+import time
+import numpy as np
+from typing import Tuple
+
+
+def tour_jump_length(entries: np.ndarray, exits: np.ndarray, order: np.ndarray = None) -> float:
+    """
+    Total travel between consecutive objects: exit of object i to entry of object i+1.
+    """
+    if order is not None:
+        entries, exits = entries[order], exits[order]
+    if len(entries) < 2:
+        return 0.0
+    return float(np.sum(np.sqrt(np.sum((entries[1:] - exits[:-1]) ** 2, axis=1))))
+
+
+def _dist(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return np.sqrt(np.sum((a - b) ** 2, axis=-1))
+
+
+def improve_order(
+    entries: np.ndarray,
+    exits: np.ndarray,
+    symmetric: np.ndarray,
+    time_budget: float = 0.1,
+    eps: float = 1e-9
+) -> Tuple[np.ndarray, int]:
+    """
+    Bounded local search over an object sequence (the first object stays in place).
+
+    - Or-opt: move a run of 1-3 consecutive objects to the best other position,
+      keeping their direction. Every insertion point is scored in one vector op.
+    - 2-opt: reverse a run, only where every object in it is symmetric
+      (entry == exit, i.e. a single closed contour), so reversal is free.
+
+    Stops when a full pass finds nothing or `time_budget` seconds have elapsed.
+    Returns (order, number_of_moves).
+    """
+    n = len(entries)
+    order = np.arange(n)
+    if n < 3 or time_budget <= 0:
+        return order, 0
+
+    deadline = time.perf_counter() + time_budget
+    moves = 0
+    improved = True
+
+    while improved and time.perf_counter() < deadline:
+        improved = False
+
+        # --- Or-opt ---
+        for seg_len in (1, 2, 3):
+            i = 1
+            while i + seg_len <= n:
+                if time.perf_counter() >= deadline:
+                    return order, moves
+                seg = order[i:i + seg_len]
+                prev = order[i - 1]
+                nxt = order[i + seg_len] if i + seg_len < n else -1
+                seg_in, seg_out = entries[seg[0]], exits[seg[-1]]
+
+                gain = _dist(exits[prev], seg_in)
+                if nxt >= 0:
+                    gain += _dist(seg_out, entries[nxt]) - _dist(exits[prev], entries[nxt])
+
+                rest = np.concatenate([order[:i], order[i + seg_len:]])
+                rest_exit = exits[rest]
+                add = _dist(rest_exit, seg_in)
+                # Inserting after rest[j]: rest[j+1] (if any) now follows the segment
+                follow = np.zeros(len(rest))
+                follow[:-1] = _dist(seg_out, entries[rest[1:]]) - _dist(rest_exit[:-1], entries[rest[1:]])
+                cost = add + follow
+                # Re-inserting where it came from is a no-op
+                cost[i - 1] = np.inf
+
+                j = int(np.argmin(cost))
+                if cost[j] < gain - eps:
+                    order = np.concatenate([rest[:j + 1], seg, rest[j + 1:]])
+                    moves += 1
+                    improved = True
+                else:
+                    i += 1
+
+        # --- 2-opt on runs of symmetric objects ---
+        # run_end[k]: first index >= k holding an asymmetric object. Reversals stay
+        # inside symmetric runs, so this holds for the whole pass.
+        sym = symmetric[order]
+        run_end = np.empty(n + 1, dtype=np.intp)
+        run_end[n] = n
+        for k in range(n - 1, -1, -1):
+            run_end[k] = run_end[k + 1] if sym[k] else k
+
+        i = 0
+        while i < n - 2:
+            if time.perf_counter() >= deadline:
+                return order, moves
+            # Longest symmetric run starting at i+1
+            start = i + 1
+            end = run_end[start]
+            if end - start < 2:
+                i += 1
+                continue
+
+            js = np.arange(start + 1, end)
+            a_exit = exits[order[i]]
+            p_first = entries[order[start]]
+            p_j = entries[order[js]]
+            delta = _dist(a_exit, p_j) - _dist(a_exit, p_first)
+            has_next = js + 1 < n
+            nxt_entry = entries[order[np.minimum(js + 1, n - 1)]]
+            delta += np.where(has_next, _dist(p_first, nxt_entry) - _dist(p_j, nxt_entry), 0.0)
+
+            k = int(np.argmin(delta))
+            if delta[k] < -eps:
+                j = js[k]
+                order[start:j + 1] = order[start:j + 1][::-1]
+                moves += 1
+                improved = True
+            else:
+                i += 1
+
+    return order, moves
@@ -0,0 +1,189 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
+
+from app.core.cache import LRUByteCache, content_key
+from app.core.polyline import cumulative_lengths
+from app.core.metrics import timed
+
+# Medial axis (skeleton) of fill shapes, for the center-walk underlay and the satin
+# column direction. The boundary (holes included) is sampled and GEOS triangulates the
+# samples (Delaunay, O(n log n)); the dual Voronoi edges whose ends (triangle
+# circumcenters) lie inside the shape make up the axis. Edges generated by two samples that are close along the boundary only
+# model boundary curvature or a blunt corner and are pruned: an edge is kept when the
+# boundary between its two samples is longer than PRUNE_RATIO times its distance to
+# them (the ratio is 2 for a right-angle corner, pi for a round end, and much larger
+# along a column). The trunk is the longest path through what is left.
+
+# Boundary samples per shape, more for thin shapes up to the maximum (existing vertices
+# are always kept)
+SKELETON_SAMPLES = int(os.environ.get("EMBRO_SKELETON_SAMPLES", 256))
+SKELETON_MAX_SAMPLES = 2048
+PRUNE_RATIO = 2.5
+
+# Skeletons keyed by polygon WKB; digitizing a layer asks twice (underlay, satin angle)
+# and re-exports of unchanged shapes ask again
+skeleton_cache = LRUByteCache(int(os.environ.get("EMBRO_SKELETON_CACHE_MAX_BYTES", 32 * 1024 * 1024)))
+
+_EMPTY = {
+    "nodes": np.empty((0, 2)),
+    "radius": np.empty(0),
+    "edges": np.empty((0, 2), dtype=np.intp),
+    "trunk": np.empty((0, 2)),
+    "trunk_radius": np.empty(0),
+}
+
+
+def _boundary_samples(polygon: Polygon) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Boundary samples of every ring: points, ring index and arc length along the ring
+    per sample, and the length of each ring.
+    """
+    # Half a column width at most (area / perimeter is that for a long thin column)
+    perimeter = polygon.boundary.length
+    spacing = max(min(perimeter / SKELETON_SAMPLES, polygon.area / perimeter), perimeter / SKELETON_MAX_SAMPLES)
+    rings = [polygon.exterior, *polygon.interiors]
+    points, ring_of, arc, lengths = [], [], [], []
+    for r, ring in enumerate(rings):
+        coords = shapely.get_coordinates(shapely.segmentize(ring, spacing) if spacing > 0 else ring)[:-1]
+        cum = cumulative_lengths(np.vstack([coords, coords[:1]]))
+        points.append(coords)
+        ring_of.append(np.full(len(coords), r))
+        arc.append(cum[:-1])
+        lengths.append(cum[-1])
+    return np.vstack(points), np.concatenate(ring_of), np.concatenate(arc), np.asarray(lengths)
+
+
+def _compute(polygon: Polygon) -> Dict[str, np.ndarray]:
+    points, ring_of, arc, ring_length = _boundary_samples(polygon)
+    if len(points) < 3:
+        return _EMPTY
+
+    # Delaunay triangles of the samples, as sample indices (GEOS keeps input coordinates)
+    triangles = shapely.get_parts(shapely.delaunay_triangles(shapely.multipoints(points)))
+    if len(triangles) == 0:
+        return _EMPTY
+    corners = shapely.get_coordinates(triangles).reshape(-1, 4, 2)[:, :3]
+    keys = points[:, 0] + 1j * points[:, 1]
+    order = np.argsort(keys)
+    vertex = order[np.searchsorted(keys[order], corners[..., 0] + 1j * corners[..., 1])]
+
+    # Voronoi vertices are the circumcenters, at the circumradius from their samples
+    a, b, c = corners[:, 0], corners[:, 1], corners[:, 2]
+    ab, ac = b - a, c - a
+    d = 2.0 * (ab[:, 0] * ac[:, 1] - ab[:, 1] * ac[:, 0])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ux = (ac[:, 1] * (ab ** 2).sum(axis=1) - ab[:, 1] * (ac ** 2).sum(axis=1)) / d
+        uy = (ab[:, 0] * (ac ** 2).sum(axis=1) - ac[:, 0] * (ab ** 2).sum(axis=1)) / d
+    centers = a + np.column_stack([ux, uy])
+    radius = np.hypot(ux, uy)
+    inside = np.isfinite(radius) & shapely.contains_xy(polygon, centers[:, 0], centers[:, 1])
+
+    # A Voronoi edge joins the circumcenters of two triangles sharing a Delaunay edge,
+    # whose end samples generate it
+    pairs = np.sort(np.stack([vertex[:, [0, 1]], vertex[:, [1, 2]], vertex[:, [2, 0]]], axis=1).reshape(-1, 2), axis=1)
+    owner = np.repeat(np.arange(len(vertex)), 3)
+    edge_key = pairs[:, 0] * len(points) + pairs[:, 1]
+    by_key = np.argsort(edge_key, kind="stable")
+    shared = np.flatnonzero(edge_key[by_key][1:] == edge_key[by_key][:-1])
+    first, second = by_key[shared], by_key[shared + 1]
+    t1, t2 = owner[first], owner[second]
+    site_a, site_b = pairs[first, 0], pairs[first, 1]
+    keep = inside[t1] & inside[t2]
+
+    same_ring = ring_of[site_a] == ring_of[site_b]
+    along = np.abs(arc[site_a] - arc[site_b])
+    along = np.where(same_ring, np.minimum(along, ring_length[ring_of[site_a]] - along), np.inf)
+    reach = np.hypot(*(points[site_a] - (centers[t1] + centers[t2]) / 2.0).T)
+    keep &= along > PRUNE_RATIO * reach
+    if not keep.any():
+        return _EMPTY
+
+    # Graph over the circumcenters that kept an edge
+    used, graph_edges = np.unique(np.column_stack([t1[keep], t2[keep]]), return_inverse=True)
+    graph_edges = graph_edges.reshape(-1, 2)
+    nodes, radius = centers[used], radius[used]
+    trunk = _longest_path(nodes, graph_edges, int(np.argmax(radius)))
+    return {
+        "nodes": nodes,
+        "radius": radius,
+        "edges": graph_edges,
+        "trunk": nodes[trunk],
+        "trunk_radius": radius[trunk],
+    }
+
+
+def _longest_path(nodes: np.ndarray, edges: np.ndarray, seed: int) -> List[int]:
+    """
+    Node indices of the longest path in the component of `seed`: the farthest node from
+    the seed, then the farthest from that one, both along a depth-first spanning tree.
+    Exact on trees (the skeleton of a shape without holes); around a hole the walk
+    keeps one side of the loop.
+    """
+    weight = np.hypot(*(nodes[edges[:, 0]] - nodes[edges[:, 1]]).T)
+    adjacency: List[List[Tuple[int, float]]] = [[] for _ in range(len(nodes))]
+    for (u, v), w in zip(edges.tolist(), weight.tolist()):
+        adjacency[u].append((v, w))
+        adjacency[v].append((u, w))
+
+    def farthest(source: int) -> Tuple[int, List[int]]:
+        dist = [-1.0] * len(nodes)
+        prev = [-1] * len(nodes)
+        dist[source] = 0.0
+        stack = [source]
+        while stack:
+            u = stack.pop()
+            for v, w in adjacency[u]:
+                if dist[v] < 0.0:
+                    dist[v] = dist[u] + w
+                    prev[v] = u
+                    stack.append(v)
+        return int(np.argmax(dist)), prev
+
+    end, _ = farthest(seed)
+    other, prev = farthest(end)
+    path = [other]
+    while path[-1] != end:
+        path.append(prev[path[-1]])
+    return path
+
+
+@timed("skeleton")
+def medial_axis(polygon: Polygon) -> Dict[str, np.ndarray]:
+    """
+    Pruned medial axis of a polygon: {"nodes": Nx2, "radius": distance of each node to
+    the boundary, "edges": Ex2 node indices, "trunk": Kx2 longest path through the axis,
+    "trunk_radius": K}. All arrays are empty for degenerate shapes. Cached per polygon.
+    """
+    if polygon.is_empty or polygon.geom_type != "Polygon":
+        return _EMPTY
+    key = content_key(shapely.to_wkb(polygon), samples=(SKELETON_SAMPLES, SKELETON_MAX_SAMPLES), prune=PRUNE_RATIO)
+    skeleton = skeleton_cache.get(key)
+    if skeleton is None:
+        skeleton = _compute(polygon)
+        for array in skeleton.values():
+            array.flags.writeable = False
+        skeleton_cache.put(key, skeleton, sum(array.nbytes for array in skeleton.values()))
+    return skeleton
+
+
+def column_angle(polygon: Polygon) -> Optional[float]:
+    """
+    Direction of the shape's trunk in degrees (length-weighted mean of its segment
+    directions, modulo 180), or None when the trunk is no longer than the shape is wide.
+    """
+    skeleton = medial_axis(polygon)
+    trunk = skeleton["trunk"]
+    if len(trunk) < 2:
+        return None
+    dx, dy = np.diff(trunk, axis=0).T
+    length = np.hypot(dx, dy)
+    if length.sum() <= skeleton["trunk_radius"].max():
+        # Blob rather than column (a disk's axis is its center)
+        return None
+    # Doubled angles, so opposite segment directions agree
+    doubled = 2.0 * np.arctan2(dy, dx)
+    return float(np.degrees(0.5 * np.arctan2((length * np.sin(doubled)).sum(), (length * np.cos(doubled)).sum())))
@@ -0,0 +1,115 @@
+import math
+import numpy as np
+from typing import Dict, List, Optional, Tuple, Hashable
+
+
+class GridIndex:
+    """
+    Uniform-grid point index with deletion, used for nearest-neighbour ordering.
+    Every item owns one or more points (e.g. all vertices of a closed contour);
+    `nearest` returns the closest remaining point together with its owner,
+    and `remove` drops all points of an item at once.
+    """
+
+    def __init__(self, cell_size: float):
+        self.cell_size = max(float(cell_size), 1e-9)
+        self._cells: Dict[Tuple[int, int], Dict[Hashable, List[Tuple[int, float, float]]]] = {}
+        self._item_cells: Dict[Hashable, List[Tuple[int, int]]] = {}
+        self._bounds = None  # (min_ix, min_iy, max_ix, max_iy) over all inserted cells
+
+    @classmethod
+    def for_points(cls, points: np.ndarray, target_per_cell: float = 4.0) -> "GridIndex":
+        """
+        Picks a cell size so that, on average, each occupied cell holds a few points.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(points) == 0:
+            return cls(1.0)
+        span = points.max(axis=0) - points.min(axis=0)
+        area = max(span[0], 1e-6) * max(span[1], 1e-6)
+        cell = np.sqrt(area * target_per_cell / len(points))
+        return cls(max(cell, 1e-6))
+
+    def __len__(self) -> int:
+        return len(self._item_cells)
+
+    def __contains__(self, item: Hashable) -> bool:
+        return item in self._item_cells
+
+    def _key(self, x: float, y: float) -> Tuple[int, int]:
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def insert(self, item: Hashable, points: np.ndarray):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(points) == 0:
+            return
+        cells = np.floor(points / self.cell_size).astype(np.int64)
+        keys = list(map(tuple, cells.tolist()))
+        for vi, (key, (x, y)) in enumerate(zip(keys, points.tolist())):
+            self._cells.setdefault(key, {}).setdefault(item, []).append((vi, x, y))
+
+        lo, hi = cells.min(axis=0).tolist(), cells.max(axis=0).tolist()
+        if self._bounds is None:
+            self._bounds = [lo[0], lo[1], hi[0], hi[1]]
+        else:
+            b = self._bounds
+            b[0], b[1] = min(b[0], lo[0]), min(b[1], lo[1])
+            b[2], b[3] = max(b[2], hi[0]), max(b[3], hi[1])
+        self._item_cells[item] = list(set(keys))
+
+    def remove(self, item: Hashable):
+        for key in self._item_cells.pop(item, []):
+            cell = self._cells.get(key)
+            if cell is None:
+                continue
+            cell.pop(item, None)
+            if not cell:
+                del self._cells[key]
+
+    def nearest(self, x: float, y: float) -> Optional[Tuple[Hashable, int, float]]:
+        """
+        (item, vertex_index, distance) of the closest remaining point, or None when empty.
+        Searches rings of cells outward and stops once no farther ring can do better.
+        """
+        if not self._item_cells:
+            return None
+
+        cx, cy = self._key(x, y)
+        min_ix, min_iy, max_ix, max_iy = self._bounds
+        max_ring = max(abs(cx - min_ix), abs(cx - max_ix), abs(cy - min_iy), abs(cy - max_iy))
+
+        best = None
+        best_d2 = float('inf')
+        for r in range(max_ring + 1):
+            # Few occupied cells left: scanning them all beats walking empty rings
+            scan_all = (2 * r + 1) ** 2 >= len(self._cells)
+            keys = list(self._cells.keys()) if scan_all else self._ring(cx, cy, r)
+            for key in keys:
+                cell = self._cells.get(key)
+                if not cell:
+                    continue
+                for item, entries in cell.items():
+                    for vi, px, py in entries:
+                        d2 = (px - x) ** 2 + (py - y) ** 2
+                        if d2 < best_d2:
+                            best_d2 = d2
+                            best = (item, vi)
+            # Anything in ring r+1 is at least r cells away from the query
+            if scan_all or (best is not None and best_d2 <= (r * self.cell_size) ** 2):
+                break
+
+        if best is None:
+            return None
+        return best[0], best[1], math.sqrt(best_d2)
+
+    @staticmethod
+    def _ring(cx: int, cy: int, r: int):
+        if r == 0:
+            yield (cx, cy)
+            return
+        for ix in range(cx - r, cx + r + 1):
+            yield (ix, cy - r)
+            yield (ix, cy + r)
+        for iy in range(cy - r + 1, cy + r):
+            yield (cx - r, iy)
+            yield (cx + r, iy)
@@ -0,0 +1,151 @@
+import numpy as np
+from typing import List, Optional, Iterable
+
+# Command codes match pyembroidery's constants so a buffer can be handed to the
+# encoders without translating every stitch.
+STITCH = 0
+JUMP = 1
+TRIM = 2
+END = 4
+COLOR_CHANGE = 5
+
+
+class StitchBuffer:
+    """
+    Compact, growable stitch store: an Nx2 coordinate array plus a uint8 command array.
+    Generators, tie stitches, connectors and exporters append to it in place;
+    storage grows geometrically so appends are amortized O(1) per stitch.
+    """
+
+    __slots__ = ("_coords", "_commands", "_size")
+
+    def __init__(self, capacity: int = 1024, dtype=np.float32):
+        capacity = max(16, int(capacity))
+        self._coords = np.empty((capacity, 2), dtype=dtype)
+        self._commands = np.empty(capacity, dtype=np.uint8)
+        self._size = 0
+
+    @classmethod
+    def from_points(cls, points: Iterable, command: int = STITCH, dtype=np.float32) -> "StitchBuffer":
+        """
+        Builds a buffer from an Nx2 array-like, every point tagged with `command`.
+        """
+        arr = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        buf = cls(capacity=len(arr), dtype=dtype)
+        buf.extend(arr, command)
+        return buf
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def coords(self) -> np.ndarray:
+        """Nx2 view of the stored coordinates (no copy)."""
+        return self._coords[:self._size]
+
+    @property
+    def commands(self) -> np.ndarray:
+        """N view of the stored command codes (no copy)."""
+        return self._commands[:self._size]
+
+    @property
+    def nbytes(self) -> int:
+        return self.coords.nbytes + self.commands.nbytes
+
+    def reserve(self, extra: int):
+        """
+        Ensures room for `extra` more stitches without reallocating.
+        """
+        needed = self._size + extra
+        capacity = len(self._commands)
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2)
+        coords = np.empty((new_capacity, 2), dtype=self._coords.dtype)
+        commands = np.empty(new_capacity, dtype=np.uint8)
+        coords[:self._size] = self._coords[:self._size]
+        commands[:self._size] = self._commands[:self._size]
+        self._coords, self._commands = coords, commands
+
+    def append(self, x: float, y: float, command: int = STITCH):
+        self.reserve(1)
+        self._coords[self._size] = (x, y)
+        self._commands[self._size] = command
+        self._size += 1
+
+    def extend(self, points, command: int = STITCH):
+        """
+        Appends an Nx2 block of points with a single command code.
+        """
+        arr = np.asarray(points).reshape(-1, 2)
+        n = len(arr)
+        if n == 0:
+            return
+        self.reserve(n)
+        self._coords[self._size:self._size + n] = arr
+        self._commands[self._size:self._size + n] = command
+        self._size += n
+
+    def extend_buffer(self, other: "StitchBuffer"):
+        """
+        Appends another buffer, keeping its per-stitch commands.
+        """
+        n = len(other)
+        if n == 0:
+            return
+        self.reserve(n)
+        self._coords[self._size:self._size + n] = other.coords
+        self._commands[self._size:self._size + n] = other.commands
+        self._size += n
+
+    def stitch(self, x: float, y: float):
+        self.append(x, y, STITCH)
+
+    def jump(self, x: float, y: float):
+        """Absolute move without thread."""
+        self.append(x, y, JUMP)
+
+    def trim(self):
+        """Trim at the current needle position."""
+        x, y = self._current_position()
+        self.append(x, y, TRIM)
+
+    def color_change(self):
+        """Color change at the current needle position."""
+        x, y = self._current_position()
+        self.append(x, y, COLOR_CHANGE)
+
+    def end(self):
+        x, y = self._current_position()
+        self.append(x, y, END)
+
+    def last_point(self) -> Optional[np.ndarray]:
+        if self._size == 0:
+            return None
+        return self._coords[self._size - 1]
+
+    def _current_position(self):
+        if self._size == 0:
+            return 0.0, 0.0
+        x, y = self._coords[self._size - 1]
+        return float(x), float(y)
+
+    def stitch_points(self) -> np.ndarray:
+        """Coordinates of STITCH commands only (thread-carrying needle drops)."""
+        return self.coords[self.commands == STITCH]
+
+    def to_list(self) -> List[List[float]]:
+        """[[x, y], ...] for JSON responses."""
+        return self.coords.tolist()
+
+    def to_stitch_list(self, truncate: bool = True) -> List[list]:
+        """
+        [[x, y, command], ...], the layout pyembroidery keeps in EmbPattern.stitches.
+        With `truncate` coordinates become ints, truncated toward zero like int().
+        """
+        commands = self.commands.tolist()
+        if truncate:
+            xy = np.trunc(self.coords).astype(np.int64).tolist()
+        else:
+            xy = self.coords.astype(np.float64).tolist()
+        return [[x, y, c] for (x, y), c in zip(xy, commands)]
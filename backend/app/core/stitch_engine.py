@@ -3,6 +3,12 @@ import shapely
 from shapely.geometry import Polygon, LineString, MultiLineString, Point
 from shapely.affinity import rotate, translate
 from typing import List, Tuple, Optional
+from app.core.scanline import polygon_edges, scanline_segments, rotate_points
+from app.core.fill_sections import plan_fill, insert_travel
+from app.core.polyline import cumulative_lengths, interpolate_along
+from app.core.skeleton import column_angle, medial_axis
+from app.core.stitch_buffer import StitchBuffer
+from app.core.metrics import timed
 
 class StitchEngine:
     """
@@ -21,13 +27,26 @@ class StitchEngine:
         return polygon.buffer(compensation_mm, join_style=shapely.geometry.JOIN_STYLE.round)
 
     @staticmethod
-    def generate_center_walk(polygon: Polygon, stitch_length: float = 2.0) -> List[Tuple[float, float]]:
+    @timed("engine.center_walk")
+    def generate_center_walk(polygon: Polygon, stitch_length: float = 2.0, inset: float = 2.0) -> np.ndarray:
         """
         Generates a center-line run stitch for underlay.
-        Uses approximation by creating a negative buffer and finding the centroid, or simple interpolation.
-        For complex shapes, medial axis transform is ideal, but costly.
-        Simplified approach: Return a path connecting centroids of subsections or just the centroid for small shapes.
+        Runs along the trunk of the shape's medial axis (app.core.skeleton), ends pulled
+        back to where the shape is at least `inset` wide on each side. Blobs without a
+        trunk (disks, squares) get the old short line through the centroid.
         """
+        if isinstance(polygon, shapely.geometry.MultiPolygon):
+            polygon = max(polygon.geoms, key=lambda a: a.area)
+        skeleton = medial_axis(polygon)
+        trunk = skeleton["trunk"]
+        wide = np.flatnonzero(skeleton["trunk_radius"] >= inset)
+        if len(wide) >= 2:
+            trunk = trunk[wide[0]:wide[-1] + 1]
+            cum = cumulative_lengths(trunk)
+            if cum[-1] > 0:
+                count = max(2, int(cum[-1] / stitch_length) + 1)
+                return interpolate_along(trunk, cum, np.linspace(0.0, cum[-1], count))
+
         # Very simplified center walk: Just a few points inside
         try:
              center = polygon.centroid
@@ -40,22 +59,30 @@ class StitchEngine:
              restricted_line = line.intersection(polygon)
              
              if restricted_line.is_empty:
-                 return [(center.x, center.y)]
+                 return np.array([[center.x, center.y]])
              
              if isinstance(restricted_line, LineString):
-                 return list(restricted_line.coords)
-             return []
+                 return np.asarray(restricted_line.coords)[:, :2]
+             return np.empty((0, 2))
         except:
-            return []
+            return np.empty((0, 2))
 
     @staticmethod
-    def generate_edge_walk(polygon: Polygon, offset_mm: float = 0.5, stitch_length: float = 2.0) -> List[Tuple[float, float]]:
+    @timed("engine.edge_walk")
+    def generate_edge_walk(
+        polygon: Polygon,
+        offset_mm: float = 0.5,
+        stitch_length: float = 2.0,
+        start: Optional[np.ndarray] = None
+    ) -> np.ndarray:
         """
         Generates a running stitch along the inside edge of the shape.
+        With `start` the loop begins at the point of the edge nearest to it, led in by
+        run stitches from `start` (excluded) when that point is more than a stitch away.
         """
         inset_poly = polygon.buffer(-offset_mm)
         if inset_poly.is_empty:
-            return []
+            return np.empty((0, 2))
         
         # If multipolygon (e.g. hole created), take exterior of largest
         if isinstance(inset_poly, shapely.geometry.MultiPolygon):
@@ -66,240 +93,227 @@ class StitchEngine:
         length = boundary.length
         num_points = int(length / stitch_length)
         if num_points < 3:
-             return list(boundary.coords)
+             return np.asarray(boundary.coords)[:, :2]
              
-        points = [boundary.interpolate(distance).coords[0] for distance in np.linspace(0, length, num_points)]
+        distances = np.linspace(0, length, num_points)
+        if start is not None:
+            distances = (distances + boundary.project(Point(start[0], start[1]))) % length
+        # One batched GEOS call for every sample along the ring
+        points = shapely.get_coordinates(shapely.line_interpolate_point(boundary, distances))
+        if start is not None:
+            gap = float(np.hypot(*(points[0] - start[:2])))
+            if gap > stitch_length:
+                steps = np.linspace(0.0, 1.0, int(np.ceil(gap / stitch_length)) + 1)[1:-1, None]
+                points = np.vstack([start[:2] + steps * (points[0] - start[:2]), points])
         return points
 
     @staticmethod
+    @timed("engine.tatami")
     def generate_tatami_fill(
         polygon: Polygon, 
         density: float = 0.4, # Spacing between rows
         angle_deg: float = 45.0,
         stitch_length: float = 3.5,
-        offset: float = 0.0 # 0.0 to 1.0, shifts pattern
-    ) -> List[Tuple[float, float]]:
+        offset: float = 0.0, # 0.0 to 1.0, shifts pattern
+        start: Optional[np.ndarray] = None,
+        stats: Optional[dict] = None
+    ) -> np.ndarray:
         """
         Generates a Tatami (Fill) stitch pattern with offset support to avoid moiré.
+        Rows are computed in one batched even-odd scanline pass (holes included), then
+        sewn section by section with travel runs inside the shape instead of stitches
+        across concave gaps and holes (see app.core.fill_sections). With `start` the
+        fill begins at the section corner nearest to it (e.g. where the underlay ended);
+        `stats` (if given) receives the sections / travel_runs / travel_length / jumps counts.
         """
-        # 1. Rotate
-        rotated_poly = rotate(polygon, -angle_deg, origin=(0,0))
-        minx, miny, maxx, maxy = rotated_poly.bounds
-        
+        # 1. Rotate (edge list only, the polygon itself is never rebuilt)
+        edges = polygon_edges(polygon, angle_deg)
+        if len(edges) == 0:
+            return np.empty((0, 2))
+        miny, maxy = edges[:, [1, 3]].min(), edges[:, [1, 3]].max()
+
         # 2. Generate Scanlines
         y_lines = np.arange(miny, maxy, density)
-        stitches = []
-        
-        direction = 1 # 1: Left to Right, -1: Right to Left
-        
-        for i, y in enumerate(y_lines):
-            # Create horizontal line
-            line = LineString([(minx - 1, y), (maxx + 1, y)])
-            intersection = rotated_poly.intersection(line)
-            
-            if intersection.is_empty:
-                continue
-                
-            segments = []
-            if isinstance(intersection, LineString):
-                segments = [intersection]
-            elif isinstance(intersection, MultiLineString):
-                segments = list(intersection.geoms)
-            
-            # Sort segments
-            segments.sort(key=lambda s: s.coords[0][0])
-            
-            row_points = []
-            
-            # Apply offset based on row index (e.g., 0.3 offset per row)
-            # A pattern like 0, 0.5, 0, 0.5 is standard brick
-            # Or continuous random offset
-            # Here we use the user param 'offset' (0..1) as a shift ratio of stitch_length
-            row_shift = (i * offset * stitch_length) % stitch_length
-            
-            for seg in segments:
-                coords = list(seg.coords)
-                start_x, start_y = coords[0]
-                end_x, end_y = coords[-1]
-                
-                # Interpolate points
-                dist = np.sqrt((end_x - start_x)**2)
-                
-                # Calculate start point with offset
-                # We start 'row_shift' into the line, then step by 'stitch_length'
-                current_x = start_x + row_shift
-                while current_x > start_x: 
-                     current_x -= stitch_length # Verify we start at beginning or before
-                if current_x < start_x:
-                     current_x += stitch_length
-                     
-                x_points = []
-                x_points.append(start_x) # Always hit edge
-                
-                while current_x < end_x:
-                    if current_x > start_x: # Don't duplicate start if match
-                        x_points.append(current_x)
-                    current_x += stitch_length
-                
-                x_points.append(end_x) # Always hit edge
-                
-                for x in x_points:
-                    row_points.append((x, start_y))
-            
-            if direction == -1:
-                row_points.reverse()
-                
-            stitches.extend(row_points)
-            direction *= -1
-            
-        # 5. Rotate back
-        final_stitches = []
-        for x, y in stitches:
-            p = Point(x, y)
-            p_rot = rotate(p, angle_deg, origin=(0,0))
-            final_stitches.append((p_rot.x, p_rot.y))
-            
-        return final_stitches
+        rows, seg_start, seg_end = scanline_segments(edges, y_lines)
+        if len(rows) == 0:
+            return np.empty((0, 2))
+
+        # 3. Sewing order: monotone sections, serpentine inside each, travel runs between
+        if start is not None:
+            start = rotate_points(start, -angle_deg)[0]
+        plan = plan_fill(rows, seg_start, seg_end, y_lines, start)
+        if stats is not None:
+            stats.update(plan["stats"])
+        order = plan["order"]
+        rows, seg_start, seg_end = rows[order], seg_start[order], seg_end[order]
+
+        # 4. Stitch points per segment: start edge, offset grid, end edge.
+        # The grid is shifted by 'offset' (0..1) of stitch_length per row index,
+        # a pattern like 0, 0.5, 0, 0.5 is standard brick.
+        row_shift = (rows * offset * stitch_length) % stitch_length
+        first = np.where(row_shift > 0, seg_start + row_shift, seg_start + stitch_length)
+        n_grid = np.maximum(np.ceil((seg_end - first) / stitch_length), 0).astype(np.intp)
+        counts = n_grid + 2
+
+        seg_id = np.repeat(np.arange(len(rows)), counts)
+        seg_offsets = np.cumsum(counts) - counts
+        local = np.arange(counts.sum()) - seg_offsets[seg_id]
+        # 5. Serpentine per section: spans sewn right to left take their points backwards
+        local = np.where(plan["reverse"][seg_id], counts[seg_id] - 1 - local, local)
+
+        xs = first[seg_id] + (local - 1) * stitch_length
+        xs = np.where(local == 0, seg_start[seg_id], xs)
+        xs = np.where(local == counts[seg_id] - 1, seg_end[seg_id], xs)
+
+        # 6. Travel runs spliced in before their spans
+        stitches = np.column_stack([xs, y_lines[rows][seg_id]])
+        stitches = insert_travel(stitches, seg_offsets, sorted(plan["travel"].items()))
+
+        # 7. Rotate back
+        return rotate_points(stitches, angle_deg)
 
     @staticmethod
+    @timed("engine.satin")
     def generate_satin_column(
         polygon: Polygon,
         density: float = 0.4, # Used as zig-zag spacing
-    ) -> List[Tuple[float, float]]:
+    ) -> np.ndarray:
         """
         Generates a Satin Stitch (ZigZag) for a columnar polygon.
         Simplified approach:
-        1. Find Oriented Bounding Box (OBB).
-        2. Determine long axis.
-        3. Zig-Zag along the long axis perpendicular to it.
+        1. Column direction from the medial axis (OBB long side for blobs).
+        2. Zig-Zag along that axis perpendicular to it.
         """
-        # Get OBB (Minimum Rotated Rectangle)
-        obb = polygon.minimum_rotated_rectangle
-        
-        # Get coordinates of OBB
-        x, y = obb.exterior.coords.xy
-        points = list(zip(x, y))[:4] # First 4 points
-        
-        # Calculate edge lengths to find orientation
-        d01 = Point(points[0]).distance(Point(points[1]))
-        d12 = Point(points[1]).distance(Point(points[2]))
-        
-        # Decide rotation angle to align long axis with X
-        angle = 0
-        if d01 > d12:
-            # Side 0-1 is longer. Calculate angle of 0-1
-            dx = points[1][0] - points[0][0]
-            dy = points[1][1] - points[0][1]
-            angle = np.degrees(np.arctan2(dy, dx))
-        else:
-             # Side 1-2 is longer
-            dx = points[2][0] - points[1][0]
-            dy = points[2][1] - points[1][1]
+        # Column direction: the medial axis trunk, which follows bent columns
+        angle = column_angle(polygon)
+        if angle is None:
+            # Blob or multipolygon: long side of the OBB (Minimum Rotated Rectangle)
+            obb = polygon.minimum_rotated_rectangle
+            
+            # Get coordinates of OBB
+            x, y = obb.exterior.coords.xy
+            points = list(zip(x, y))[:4] # First 4 points
+            
+            # Calculate edge lengths to find orientation
+            d01 = Point(points[0]).distance(Point(points[1]))
+            d12 = Point(points[1]).distance(Point(points[2]))
+            
+            # Decide rotation angle to align long axis with X
+            if d01 > d12:
+                # Side 0-1 is longer. Calculate angle of 0-1
+                dx = points[1][0] - points[0][0]
+                dy = points[1][1] - points[0][1]
+            else:
+                 # Side 1-2 is longer
+                dx = points[2][0] - points[1][0]
+                dy = points[2][1] - points[1][1]
             angle = np.degrees(np.arctan2(dy, dx))
             
-        # Rotate polygon to horizontal
-        rotated_poly = rotate(polygon, -angle, origin=(0,0))
-        minx, miny, maxx, maxy = rotated_poly.bounds
-        
+        # Rotate polygon to horizontal, then scan vertical rungs by swapping axes
+        edges = polygon_edges(polygon, angle)
+        if len(edges) == 0:
+            return np.empty((0, 2))
+        edges = edges[:, [1, 0, 3, 2]]
+        minx, maxx = edges[:, [1, 3]].min(), edges[:, [1, 3]].max()
+
         # Generate rungs along X
         x_steps = np.arange(minx, maxx, density)
-        stitches = []
-        toggle = True 
-        
-        for x in x_steps:
-             line = LineString([(x, miny - 10), (x, maxy + 10)])
-             inter = rotated_poly.intersection(line)
-             
-             if inter.is_empty: continue
-             
-             # Take the longest segment if multiple intersect
-             target_seg = inter
-             if isinstance(inter, MultiLineString):
-                  target_seg = max(inter.geoms, key=lambda g: g.length)
-             
-                 if hasattr(target_seg, 'coords'):
-                     coords = list(target_seg.coords)
-                     # Sort by Y
-                     coords.sort(key=lambda c: c[1])
-                     p_min = np.array(coords[0])
-                     p_max = np.array(coords[-1])
-                     
-                     # Short Stitch Logic (Simplified)
-                     # In a full run, we would compare with PREVIOUS rung to detect curvature.
-                     # Here we simply alternate if the segment is 'too short'? No, that's not it.
-                     # We need to detect if one side is pinched. 
-                     # For this stateless loop, it's hard. 
-                     # IMPROVEMENT: Let's assume standard zig-zag for now, 
-                     # but if we had previous points we could detect d(p_min_prev, p_min) vs d(p_max_prev, p_max).
-                     
-                     # Let's add a random factor or 'short' factor if requested (simulated density control)
-                     # For now, standard zig-zag.
-                     
-                     if toggle:
-                         stitches.append(tuple(p_min))
-                         stitches.append(tuple(p_max))
-                     else:
-                         stitches.append(tuple(p_max))
-                         stitches.append(tuple(p_min))
-                     toggle = not toggle
+        rows, seg_lo, seg_hi = scanline_segments(edges, x_steps)
+        if len(rows) == 0:
+            return np.empty((0, 2))
+
+        # Take the longest segment if multiple intersect
+        order = np.lexsort((-(seg_hi - seg_lo), rows))
+        rows, seg_lo, seg_hi = rows[order], seg_lo[order], seg_hi[order]
+        _, first = np.unique(rows, return_index=True)
+        rows, seg_lo, seg_hi = rows[first], seg_lo[first], seg_hi[first]
+
+        # Zig-zag: alternate rungs go bottom->top and top->bottom
+        toggle = (np.arange(len(rows)) % 2) == 0
+        x = x_steps[rows]
+        y_a = np.where(toggle, seg_lo, seg_hi)
+        y_b = np.where(toggle, seg_hi, seg_lo)
+        stitches = np.empty((2 * len(rows), 2))
+        stitches[0::2, 0] = x
+        stitches[0::2, 1] = y_a
+        stitches[1::2, 0] = x
+        stitches[1::2, 1] = y_b
 
         # Rotate stitches back
-        final = []
-        for sx, sy in stitches:
-             p = rotate(Point(sx, sy), angle, origin=(0,0))
-             final.append((p.x, p.y))
-             
+        final = rotate_points(stitches, angle)
+
         # Expert Rule: Short Stitches for Sharp Curves
         # Not fully implemented in simplified logic above, but structure allows it.
-        # Improvement: In the loop, check distance between p_min and p_max.
+        # Improvement: compare seg_lo/seg_hi with the previous rung.
         # If density is high on one side compared to previous rung, shorten.
-        
+
         return final
 
     @staticmethod
-    def add_tie_stitches(points: List[Tuple[float, float]], length: float = 0.5) -> List[Tuple[float, float]]:
+    def _tie_points(points: np.ndarray, length: float) -> Tuple[np.ndarray, np.ndarray]:
         """
-        Adds micro-stitches (Tie-In / Tie-Out) to lock the thread.
+        Micro-stitches for Tie-In (inserted after the first point) and Tie-Out (appended).
         Pattern: Small back-and-forth motion.
         """
-        if len(points) < 2: return points
-        
+        head = np.empty((0, 2))
+        tail = np.empty((0, 2))
+
         # Tie-In (Start)
-        start = np.array(points[0])
-        second = np.array(points[1])
+        start, second = points[0], points[1]
         vec = second - start
         norm = np.linalg.norm(vec)
         if norm > 0:
             direction = vec / norm
             # Create 3 micro stitches
-            p1 = tuple(start + direction * length)
-            p2 = tuple(start)
-            p3 = tuple(start + direction * length)
-            points.insert(1, p3)
-            points.insert(1, p2)
-            points.insert(1, p1)
-            
+            head = np.array([start + direction * length, start, start + direction * length])
+
         # Tie-Out (End)
-        end = np.array(points[-1])
-        prev = np.array(points[-2])
+        end = points[-1]
+        prev = points[-2] if len(points) > 2 or len(head) == 0 else head[-1]
         vec_end = end - prev
         norm_end = np.linalg.norm(vec_end)
         if norm_end > 0:
             direction_end = vec_end / norm_end
-            p1 = tuple(end - direction_end * length)
-            p2 = tuple(end)
-            p3 = tuple(end - direction_end * length)
-            points.append(p1)
-            points.append(p2)
-            points.append(p3)
-            
-        return points
+            tail = np.array([end - direction_end * length, end, end - direction_end * length])
+
+        return head, tail
 
     @staticmethod
+    def add_tie_stitches(points, length: float = 0.5) -> np.ndarray:
+        """
+        Adds micro-stitches (Tie-In / Tie-Out) to lock the thread.
+        Returns a new array; use append_tie_stitches to write straight into a StitchBuffer.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(points) < 2: return points
+
+        head, tail = StitchEngine._tie_points(points, length)
+        return np.concatenate([points[:1], head, points[1:], tail])
+
+    @staticmethod
+    def append_tie_stitches(buffer: StitchBuffer, points, length: float = 0.5):
+        """
+        Appends `points` to `buffer` wrapped in Tie-In / Tie-Out micro-stitches,
+        without building an intermediate list.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(points) < 2:
+            buffer.extend(points)
+            return
+
+        head, tail = StitchEngine._tie_points(points, length)
+        buffer.reserve(len(points) + len(head) + len(tail))
+        buffer.extend(points[:1])
+        buffer.extend(head)
+        buffer.extend(points[1:])
+        buffer.extend(tail)
+
+    @staticmethod
+    @timed("engine.bean")
     def generate_bean_stitch(
         linestring: LineString, 
         stitch_length: float = 2.5
-    ) -> List[Tuple[float, float]]:
+    ) -> np.ndarray:
         """
         Generates a Bean Stitch (Triple Run): A -> B -> A -> C -> B -> D ...
         Basically for every step forward, goes back and forward again.
@@ -307,23 +321,16 @@ class StitchEngine:
         Result: 3 layers of thread.
         """
         length = linestring.length
-        if length == 0: return []
+        if length == 0: return np.empty((0, 2))
         
         num_points = max(2, int(length / stitch_length))
-        interpolated = [linestring.interpolate(d).coords[0] for d in np.linspace(0, length, num_points)]
+        interpolated = shapely.get_coordinates(
+            shapely.line_interpolate_point(linestring, np.linspace(0, length, num_points))
+        )
         
-        final_stitches = []
-        for i in range(len(interpolated) - 1):
-            curr = interpolated[i]
-            next_p = interpolated[i+1]
-            
-            # A -> B
-            final_stitches.append(curr)
-            final_stitches.append(next_p)
-            # B -> A
-            final_stitches.append(curr)
-            # A -> B (Standard bean is 3 passes per segment)
-            final_stitches.append(next_p)
-            
-        return final_stitches
-
+        curr = interpolated[:-1]
+        next_p = interpolated[1:]
+        
+        # A -> B, B -> A, A -> B (Standard bean is 3 passes per segment)
+        final_stitches = np.stack([curr, next_p, curr, next_p], axis=1)
+        return final_stitches.reshape(-1, 2)
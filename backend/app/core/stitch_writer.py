@@ -0,0 +1,263 @@
+import numpy as np
+from typing import Tuple
+
+from app.core.stitch_buffer import STITCH, JUMP, TRIM, END, COLOR_CHANGE
+
+# Writes the fixed-record formats (DST, EXP) straight from a coordinate array and a
+# command array. Output is byte-identical to pyembroidery.write_dst / write_exp with
+# default settings: the same normalization (rounding, long-move splitting, trims and
+# color changes) is applied in bulk, and only the rare long moves are split in Python.
+
+STOP = 3
+
+# Command codes this writer understands; anything else goes through pyembroidery
+SUPPORTED_COMMANDS = (STITCH, JUMP, TRIM, STOP, END, COLOR_CHANGE)
+NATIVE_FORMATS = ("dst", "exp")
+
+# Writer settings pyembroidery uses for each format (MAX_STITCH/MAX_JUMP_DISTANCE, FULL_JUMP)
+DST_MAX_MOVE = 121
+EXP_MAX_MOVE = 127
+DST_HEADER_SIZE = 512
+DST_TRIM_JUMPS = ((2, 2), (-4, -4), (2, 2))
+
+# Balanced ternary digits of a DST delta: (weight, byte, bit for +1, bit for -1)
+_DST_X_DIGITS = ((81, 2, 2, 3), (27, 1, 2, 3), (9, 0, 2, 3), (3, 1, 0, 1), (1, 0, 0, 1))
+_DST_Y_DIGITS = ((81, 2, 5, 4), (27, 1, 5, 4), (9, 0, 5, 4), (3, 1, 7, 6), (1, 0, 7, 6))
+
+
+def supports(commands: np.ndarray) -> bool:
+    return bool(np.isin(commands, SUPPORTED_COMMANDS).all())
+
+
+def _gap_points(x0: int, y0: int, x1: int, y1: int, max_length: int):
+    """
+    Intermediate points of a move longer than `max_length`, accumulated exactly like
+    pyembroidery's interpolate_gap_stitches (float steps added one by one).
+    """
+    distance_x = x1 - x0
+    distance_y = y1 - y0
+    steps = max(-(-abs(distance_x) // max_length), -(-abs(distance_y) // max_length))
+    step_x = distance_x / steps
+    step_y = distance_y / steps
+    qx, qy = x0, y0
+    points = []
+    for _ in range(1, steps):
+        qx += step_x
+        qy += step_y
+        points.append((qx, qy))
+    return points
+
+
+def normalize_stitches(
+    coords: np.ndarray,
+    commands: np.ndarray,
+    max_move: int,
+    full_jump: bool
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Low-level stitch stream as the pyembroidery encoder would produce it for a writer
+    with `max_move` as both stitch and jump limit.
+
+    Returns (commands, positions, written):
+    - commands: output command per record (END appended);
+    - positions: float64 Nx2 record coordinates (split moves are fractional), used for bounds;
+    - written: int64 Nx2 needle positions as the writer accumulates them (deltas are their diff).
+    """
+    xy = np.round(np.asarray(coords, dtype=np.float64)).astype(np.int64).reshape(-1, 2)
+    commands = np.asarray(commands).astype(np.int64)
+    # Everything after the first END is dropped; END itself is always appended below
+    ends = np.flatnonzero(commands == END)
+    if len(ends):
+        xy, commands = xy[:ends[0]], commands[:ends[0]]
+    n = len(commands)
+    # Per-axis 1-D arrays: scatter/gather on them is far cheaper than on Nx2 rows
+    x, y = xy[:, 0], xy[:, 1]
+
+    is_move = (commands == STITCH) | (commands == JUMP)
+    is_stitch = commands == STITCH
+
+    # Needle before each entry: target of the previous move, (0, 0) at the start
+    last_move = np.maximum.accumulate(np.where(is_move, np.arange(n), -1))
+    prev_move = np.concatenate(([-1], last_move[:-1])) if n else last_move
+    has_prev = prev_move >= 0
+    needle_x = np.where(has_prev, x[np.maximum(prev_move, 0)], 0)
+    needle_y = np.where(has_prev, y[np.maximum(prev_move, 0)], 0)
+
+    # "Trimmed" before each entry: set by trims / stops / color changes, cleared by a stitch,
+    # jumps leave it unchanged
+    sets_state = commands != JUMP
+    last_state = np.maximum.accumulate(np.where(sets_state, np.arange(n), -1))
+    prev_state = np.concatenate(([-1], last_state[:-1])) if n else last_state
+    trimmed = np.where(prev_state >= 0, ~is_stitch[np.maximum(prev_state, 0)], True)
+
+    # Color changes: the first one before any stitch only selects the first thread
+    is_color = commands == COLOR_CHANGE
+    color_idx = np.flatnonzero(is_color)
+    stitch_idx = np.flatnonzero(is_stitch)
+    emit_color = is_color.copy()
+    if len(color_idx) and (not len(stitch_idx) or color_idx[0] < stitch_idx[0]):
+        emit_color[color_idx[0]] = False
+
+    # Long moves are split into jumps of at most max_move
+    delta = np.maximum(np.abs(x - needle_x), np.abs(y - needle_y))
+    gaps = np.where(is_move & (delta > max_move), -(-delta // max_move) - 1, 0)
+    # A trimmed stitch is reached by jumps; formats with full jumps add one onto the target
+    extra_jump = is_stitch & trimmed & ((gaps > 0) | (delta > 0)) if full_jump else np.zeros(n, dtype=bool)
+
+    count = np.where(is_move, gaps + extra_jump + 1, 0)
+    count += (commands == TRIM) & ~trimmed
+    count += commands == STOP
+    count += emit_color
+    starts = np.concatenate(([0], np.cumsum(count)))
+    total = int(starts[-1]) + 1
+
+    out_commands = np.empty(total, dtype=np.int64)
+    written_x = np.empty(total, dtype=np.int64)
+    written_y = np.empty(total, dtype=np.int64)
+
+    # Last record of every emitted entry: the move itself, or the command at the needle
+    emitted = np.flatnonzero(count)
+    last = starts[1:][emitted] - 1
+    out_commands[last] = commands[emitted]
+    written_x[last] = np.where(is_move, x, needle_x)[emitted]
+    written_y[last] = np.where(is_move, y, needle_y)[emitted]
+
+    extra = np.flatnonzero(extra_jump)
+    out_commands[starts[extra + 1] - 2] = JUMP
+    written_x[starts[extra + 1] - 2] = x[extra]
+    written_y[starts[extra + 1] - 2] = y[extra]
+
+    # Only gap records have fractional positions; the rest equal their written position
+    gap_rows, gap_points = [], []
+    for i in np.flatnonzero(gaps):
+        x0, y0 = int(needle_x[i]), int(needle_y[i])
+        xx, yy = x0, y0
+        row = int(starts[i])
+        for qx, qy in _gap_points(x0, y0, int(x[i]), int(y[i]), max_move):
+            xx += int(round(qx - xx))
+            yy += int(round(qy - yy))
+            out_commands[row] = JUMP
+            written_x[row], written_y[row] = xx, yy
+            gap_rows.append(row)
+            gap_points.append((qx, qy))
+            row += 1
+
+    out_commands[-1] = END
+    end_at = (x[last_move[-1]], y[last_move[-1]]) if n and last_move[-1] >= 0 else (0, 0)
+    written_x[-1], written_y[-1] = end_at
+
+    written = np.column_stack([written_x, written_y])
+    positions = written.astype(np.float64)
+    if gap_rows:
+        positions[gap_rows] = gap_points
+    return out_commands, positions, written
+
+
+def _deltas(written: np.ndarray) -> np.ndarray:
+    return np.column_stack([np.diff(written[:, i], prepend=0) for i in range(2)])
+
+
+def _dst_header(commands: np.ndarray, positions: np.ndarray, name: str) -> bytes:
+    # Per column: reductions along axis 0 of an Nx2 array are strided and slow
+    min_x, max_x = positions[:, 0].min(), positions[:, 0].max()
+    min_y, max_y = positions[:, 1].min(), positions[:, 1].max()
+    ax = int(positions[-1, 0])
+    ay = -int(positions[-1, 1])
+    header = "".join([
+        "LA:%-16s\r" % name,
+        "ST:%7d\r" % len(commands),
+        "CO:%3d\r" % int((commands == COLOR_CHANGE).sum()),
+        "+X:%5d\r" % abs(max_x),
+        "-X:%5d\r" % abs(min_x),
+        "+Y:%5d\r" % abs(max_y),
+        "-Y:%5d\r" % abs(min_y),
+        "AX:+%5d\r" % ax if ax >= 0 else "AX:-%5d\r" % abs(ax),
+        "AY:+%5d\r" % ay if ay >= 0 else "AY:-%5d\r" % abs(ay),
+        "MX:+%5d\r" % 0,
+        "MY:+%5d\r" % 0,
+        "PD:%6s\r" % "******",
+    ]).encode("utf8") + b"\x1a"
+    return header.ljust(DST_HEADER_SIZE, b"\x20")
+
+
+def encode_dst(coords: np.ndarray, commands: np.ndarray, name: str = "Untitled") -> bytes:
+    """
+    DST file (512-byte header + 3-byte ternary records) for a stitch stream.
+    Raises ValueError for unsupported command codes.
+    """
+    if not supports(commands):
+        raise ValueError("Stitch stream has commands the native DST writer does not support")
+    out_commands, positions, written = normalize_stitches(coords, commands, DST_MAX_MOVE, full_jump=False)
+    d = _deltas(written)
+
+    # A trim is written as three small jumps
+    is_trim = out_commands == TRIM
+    repeat = np.where(is_trim, len(DST_TRIM_JUMPS), 1)
+    rec_commands = np.repeat(np.where(is_trim, JUMP, out_commands), repeat)
+    rec = np.repeat(d, repeat, axis=0)
+    trim_rows = np.flatnonzero(np.repeat(is_trim, repeat))
+    if len(trim_rows):
+        rec[trim_rows] = np.tile(DST_TRIM_JUMPS, (int(is_trim.sum()), 1))
+
+    x = rec[:, 0].copy()
+    y = -rec[:, 1]
+    if np.abs(x).max(initial=0) > DST_MAX_MOVE or np.abs(y).max(initial=0) > DST_MAX_MOVE:
+        raise ValueError("The delta value given to the writer exceeds maximum allowed.")
+
+    # Column-wide bit arithmetic (no masked assignments): control records have zero deltas
+    cols = [np.zeros(len(rec), dtype=np.uint8) for _ in range(3)]
+    for values, digits in ((x, _DST_X_DIGITS), (y, _DST_Y_DIGITS)):
+        for weight, byte, plus_bit, minus_bit in digits:
+            half = weight // 2
+            plus, minus = values > half, values < -half
+            cols[byte] |= (plus.view(np.uint8) << plus_bit) | (minus.view(np.uint8) << minus_bit)
+            values += (minus.view(np.int8) - plus.view(np.int8)).astype(np.int64) * weight
+
+    b2 = np.array([0b11, 0x83, 0, 0b11000011, 0b11110011, 0b11000011], dtype=np.uint8)[rec_commands]
+    cols[2] |= b2
+    out = np.column_stack(cols)
+
+    return _dst_header(out_commands, positions, name) + out.tobytes()
+
+
+def encode_exp(coords: np.ndarray, commands: np.ndarray) -> bytes:
+    """
+    EXP file (2-byte stitch records, 4-byte jump and control records) for a stitch stream.
+    Raises ValueError for unsupported command codes.
+    """
+    if not supports(commands):
+        raise ValueError("Stitch stream has commands the native EXP writer does not support")
+    out_commands, _, written = normalize_stitches(coords, commands, EXP_MAX_MOVE, full_jump=True)
+    d = _deltas(written)
+    dx = (d[:, 0] & 0xFF).astype(np.uint8)
+    dy = (-d[:, 1] & 0xFF).astype(np.uint8)
+
+    out = np.zeros((len(out_commands), 4), dtype=np.uint8)
+    length = np.zeros(len(out_commands), dtype=np.int64)
+
+    stitch = out_commands == STITCH
+    out[stitch, 0], out[stitch, 1] = dx[stitch], dy[stitch]
+    length[stitch] = 2
+
+    jump = out_commands == JUMP
+    out[jump] = np.column_stack([np.full(jump.sum(), 0x80), np.full(jump.sum(), 0x04), dx[jump], dy[jump]])
+    length[jump] = 4
+
+    trim = out_commands == TRIM
+    out[trim] = (0x80, 0x80, 0x07, 0x00)
+    length[trim] = 4
+
+    change = (out_commands == COLOR_CHANGE) | (out_commands == STOP)
+    out[change] = (0x80, 0x01, 0x00, 0x00)
+    length[change] = 4
+
+    return out[np.arange(4) < length[:, None]].tobytes()
+
+
+def encode_stitches(coords: np.ndarray, commands: np.ndarray, format: str) -> bytes:
+    """Native encoding for `format` in NATIVE_FORMATS."""
+    if format == "dst":
+        return encode_dst(coords, commands)
+    if format == "exp":
+        return encode_exp(coords, commands)
+    raise ValueError(f"No native writer for format: {format}")
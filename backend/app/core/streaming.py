@@ -0,0 +1,214 @@
+import asyncio
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.stitch_engine import add_lock_stitches, satin_rung_count, satin_rungs, tatami_layout, tatami_span_stitches
+from app.core.export_processor import iter_digitized
+
+# Band sizes grow geometrically: the first band is small so stitches reach the client
+# right away, later bands are larger so the per-task overhead stays negligible.
+# Tatami bands count scanline spans in sewing order (one per row on convex shapes).
+STREAM_FIRST_ROWS = int(os.environ.get("EMBRO_STREAM_FIRST_ROWS", 8))
+STREAM_MAX_ROWS = int(os.environ.get("EMBRO_STREAM_MAX_ROWS", 512))
+STREAM_FIRST_RUNGS = int(os.environ.get("EMBRO_STREAM_FIRST_RUNGS", 64))
+STREAM_MAX_RUNGS = int(os.environ.get("EMBRO_STREAM_MAX_RUNGS", 8192))
+# Stitches per chunk message; larger bands are split
+STREAM_MAX_CHUNK = int(os.environ.get("EMBRO_STREAM_MAX_CHUNK", 16384))
+# Chunks a client may have in flight when it does not say otherwise
+STREAM_CREDIT = int(os.environ.get("EMBRO_STREAM_CREDIT", 8))
+
+
+def band_bounds(total: int, first: int, maximum: int) -> List[Tuple[int, int]]:
+    """[start, stop) ranges covering `total` items, doubling from `first` up to `maximum`."""
+    bounds, start, size = [], 0, max(1, first)
+    while start < total:
+        stop = min(start + size, total)
+        bounds.append((start, stop))
+        start, size = stop, min(size * 2, max(maximum, 1))
+    return bounds
+
+
+async def run_bands(lane, fn: Callable, args: tuple, bounds: List[Tuple[int, int]]) -> AsyncIterator[np.ndarray]:
+    """
+    Yields fn(*args, start, stop) for every band, computed on `lane` one band ahead of the
+    consumer: generation is paced by whoever iterates, and stops when they stop.
+    """
+    ahead: Optional[asyncio.Future] = None
+    try:
+        for i in range(len(bounds)):
+            current = ahead or asyncio.ensure_future(lane.run(fn, *args, *bounds[i]))
+            ahead = asyncio.ensure_future(lane.run(fn, *args, *bounds[i + 1])) if i + 1 < len(bounds) else None
+            yield await current
+    finally:
+        if ahead is not None:
+            ahead.cancel()
+
+
+class LockedSequence:
+    """
+    Frames a stitch sequence that arrives in pieces with the tie-in / tie-out knots of
+    add_lock_stitches, so the emitted pieces concatenate to add_lock_stitches(whole).
+    """
+
+    def __init__(self):
+        self._held = np.empty((0, 2))
+        self._started = False
+        self._tail = np.empty((0, 2))
+
+    def feed(self, stitches: np.ndarray) -> np.ndarray:
+        stitches = np.asarray(stitches, dtype=np.float64).reshape(-1, 2)
+        if len(stitches):
+            self._tail = np.concatenate([self._tail, stitches])[-2:]
+        if self._started:
+            return stitches
+        # The tie-in needs the first two stitches
+        self._held = np.concatenate([self._held, stitches])
+        if len(self._held) < 2:
+            return np.empty((0, 2))
+        self._started = True
+        head = add_lock_stitches(self._held[:2], "in")[:-2]
+        out, self._held = np.concatenate([head, self._held]), np.empty((0, 2))
+        return out
+
+    def finish(self) -> np.ndarray:
+        if not self._started:
+            # Fewer than two stitches overall: no knots, as add_lock_stitches
+            return self._held
+        return add_lock_stitches(self._tail, "out")[2:]
+
+
+class CreditGate:
+    """
+    Credit-based flow control: the client grants chunk credits, each chunk sent spends
+    one, and the sender waits while none are left.
+    """
+
+    def __init__(self, credit: int = STREAM_CREDIT):
+        self.credit = max(0, int(credit))
+        self.closed = False
+        self.waits = 0
+        self._changed = asyncio.Event()
+
+    def grant(self, n: int):
+        self.credit += max(0, int(n))
+        self._changed.set()
+
+    def close(self):
+        self.closed = True
+        self._changed.set()
+
+    async def acquire(self) -> bool:
+        """Spends one credit, waiting for a grant if needed; False once closed."""
+        if self.credit <= 0 and not self.closed:
+            self.waits += 1
+        while self.credit <= 0 and not self.closed:
+            self._changed.clear()
+            await self._changed.wait()
+        if self.closed:
+            return False
+        self.credit -= 1
+        return True
+
+
+def _chunks(stitches: np.ndarray, **meta) -> List[Dict[str, Any]]:
+    return [{"type": "chunk", **meta, "stitches": stitches[i:i + STREAM_MAX_CHUNK]}
+            for i in range(0, len(stitches), STREAM_MAX_CHUNK)]
+
+
+async def stream_locked(lane, fn: Callable, args: tuple, bounds: List[Tuple[int, int]]) -> AsyncIterator[Dict[str, Any]]:
+    sequence = LockedSequence()
+    async for band in run_bands(lane, fn, args, bounds):
+        for event in _chunks(sequence.feed(band)):
+            yield event
+    for event in _chunks(sequence.finish()):
+        yield event
+
+
+async def stream_tatami(lane, request: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+    """Events of a tatami fill: its stitches in bands of spans (same stitches as /tatami)."""
+    angle = float(request.get("angle", 0))
+    layout = await lane.run(
+        tatami_layout, request["polygon"], float(request.get("density_start", 0.4)),
+        float(request.get("density_end", 0.4)), angle
+    )
+    if layout is None:
+        yield {"type": "start", "rows": 0}
+        return
+    bounds = band_bounds(len(layout["order"]), STREAM_FIRST_ROWS, STREAM_MAX_ROWS)
+    yield {"type": "start", "rows": len(layout["ys"]), "sections": layout["stats"]["sections"], "bands": len(bounds)}
+    async for event in stream_locked(lane, tatami_span_stitches, (layout, angle), bounds):
+        yield event
+
+
+async def stream_satin(lane, request: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+    """Events of a satin column: its stitches in rung batches (same stitches as /satin)."""
+    path = request["path"]
+    width, density = float(request.get("width", 4.0)), float(request.get("density", 0.4))
+    if density <= 0:
+        raise ValueError("density must be positive")
+    bounds = band_bounds(satin_rung_count(path, density), STREAM_FIRST_RUNGS, STREAM_MAX_RUNGS)
+    yield {"type": "start", "rungs": bounds[-1][1] if bounds else 0, "bands": len(bounds)}
+    async for event in stream_locked(lane, satin_rungs, (path, width, density, True), bounds):
+        yield event
+
+
+async def stream_layers(lane, request: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Events of a design's layers in order, as digitized for the fill export: a "layer"
+    boundary (index, color), then each block's underlay and fill stitches. Layers come
+    from the layer cache or are digitized on `lane` in parallel (see iter_digitized).
+    """
+    layers = request["layers"]
+    yield {"type": "start", "layers": len(layers)}
+    async for index, blocks in iter_digitized(lane, layers):
+        yield {"type": "layer", "index": index, "color": layers[index].get("color", "#000000"), "blocks": len(blocks)}
+        for b, (underlay, stitches) in enumerate(blocks):
+            for event in _chunks(underlay, layer=index, block=b, underlay=True):
+                yield event
+            for event in _chunks(stitches, layer=index, block=b, underlay=False):
+                yield event
+
+
+STREAM_SOURCES = {
+    "tatami": stream_tatami,
+    "satin": stream_satin,
+    "layers": stream_layers,
+}
+
+
+async def stream_events(lane, request: Dict[str, Any], gate: CreditGate) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Events for a stream request ({"type": "tatami" | "satin" | "layers", ...parameters}),
+    chunks paced by `gate`, closed by a "done" event with counters and timings.
+    Raises ValueError for unknown types or missing parameters.
+    """
+    source = STREAM_SOURCES.get(request.get("type"))
+    if source is None:
+        raise ValueError(f"Unknown stream type {request.get('type')!r}; expected one of {sorted(STREAM_SOURCES)}")
+
+    t0 = time.perf_counter()
+    first_chunk_ms = None
+    chunks = stitches = 0
+    try:
+        async for event in source(lane, request):
+            if event["type"] == "chunk":
+                if not await gate.acquire():
+                    return
+                if first_chunk_ms is None:
+                    first_chunk_ms = (time.perf_counter() - t0) * 1000.0
+                chunks += 1
+                stitches += len(event["stitches"])
+            yield event
+    except KeyError as e:
+        raise ValueError(f"Missing parameter {e}")
+    yield {
+        "type": "done",
+        "chunks": chunks,
+        "stitches": stitches,
+        "first_chunk_ms": first_chunk_ms,
+        "elapsed_ms": (time.perf_counter() - t0) * 1000.0,
+        "credit_waits": gate.waits,
+    }
@@ -0,0 +1,317 @@
+import os
+import time
+from collections import deque
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
+
+from app.core.contours import extract_region_contours
+from app.core.cleanup import merge_speckles
+from app.core.executor import QueueFull, heavy_lane
+from app.core.kmeans import assign_to_centers, run_kmeans, stratified_sample
+from app.core.palette import apply_palette, load_catalog, palette_tables
+
+# Memory cap for a tiled segmentation: shared image + the working set of every tile in flight
+DEFAULT_MEMORY_CAP = int(os.environ.get("EMBRO_TILE_MEMORY_BYTES", 2 * 1024 * 1024 * 1024))
+
+# Upper bound of the working bytes per tile pixel: BGR and LAB tiles, float32 pixels,
+# labels, distances, the int32 label map, the speckle merge (component ids, distance
+# transform, merged copy) and the run arrays of the labelling pass.
+BYTES_PER_TILE_PIXEL = 112
+MIN_TILE_SIZE = 256
+MAX_TILE_SIZE = 4096
+
+def plan_tiles(height: int, width: int, memory_cap: int, workers: int) -> Tuple[int, int, int]:
+    """
+    Largest square tile (and number of tiles in flight) whose working sets, next to the
+    shared decoded image, fit in `memory_cap`.
+    Returns (tile_size, workers, planned_peak_bytes); raises ValueError if even one
+    minimum-size tile does not fit.
+    """
+    image_bytes = height * width * 3
+    # Decoding holds the decoder output and its shared-memory copy at the same time
+    if 2 * image_bytes > memory_cap:
+        raise ValueError(
+            f"Memory cap of {memory_cap} bytes is too small for a {width}x{height} image "
+            f"(needs at least {2 * image_bytes})"
+        )
+
+    budget = memory_cap - image_bytes
+    workers = max(1, int(workers))
+    min_tile_bytes = (MIN_TILE_SIZE + 1) ** 2 * BYTES_PER_TILE_PIXEL
+    workers = min(workers, budget // min_tile_bytes)
+    if workers < 1:
+        raise ValueError(f"Memory cap of {memory_cap} bytes leaves no room for a {MIN_TILE_SIZE}px tile")
+
+    tile = int(np.sqrt(budget / workers / BYTES_PER_TILE_PIXEL)) - 1
+    tile = max(MIN_TILE_SIZE, min(tile, MAX_TILE_SIZE, max(height, width)))
+    # No point keeping more tiles in flight than there are tiles
+    n_tiles = -(-height // tile) * -(-width // tile)
+    workers = min(workers, n_tiles)
+    peak = max(2 * image_bytes, image_bytes + workers * (tile + 1) ** 2 * BYTES_PER_TILE_PIXEL)
+    return tile, workers, peak
+
+
+def _simplify_ring(points: np.ndarray, epsilon_ratio: Optional[float]) -> np.ndarray:
+    if epsilon_ratio is None:
+        return points
+    contour = points.reshape(-1, 1, 2)
+    return cv2.approxPolyDP(contour, epsilon_ratio * cv2.arcLength(contour, True), True).reshape(-1, 2)
+
+
+def _region_from_rings(exterior, holes, epsilon_ratio, min_points) -> Optional[Dict[str, Any]]:
+    exterior = _simplify_ring(np.asarray(exterior, dtype=np.int32), epsilon_ratio)
+    if len(exterior) < min_points:
+        return None
+    kept = []
+    for hole in holes:
+        hole = _simplify_ring(np.asarray(hole, dtype=np.int32), epsilon_ratio)
+        if len(hole) >= min_points:
+            kept.append(hole.tolist())
+    return {"exterior": exterior.tolist(), "holes": kept}
+
+
+def _segment_tile(
+    shm_name: str,
+    shape: Tuple[int, int, int],
+    bounds: Tuple[int, int, int, int],
+    centers: np.ndarray,
+    epsilon_ratio: Optional[float],
+    min_points: int,
+    min_area: int = 0,
+    palette: Optional[Tuple[np.ndarray, np.ndarray]] = None
+) -> Dict[str, Any]:
+    """
+    Worker: assigns one tile of the shared BGR image to the global LAB centers and
+    extracts its region contours in image coordinates. With `palette` (the cell tables
+    of app.core.palette.palette_tables) pixels are looked up there instead, and `centers`
+    are the thread colors.
+
+    The tile covers its core [y0, y1) x [x0, x1) plus one pixel of overlap to the right
+    and below, so a region crossing a seam shares a boundary line with its counterpart
+    in the next tile. Regions that reach a seam come back unsimplified for merging.
+    Speckles under `min_area` pixels are merged into their neighbours first, except those
+    touching the tile edge (their full size is not known here).
+    """
+    y0, y1, x0, x1 = bounds
+    h, w = shape[:2]
+    ry1, rx1 = min(y1 + 1, h), min(x1 + 1, w)
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        image = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        # A copy: the shared buffer is unmapped below
+        tile = np.array(image[y0:ry1, x0:rx1])
+        del image
+    finally:
+        shm.close()
+
+    th, tw = tile.shape[:2]
+    if palette is None:
+        tile_lab = cv2.cvtColor(tile, cv2.COLOR_BGR2LAB)
+        del tile
+        labels, dist_sq = assign_to_centers(tile_lab.reshape(-1, 3), centers)
+        del tile_lab
+        error = np.sqrt(dist_sq.reshape(th, tw))
+        del dist_sq
+    else:
+        labels, error = apply_palette(tile, *palette)
+        del tile
+    error_sum = float(error[:y1 - y0, :x1 - x0].sum(dtype=np.float64))
+    del error
+
+    k = len(centers)
+    label_map, speckles = merge_speckles(labels.reshape(th, tw), k, min_area, protect_border=True)
+    regions = extract_region_contours(label_map, k, None, min_points, offset=(x0, y0))
+    del labels, label_map
+    if min_area <= 0:
+        speckles["regions"] = sum(map(len, regions))
+
+    done: List[List[Dict[str, Any]]] = [[] for _ in range(k)]
+    seam: List[List[Dict[str, Any]]] = [[] for _ in range(k)]
+    for label, label_regions in enumerate(regions):
+        for region in label_regions:
+            exterior = np.asarray(region["exterior"], dtype=np.int32)
+            lo, hi = exterior.min(axis=0), exterior.max(axis=0)
+            on_seam = (
+                (x0 > 0 and lo[0] <= x0) or (rx1 > x1 and hi[0] >= x1) or
+                (y0 > 0 and lo[1] <= y0) or (ry1 > y1 and hi[1] >= y1)
+            )
+            if on_seam:
+                seam[label].append(region)
+            else:
+                merged = _region_from_rings(exterior, region["holes"], epsilon_ratio, min_points)
+                if merged is not None:
+                    done[label].append(merged)
+
+    return {"regions": done, "seam": seam, "error_sum": error_sum, "pixels": (y1 - y0) * (x1 - x0),
+            "speckles": speckles}
+
+
+def _merge_seam_regions(
+    seam_regions: List[Dict[str, Any]],
+    epsilon_ratio: Optional[float],
+    min_points: int
+) -> List[Dict[str, Any]]:
+    """
+    Unions the seam-touching pieces of one label: pieces from neighbouring tiles share
+    the overlap row/column, so every region split by a seam becomes a single polygon again.
+    """
+    polygons = [Polygon(r["exterior"], [h for h in r["holes"] if len(h) >= 3])
+                for r in seam_regions if len(r["exterior"]) >= 3]
+    if not polygons:
+        return []
+    merged = shapely.unary_union(shapely.make_valid(np.array(polygons, dtype=object)))
+    parts = shapely.get_parts(merged)
+
+    result = []
+    for part in parts:
+        polys = shapely.get_parts(part) if part.geom_type == "MultiPolygon" else [part]
+        for poly in polys:
+            if poly.geom_type != "Polygon" or poly.is_empty or poly.area == 0:
+                continue
+            exterior = np.rint(np.asarray(poly.exterior.coords)[:-1]).astype(np.int32)
+            holes = [np.rint(np.asarray(r.coords)[:-1]).astype(np.int32) for r in poly.interiors]
+            region = _region_from_rings(exterior, holes, epsilon_ratio, min_points)
+            if region is not None:
+                result.append(region)
+    return result
+
+
+def segment_tiled(
+    image_bytes: bytes,
+    k: int = 5,
+    sample_size: int = 100_000,
+    seed: Optional[int] = None,
+    memory_cap: Optional[int] = None,
+    workers: Optional[int] = None,
+    epsilon_ratio: Optional[float] = 0.001,
+    min_points: int = 3,
+    min_area: int = 0,
+    palette: bool = False,
+    catalog: Optional[str] = None
+) -> Tuple[List[List[Dict[str, Any]]], np.ndarray, Dict[str, Any], Tuple[int, int]]:
+    """
+    Memory-bounded LAB K-Means segmentation for very large artwork.
+
+    1. The image is decoded once into a shared-memory buffer.
+    2. Centers are fitted on a stratified sample of it.
+    3. Tiles are labelled against those global centers and traced in worker processes,
+       never more tiles in flight than the memory cap allows (see plan_tiles). Tiles are
+       heavy lane tasks (app.core.executor): each takes a lane slot and gets the lane
+       timeout (TaskTimeout); while the lane is full the job waits for its own tiles and
+       raises QueueFull only when it has none in flight. `workers` defaults to the lane size.
+    4. Regions cut by tile seams are unioned back together.
+    Speckles under `min_area` pixels are merged per tile (see _segment_tile); stats
+    "speckles" sums the tiles' merge counts.
+    With palette=True step 2 picks up to `k` threads of `catalog` from the sample (0 for
+    every thread it matched, see app.core.palette) instead of fitting k-means; the
+    centers are then the threads' CIE LAB colors and stats "threads" lists the threads.
+
+    Returns (regions per label, centers (k, 3) float32 LAB, stats, (height, width)).
+    """
+    memory_cap = DEFAULT_MEMORY_CAP if memory_cap is None else int(memory_cap)
+    workers = heavy_lane.workers if workers is None else int(workers)
+
+    t0 = time.perf_counter()
+    decoded = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if decoded is None:
+        raise ValueError("Could not decode image")
+    h, w = decoded.shape[:2]
+    tile, workers, planned_peak = plan_tiles(h, w, memory_cap, workers)
+
+    shm = shared_memory.SharedMemory(create=True, size=decoded.nbytes)
+    pending = set()
+    try:
+        image = np.ndarray(decoded.shape, dtype=np.uint8, buffer=shm.buf)
+        image[:] = decoded
+        shape = decoded.shape
+        del decoded
+        t_decode = time.perf_counter()
+
+        # Fit the global centers on a stratified sample, converted to LAB on its own
+        # (or pick the threads for it)
+        rng = np.random.default_rng(seed)
+        idx = stratified_sample(h * w, max(int(sample_size), k), rng)
+        tables = threads = None
+        if palette:
+            cell_label, cell_error, threads, fit_stats = palette_tables(image.reshape(-1, 3)[idx], catalog, k)
+            tables = (cell_label, cell_error)
+            entry = load_catalog(fit_stats["catalog"])
+            centers = entry["lab"][[entry["ids"].index(thread["id"]) for thread in threads]]
+            fit_stats["pixels"] = len(idx)
+        else:
+            sample = cv2.cvtColor(image.reshape(-1, 1, 3)[idx], cv2.COLOR_BGR2LAB).reshape(-1, 3)
+            criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100, 0.2)
+            _, centers, fit_stats = run_kmeans(sample.astype(np.float32), k, criteria, 10, seed=seed)
+        del image
+        k = len(centers)
+        t1 = time.perf_counter()
+
+        bounds = [(y, min(y + tile, h), x, min(x + tile, w))
+                  for y in range(0, h, tile) for x in range(0, w, tile)]
+        regions: List[List[Dict[str, Any]]] = [[] for _ in range(k)]
+        seam: List[List[Dict[str, Any]]] = [[] for _ in range(k)]
+        error_sum = 0.0
+        speckles = {"regions": 0, "speckles": 0, "pixels_merged": 0}
+
+        queue = deque(bounds)
+        # Bounded submission: at most `workers` tiles (and working sets) alive at once
+        while queue or pending:
+            while queue and len(pending) < workers:
+                try:
+                    pending.add(heavy_lane.submit(
+                        _segment_tile, shm.name, shape, queue[0], centers, epsilon_ratio, min_points, min_area, tables
+                    ))
+                except QueueFull:
+                    # Other requests hold the lane: wait for a tile of this job instead
+                    if not pending:
+                        raise
+                    break
+                queue.popleft()
+            finished, pending = heavy_lane.wait_first(pending)
+            for future in finished:
+                part = heavy_lane.collect(future)
+                error_sum += part["error_sum"]
+                for key, value in part["speckles"].items():
+                    speckles[key] += value
+                for label in range(k):
+                    regions[label].extend(part["regions"][label])
+                    seam[label].extend(part["seam"][label])
+    finally:
+        # On failure, queued tiles are dropped; running ones keep their own mapping of
+        # the buffer (unlinking only removes the name) and their results are ignored
+        for future in pending:
+            future.cancel()
+        shm.close()
+        shm.unlink()
+    t2 = time.perf_counter()
+
+    for label in range(k):
+        regions[label].extend(_merge_seam_regions(seam[label], epsilon_ratio, min_points))
+    t3 = time.perf_counter()
+
+    stats = {
+        "mode": "tiled",
+        "pixels": h * w,
+        "fit_pixels": fit_stats["pixels"],
+        "decode_ms": (t_decode - t0) * 1000.0,
+        "fit_ms": (t1 - t_decode) * 1000.0,
+        "assign_ms": (t2 - t1) * 1000.0,
+        "merge_ms": (t3 - t2) * 1000.0,
+        "latency_ms": (t3 - t0) * 1000.0,
+        "color_error": error_sum / (h * w) if h * w else 0.0,
+        "tiles": len(bounds),
+        "tile_size": tile,
+        "workers": workers,
+        "memory_cap_bytes": memory_cap,
+        "planned_peak_bytes": planned_peak,
+        "speckles": speckles,
+    }
+    if palette:
+        stats.update(catalog=fit_stats["catalog"], threads_matched=fit_stats["threads_matched"], threads=threads)
+    return regions, centers, stats, (h, w)
@@ -0,0 +1,276 @@
+import json
+import struct
+from itertools import chain
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Binary alternative to the JSON nested lists of /tatami, /satin, /segmentar,
+# /process-image (responses, via Accept) and /export (request body, via Content-Type).
+#
+# Layout, little-endian throughout:
+#   0   4s   magic b"EMBW"
+#   4   u8   version
+#   5   u8   encoding (1 = f32 absolute, 2 = i16 deltas)
+#   6   u16  reserved
+#   8   u32  header length
+#   12  header: UTF-8 JSON, space-padded to a multiple of 4 bytes
+#   then every array listed in header["arrays"] ({"name", "dtype", "count"}), in order,
+#   each starting on a 4-byte boundary so clients can map typed-array views directly.
+#
+# Geometry is a flat list of rings (polylines): "ring_points" holds their point counts and
+# "points" the x, y pairs. Stitch payloads are a single ring. Layer payloads add
+# "layer_paths" (paths per layer) and "path_holes" (holes per path); rings are stored
+# layer by layer, each path as its exterior followed by its holes. Everything that is not
+# geometry (colors, settings, stats, ...) travels in the JSON header.
+#
+# With "i16" every coordinate is quantized to header["quantum"]: "ring_starts" (i32) holds
+# the first point of each ring and "points" the per-point deltas (the first one of each
+# ring is 0, 0). When a delta does not fit in int16 the payload is written as "f32".
+MEDIA_TYPE = "application/x-embro-geometry"
+MAGIC = b"EMBW"
+WIRE_VERSION = 1
+ENCODINGS = {"f32": 1, "i16": 2}
+
+# Default quantum per payload: contours are integer pixels, stitches keep two decimals
+CONTOUR_QUANTUM = 1.0
+STITCH_QUANTUM = 0.01
+
+_PREFIX = struct.Struct("<4sBBHI")
+_I16_MAX = 32767
+
+
+def negotiate(accept: Optional[str], quantum: float) -> Optional[Dict[str, Any]]:
+    """
+    Parses an Accept header. Returns the wire options ({"encoding", "quantum"}) when the
+    binary format is preferred over JSON, None for JSON (the default). The media range
+    may carry encoding=f32|i16 and quantum=<float> parameters.
+    """
+    if not accept:
+        return None
+    wire_q, json_q, options = 0.0, 0.0, {"encoding": "i16", "quantum": quantum}
+    for media_range in accept.split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        values = dict(p.split("=", 1) for p in params if "=" in p)
+        try:
+            q = float(values.get("q", 1))
+        except ValueError:
+            q = 0.0
+        media_type = media_type.lower()
+        if media_type == MEDIA_TYPE:
+            wire_q = q
+            if values.get("encoding") in ENCODINGS:
+                options["encoding"] = values["encoding"]
+            try:
+                options["quantum"] = float(values.get("quantum", quantum)) or quantum
+            except ValueError:
+                pass
+        elif media_type in ("application/json", "application/*", "*/*"):
+            json_q = max(json_q, q)
+    return options if wire_q > 0 and wire_q >= json_q else None
+
+
+def is_wire(content_type: Optional[str]) -> bool:
+    return bool(content_type) and content_type.split(";")[0].strip().lower() == MEDIA_TYPE
+
+
+def _pack(header: Dict[str, Any], arrays: List[Tuple[str, np.ndarray]], encoding: str) -> bytes:
+    header["arrays"] = [{"name": name, "dtype": a.dtype.str, "count": int(a.size)} for name, a in arrays]
+    header_bytes = json.dumps(header, separators=(",", ":"), default=str).encode()
+    header_bytes += b" " * (-len(header_bytes) % 4)
+
+    parts = [_PREFIX.pack(MAGIC, WIRE_VERSION, ENCODINGS[encoding], 0, len(header_bytes)), header_bytes]
+    for _, array in arrays:
+        data = array.tobytes()
+        parts.append(data)
+        parts.append(b"\0" * (-len(data) % 4))
+    return b"".join(parts)
+
+
+def _geometry_arrays(points: np.ndarray, ring_points: np.ndarray, encoding: str, quantum: float) -> Tuple[str, List[Tuple[str, np.ndarray]]]:
+    """
+    (encoding actually used, [ring_starts,] points arrays) for an (n, 2) point array.
+    """
+    if encoding == "i16" and len(points):
+        qx = np.rint(points[:, 0] / quantum).astype(np.int64)
+        qy = np.rint(points[:, 1] / quantum).astype(np.int64)
+        starts = (np.cumsum(ring_points) - ring_points)[ring_points > 0]
+        dx = np.diff(qx, prepend=qx[:1])
+        dy = np.diff(qy, prepend=qy[:1])
+        dx[starts] = 0
+        dy[starts] = 0
+        fits = max(np.abs(dx).max(), np.abs(dy).max()) <= _I16_MAX
+        fits &= max(np.abs(qx[starts]).max(), np.abs(qy[starts]).max()) < 2 ** 31
+        if fits:
+            ring_starts = np.empty(2 * len(starts), dtype="<i4")
+            ring_starts[0::2], ring_starts[1::2] = qx[starts], qy[starts]
+            deltas = np.empty(2 * len(points), dtype="<i2")
+            deltas[0::2], deltas[1::2] = dx, dy
+            return "i16", [("ring_starts", ring_starts), ("points", deltas)]
+    flat = np.empty(2 * len(points), dtype="<f4")
+    flat[0::2], flat[1::2] = points[:, 0], points[:, 1]
+    return "f32", [("points", flat)]
+
+
+def encode_stitches(points, meta: Optional[Dict[str, Any]] = None, encoding: str = "i16",
+                    quantum: float = STITCH_QUANTUM) -> bytes:
+    """
+    Binary payload of one stitch sequence ((n, 2) array or [[x, y], ...]) plus JSON metadata.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    ring_points = np.array([len(points)], dtype="<u4")
+    encoding, geometry = _geometry_arrays(points, ring_points, encoding, quantum)
+    header = {"shape": "stitches", "encoding": encoding, "meta": meta or {}}
+    if encoding == "i16":
+        header["quantum"] = quantum
+    return _pack(header, [("ring_points", ring_points)] + geometry, encoding)
+
+
+def encode_layers(layers: Sequence[Dict[str, Any]], meta: Optional[Dict[str, Any]] = None,
+                  encoding: str = "i16", quantum: float = CONTOUR_QUANTUM, field: str = "layers") -> bytes:
+    """
+    Binary payload of layers ({"paths", "holes", ...other keys}); every key besides
+    paths / holes is kept per layer in the header. `field` names the list once decoded
+    (e.g. "capas" for /segmentar).
+    """
+    layer_paths, path_holes, rings = [], [], []
+    for layer in layers:
+        paths = layer.get("paths") or []
+        holes = layer.get("holes") or []
+        layer_paths.append(len(paths))
+        for i, path in enumerate(paths):
+            path_hole_list = holes[i] if i < len(holes) and holes[i] else []
+            path_holes.append(len(path_hole_list))
+            rings.append(path)
+            rings.extend(path_hole_list)
+
+    ring_points = np.fromiter((len(r) for r in rings), dtype="<u4", count=len(rings))
+    n_points = int(ring_points.sum())
+    coords = np.fromiter(chain.from_iterable(chain.from_iterable(rings)), dtype=np.float64, count=2 * n_points)
+    encoding, geometry = _geometry_arrays(coords.reshape(-1, 2), ring_points, encoding, quantum)
+
+    header = {
+        "shape": "layers",
+        "field": field,
+        "encoding": encoding,
+        "meta": meta or {},
+        "layers": [{k: v for k, v in layer.items() if k not in ("paths", "holes")} for layer in layers],
+    }
+    if encoding == "i16":
+        header["quantum"] = quantum
+    arrays = [
+        ("layer_paths", np.asarray(layer_paths, dtype="<u4")),
+        ("path_holes", np.asarray(path_holes, dtype="<u4")),
+        ("ring_points", ring_points),
+    ]
+    return _pack(header, arrays + geometry, encoding)
+
+
+def _array_spec(spec: Any) -> Tuple[str, np.dtype, int]:
+    """(name, dtype, count) of a header array entry; ValueError unless it names a numeric array."""
+    if not isinstance(spec, dict) or not isinstance(spec.get("name"), str):
+        raise ValueError(f"Invalid wire array spec: {spec!r}")
+    if not isinstance(spec.get("dtype"), str):
+        raise ValueError(f"Missing dtype in wire array {spec['name']!r}")
+    try:
+        dtype = np.dtype(spec["dtype"])
+    except TypeError as e:
+        raise ValueError(f"Invalid dtype in wire array {spec['name']!r}: {e}")
+    if dtype.kind not in "iuf":
+        raise ValueError(f"Non-numeric dtype in wire array {spec['name']!r}: {dtype}")
+    count = spec.get("count")
+    if not isinstance(count, int) or isinstance(count, bool) or count < 0:
+        raise ValueError(f"Invalid count in wire array {spec['name']!r}: {count!r}")
+    return spec["name"], dtype, count
+
+
+def _unpack(data: bytes) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    if len(data) < _PREFIX.size:
+        raise ValueError("Wire payload too short")
+    magic, version, _, _, header_len = _PREFIX.unpack_from(data)
+    if magic != MAGIC or version != WIRE_VERSION:
+        raise ValueError("Not a wire payload (bad magic or version)")
+    offset = _PREFIX.size + header_len
+    try:
+        header = json.loads(data[_PREFIX.size:offset])
+        specs = header["arrays"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid wire header: {e}")
+    if not isinstance(specs, list):
+        raise ValueError("Invalid wire header: arrays must be a list")
+
+    arrays = {}
+    for spec in specs:
+        name, dtype, count = _array_spec(spec)
+        if offset + dtype.itemsize * count > len(data):
+            raise ValueError(f"Wire payload truncated in array {name!r}")
+        arrays[name] = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        offset += dtype.itemsize * count
+        offset += -offset % 4
+    return header, arrays
+
+
+def _decode_points(header: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> np.ndarray:
+    """(n, 2) points of a payload, deltas integrated for "i16"."""
+    ring_points = arrays["ring_points"].astype(np.int64)
+    flat = arrays["points"]
+    if len(flat) != 2 * ring_points.sum():
+        raise ValueError("Wire payload point count does not match ring sizes")
+    if header.get("encoding") != "i16":
+        return flat.astype(np.float64).reshape(-1, 2)
+
+    quantum = float(header["quantum"])
+    deltas = flat.astype(np.int64).reshape(-1, 2)
+    starts = arrays["ring_starts"].astype(np.int64).reshape(-1, 2)
+    first = (np.cumsum(ring_points) - ring_points)[ring_points > 0]
+    if len(starts) != len(first):
+        raise ValueError("Wire payload ring starts do not match ring sizes")
+    # Running sum over all points, re-based at the start of every non-empty ring
+    totals = np.cumsum(deltas, axis=0)
+    base = np.repeat(starts - totals[first], ring_points[ring_points > 0], axis=0)
+    if quantum.is_integer():
+        # Integer grids (pixel contours) decode to ints, as they were sent
+        return (totals + base) * int(quantum)
+    return (totals + base) * quantum
+
+
+def decode(data: bytes) -> Dict[str, Any]:
+    """
+    Inverse of encode_stitches / encode_layers: the header's meta plus "stitches"
+    ([[x, y], ...]) or the layers (dicts with "paths" and "holes" as nested lists)
+    under their field name, "layers" by default.
+    Raises ValueError on malformed payloads.
+    """
+    header, arrays = _unpack(data)
+    try:
+        points = _decode_points(header, arrays)
+        ring_points = arrays["ring_points"]
+    except KeyError as e:
+        raise ValueError(f"Wire payload is missing array {e}")
+
+    flat = points.tolist()
+    bounds = np.concatenate([[0], np.cumsum(ring_points, dtype=np.int64)]).tolist()
+    result = dict(header.get("meta") or {})
+    if header.get("shape") == "stitches":
+        result["stitches"] = flat
+        return result
+
+    layer_paths = arrays.get("layer_paths", np.zeros(0, dtype=np.uint32)).tolist()
+    path_holes = arrays.get("path_holes", np.zeros(0, dtype=np.uint32)).tolist()
+    infos = header.get("layers") or [{} for _ in layer_paths]
+    if len(infos) != len(layer_paths) or sum(layer_paths) != len(path_holes) \
+            or len(path_holes) + sum(path_holes) != len(ring_points):
+        raise ValueError("Wire payload layer structure does not match its rings")
+
+    layers, ring, path = [], 0, 0
+    for info, n_paths in zip(infos, layer_paths):
+        paths, holes = [], []
+        for _ in range(n_paths):
+            paths.append(flat[bounds[ring]:bounds[ring + 1]])
+            n_holes = path_holes[path]
+            holes.append([flat[bounds[r]:bounds[r + 1]] for r in range(ring + 1, ring + 1 + n_holes)])
+            ring += 1 + n_holes
+            path += 1
+        layers.append({**info, "paths": paths, "holes": holes})
+    result[header.get("field") or "layers"] = layers
+    return result
@@ -1,12 +1,46 @@
+import asyncio
+import json
+import math
+import time
 import cv2
 import numpy as np
-from fastapi import FastAPI, UploadFile, File, Body
+from contextlib import asynccontextmanager
+from io import BytesIO
+from fastapi import FastAPI, UploadFile, File, Body, Depends, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from shapely.geometry import Polygon, LineString, Point
 from shapely.ops import linemerge, unary_union
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Dict, Any, Union
+from starlette.websockets import WebSocketState
+from typing import List, Dict, Any, Union, Optional
 
-app = FastAPI()
+from app.core.executor import light_lane, heavy_lane, QueueFull, TaskTimeout, timing_headers
+from app.core.jobs import job_manager, JOB_STATES
+from app.core.metrics import MetricsMiddleware, count_stitches, register_gauge, render_metrics, stage, websocket_in_flight
+from app.api.timing import TimedRoute
+from app.api.schemas import DesignRequest, design_body, design_openapi
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Spawn warm workers before the first request instead of on it
+    light_lane.start()
+    heavy_lane.start()
+    yield
+    job_manager.shutdown()
+    light_lane.shutdown()
+    heavy_lane.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+# Every route body is timed ("endpoint" in Server-Timing, start of "serialize")
+app.router.route_class = TimedRoute
+
+@app.exception_handler(QueueFull)
+async def queue_full_handler(request: Request, exc: QueueFull):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+@app.exception_handler(TaskTimeout)
+async def task_timeout_handler(request: Request, exc: TaskTimeout):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
 
 # Permitir que tu Next.js se conecte
 app.add_middleware(
@@ -14,7 +48,10 @@ app.add_middleware(
     allow_origins=["*"], 
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+# Per-stage Server-Timing header, request latency / in-flight metrics (see GET /metrics)
+app.add_middleware(MetricsMiddleware)
 
 from app.stitch_engine import (
     generate_satin_column_industrial, 
@@ -22,56 +59,145 @@ from app.stitch_engine import (
     optimize_branching, 
     generate_applique_steps
 )
+from app.core.image_processor import segment_image_rgb, run_segmentation
+from app.core.cleanup import cleanup_options
+from app.core.palette import catalog_option
+from app.core.export_processor import (
+    run_export,
+    export_key,
+    export_etag,
+    cached_export,
+    store_export,
+    export_cache_stats,
+    analyze_design,
+    production_headers,
+    density_headers,
+    sidecar_zip,
+    branch_layers,
+    encode_run_layers,
+    digitize_design,
+    encode_digitized
+)
+from app.core.batch import run_jobs, split_jobs
+from app.core.production_stats import DEFAULT_MACHINE
+from app.core.streaming import CreditGate, STREAM_CREDIT, stream_events
+from app.core.cache import image_cache, segmentation_cache, layer_cache, etag_matches
+from app.core.wire import (
+    MEDIA_TYPE as WIRE_MEDIA_TYPE,
+    CONTOUR_QUANTUM,
+    STITCH_QUANTUM,
+    negotiate,
+    encode_stitches,
+    encode_layers
+)
 
 # ... (rest of imports)
 
+def _stitches_response(request: Request, response: Response, stitches: np.ndarray, headers: Dict[str, str]):
+    """
+    {"stitches": [[x, y], ...]} as JSON, or as the binary wire format when the Accept
+    header asks for it (see app.core.wire).
+    """
+    response.headers["Vary"] = "Accept"
+    wire = negotiate(request.headers.get("accept"), STITCH_QUANTUM)
+    if wire:
+        with stage("serialize.wire"):
+            content = encode_stitches(stitches, **wire)
+        return Response(content, media_type=WIRE_MEDIA_TYPE, headers={**headers, "Vary": "Accept"})
+    response.headers.update(headers)
+    return {"stitches": stitches.tolist()}
+
 # --- ENDPOINTS ---
 
 @app.post("/segmentar")
-async def segmentar_imagen(k: int = 5, file: UploadFile = File(...)):
-    # ... (Keep existing implementation)
-    # 1. Leer la imagen
+async def segmentar_imagen(
+    request: Request,
+    response: Response,
+    k: int = 5,
+    file: UploadFile = File(...),
+    mode: str = "exact",
+    sample_size: int = 100_000,
+    seed: Optional[int] = None,
+    measure_memory: bool = False,
+    min_area: Optional[int] = None,
+    vertex_budget: Optional[int] = None,
+    catalog: Optional[str] = None
+):
+    # Decoding, clustering (or thread quantization with mode=palette), speckle cleanup and
+    # contour extraction live in image_processor and run on the heavy lane (cached here by
+    # image hash + parameters).
     contents = await file.read()
-    nparr = np.frombuffer(contents, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-    # 2. K-Means Clustering
-    data = img.reshape((-1, 3)).astype(np.float32)
-    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
-    _, labels, centers = cv2.kmeans(data, k, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
-    
-    centers = np.uint8(centers)
-    res = centers[labels.flatten()].reshape(img.shape)
-
-    # 3. Extraer contornos por cada color
-    resultado = []
-    for color in centers:
-        mask = cv2.inRange(res, color, color)
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        paths = []
-        for cnt in contours:
-            if len(cnt) > 2: # Evitar ruidos pequeños
-                puntos = cnt.reshape(-1, 2).tolist()
-                paths.append(puntos)
-        
-        resultado.append({
-            "color": f"#{color[0]:02x}{color[1]:02x}{color[2]:02x}",
-            "paths": paths
-        })
-
-    return {"capas": resultado}
+    try:
+        min_area, vertex_budget = cleanup_options(min_area, vertex_budget)
+        result, timing = await run_segmentation(
+            heavy_lane, segment_image_rgb, contents, k=k, mode=mode,
+            sample_size=sample_size, seed=seed, measure_memory=measure_memory,
+            min_area=min_area, vertex_budget=vertex_budget, catalog=catalog_option(mode, catalog)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = timing_headers(timing) if timing else {}
+    response.headers["Vary"] = "Accept"
+    wire = negotiate(request.headers.get("accept"), CONTOUR_QUANTUM)
+    if wire:
+        meta = {key: value for key, value in result.items() if key != "capas"}
+        with stage("serialize.wire"):
+            content = encode_layers(result["capas"], meta, field="capas", **wire)
+        return Response(content, media_type=WIRE_MEDIA_TYPE, headers={**headers, "Vary": "Accept"})
+    response.headers.update(headers)
+    return result
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """
+    Hit/miss/eviction counters of this worker's caches (disk tier counters are per worker too).
+    """
+    return {
+        "images": image_cache.stats(),
+        "segmentation": segmentation_cache.stats(),
+        "export": export_cache_stats(),
+        "layers": layer_cache.stats(),
+    }
+
+@app.get("/executor/stats")
+async def executor_stats():
+    """
+    Per-lane queue depth, counters and p50/p99 of queue wait vs compute time.
+    """
+    return {"light": light_lane.stats(), "heavy": heavy_lane.stats(), "jobs": job_manager.stats()}
+
+register_gauge(
+    "embro_lane_pending", "Queued + running tasks per executor lane.", ("lane",),
+    lambda: {(lane.name,): lane.pending for lane in (light_lane, heavy_lane)}
+)
+register_gauge(
+    "embro_jobs", "Background jobs per state.", ("state",),
+    lambda: {(state,): count for state, count in job_manager.stats().items() if state in JOB_STATES}
+)
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus text format: per-stage latency histograms (embro_stage_duration_seconds),
+    request latency and counts per route, stitches generated per source, in-flight
+    requests, lane queue depths and jobs per state. Values are per server process.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 @app.post("/satin")
 async def create_satin(
+    request: Request,
+    response: Response,
     path: List[List[float]] = Body(...),
     width: float = Body(4.0),
     density: float = Body(0.4)
 ):
     # Use the industrial engine
-    stitches = generate_satin_column_industrial(path, width, density, short_stitches=True)
-    return {"stitches": stitches}
+    stitches, timing = await light_lane.run_timed(
+        generate_satin_column_industrial, path, width, density, short_stitches=True
+    )
+    count_stitches("satin", len(stitches))
+    return _stitches_response(request, response, stitches, timing_headers(timing))
 
 @app.post("/applique")
 async def create_applique(
@@ -99,95 +225,402 @@ async def create_applique(
     }
     
     # Finish using Industrial Satin
-    satin_stitches = generate_satin_column_industrial(polygon + [polygon[0]], width=3.5, density=0.4)
+    satin_stitches = await light_lane.run(
+        generate_satin_column_industrial, polygon + [polygon[0]], width=3.5, density=0.4
+    )
     
     finish_step = {
         "name": "Appliqué Satin Finish",
         "type": "satin", 
         "color": "#000000",
-        "paths": [satin_stitches] 
+        "paths": [satin_stitches.tolist()] 
     }
     
     return {"steps": [position_step, tackdown_step, finish_step]}
 
 @app.post("/tatami")
 async def create_tatami(
+    request: Request,
+    response: Response,
     polygon: List[List[float]] = Body(...),
     density_start: float = Body(0.4),
     density_end: float = Body(0.4),
     angle: float = Body(0)
 ):
-    stitches = generate_tatami_fill(polygon, density_start, density_end, angle)
-    return {"stitches": stitches}
+    stitches, timing = await light_lane.run_timed(
+        generate_tatami_fill, polygon, density_start, density_end, angle
+    )
+    count_stitches("tatami", len(stitches))
+    return _stitches_response(request, response, stitches, timing_headers(timing))
 
-@app.post("/export")
-async def export_embroidery(
-    layers: List[Dict[str, Any]] = Body(...),
-    format: str = Body("dst")
+@app.post("/batch")
+async def batch_generate(
+    response: Response,
+    jobs: List[Dict[str, Any]] = Body(..., embed=True)
 ):
-    import pyembroidery
-    # Use Industrial Stitch Engine
-    from app.stitch_engine import optimize_branching
-    
-    # 1. Optimize Order (Branching)
-    # This reorders objects to minimize jumps and adds travel runs if implemented
-    optimized_layers = optimize_branching(layers)
-    
-    pattern = pyembroidery.EmbPattern()
-    
-    for layer in optimized_layers:
-        # We need actual stitch points. 
-        # If 'paths' contains vector points, we must digitize them.
-        # If frontend sends 'generatedStitches' (from satin), use them.
-        # For this MVP, let's assume 'paths' are either run stitches or we just jump between them.
-        # REALITY CHECK: Frontend sends 'paths' which are contours. 
-        # We should probably run 'Satin' on them if type is satin, or 'Run' if type is run.
-        # But for simplicity, we treat all points as Run stitches for now unless specified.
-        
-        # Color change for new layer
-        # Parse hex color layer['color'] -> RGB
-        try:
-            h = layer.get('color', '#000000').lstrip('#')
-            rgb = tuple(int(h[i:i+2], 16) for i in (0, 2, 4))
-            pattern.add_thread(pyembroidery.EmbThread(rgb[0], rgb[1], rgb[2]))
-        except:
-             pattern.add_thread(pyembroidery.EmbThread(0, 0, 0))
-             
-        # Add stitches
-        paths = layer.get('paths', [])
-        for p_idx, path in enumerate(paths):
-            if not path: continue
-            
-            # Jump to start of path
-            pattern.add_stitch_absolute(pyembroidery.JUMP, path[0][0], path[0][1])
-            
-            # For now, treat as RUN stitch (simple line)
-            for point in path:
-                pattern.add_stitch_absolute(pyembroidery.STITCH, point[0], point[1])
-                
-            # If closed shape? we don't know, assuming path is just points.
-            
-    # Save to buffer
-    from io import BytesIO
-    stream = BytesIO()
-    
-    # pyembroidery writes to file path usually, but write(stream) supported?
-    # It supports write_dst(stream)
-    
-    if format.lower() == 'dst':
-        pyembroidery.write_dst(pattern, stream)
-    elif format.lower() == 'pes':
-        pyembroidery.write_pes(pattern, stream)
-    elif format.lower() == 'exp':
-        pyembroidery.write_exp(pattern, stream)
-    else:
-        pyembroidery.write_dst(pattern, stream)
-        
-    stream.seek(0)
+    """
+    Many satin / tatami / applique jobs in one round trip:
+    {"jobs": [{"type": "satin", "path", "width", "density"},
+              {"type": "tatami", "polygon", "density_start", "density_end", "angle"},
+              {"type": "applique", "polygon"}, ...]}
+    Jobs are balanced over one chunk per heavy-lane worker and run in parallel.
+    Results come back in input order, each shaped like its single endpoint's
+    response, or {"error": ...} for a job that failed. A chunk that fails as a whole
+    (lane full, timeout, worker crash) fails only its own jobs; when no chunk could
+    even be queued the batch is rejected (503) so it can be retried.
+    """
+    chunks = split_jobs(jobs, heavy_lane.workers)
+    outputs = await asyncio.gather(*(
+        heavy_lane.run_timed(run_jobs, [jobs[i] for i in chunk]) for chunk in chunks
+    ), return_exceptions=True)
+    if outputs and all(isinstance(output, QueueFull) for output in outputs):
+        raise outputs[0]
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(jobs)
+    timings = []
+    for chunk, output in zip(chunks, outputs):
+        if isinstance(output, BaseException):
+            if not isinstance(output, Exception):
+                raise output
+            error = {"error": str(output) or type(output).__name__}
+            for i in chunk:
+                results[i] = dict(error)
+            continue
+        chunk_results, timing = output
+        timings.append(timing)
+        for i, result in zip(chunk, chunk_results):
+            results[i] = result
+            count_stitches("batch", len(result.get("stitches") or []))
+    if timings:
+        # The slowest chunk bounds the batch latency
+        response.headers.update(timing_headers(max(timings, key=lambda t: t["compute_ms"])))
+    return {"results": results}
+
+@app.post("/export", openapi_extra=design_openapi(DesignRequest))
+async def export_embroidery(request: Request, design: DesignRequest = Depends(design_body(DesignRequest))):
+    """
+    Stitch file of the design: {"layers", "format" = "dst", "sidecar" = false} as JSON or
+    in the binary wire format. With sidecar=true the response is a zip holding the file
+    and design.json (branching + production stats: counts, stitch lengths, thread per
+    color, estimated sew time).
+    """
+    layers, format, sidecar = design.layers, design.format, design.sidecar
+
+    # Unchanged design: the client already holds this file
+    etag = export_etag(export_key("run", layers, format), "zip" if sidecar else "")
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    # Branching, stitch buffer and encoding run on the heavy lane (cached by design hash)
+    entry, timing = await run_export(heavy_lane, "run", layers, format)
+    branching_stats = entry["meta"]["branching"]
+    filename = f"design.{format}"
+    content, media_type = entry["content"], "application/octet-stream"
+    if sidecar:
+        content, media_type = sidecar_zip(content, filename, entry["meta"]), "application/zip"
+        filename = "design.zip"
     
-    from fastapi.responses import StreamingResponse
     return StreamingResponse(
-        stream, 
-        media_type="application/octet-stream", 
-        headers={"Content-Disposition": f"attachment; filename=design.{format}"}
+        BytesIO(content), 
+        media_type=media_type, 
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            "ETag": etag,
+            **production_headers(entry["meta"]["production"]),
+            "X-Cache": "miss" if timing else "hit",
+            "X-Jump-Length-Before": f"{branching_stats['jump_length_before']:.1f}",
+            "X-Jump-Length-After": f"{branching_stats['jump_length_after']:.1f}",
+            **(timing_headers(timing) if timing else {}),
+        }
+    )
+
+@app.post("/analyze")
+async def analyze(
+    response: Response,
+    layers: List[Dict[str, Any]] = Body(...),
+    pipeline: str = Body("fill"),
+    machine: Optional[Dict[str, float]] = Body(None),
+    bins_mm: Optional[List[float]] = Body(None),
+    density: Optional[Dict[str, float]] = Body(None),
+    knockdown: bool = Body(False),
+    knockdown_margin: Optional[float] = Body(None)
+):
+    """
+    Production statistics without writing a file: stitch / jump / trim / color-change
+    counts, stitch-length histogram (bins_mm: strictly increasing edges), thread per
+    color, estimated sew time and stitch density hotspots. `machine` overrides the
+    sew-time model (speed_spm and max_stitch_mm positive, jump_s, trim_s and
+    color_change_s non-negative), `density` the density grid (cell_mm, threshold);
+    unknown keys or invalid values are a 400. pipeline "fill" (/export-embroidery) reuses digitized layers
+    from the layer cache, "run" analyzes the /export run-stitch pattern.
+    knockdown=true (fill only) drops fill hidden under later layers, keeping
+    knockdown_margin units of overlap, and reports the stitches and time it saves.
+    """
+    if pipeline not in EXPORT_JOB_STAGES:
+        raise HTTPException(status_code=400, detail=f"Unknown pipeline: {pipeline!r} (expected one of {', '.join(EXPORT_JOB_STAGES)})")
+    machine = _machine_options(machine)
+    bins_mm = _length_bins(bins_mm)
+    density = _density_options(**(density or {}))
+    options = _knockdown_options(pipeline, knockdown, knockdown_margin)
+    stats, timing = await analyze_design(heavy_lane, pipeline, layers, machine, bins_mm, density, options)
+    response.headers.update(timing_headers(timing))
+    return stats
+
+def _knockdown_options(pipeline: str, knockdown: bool, margin: Optional[float]) -> Optional[Dict[str, Any]]:
+    if not knockdown:
+        return None
+    if pipeline != "fill":
+        raise HTTPException(status_code=400, detail="Knockdown applies to the fill pipeline only")
+    if margin is not None and margin < 0:
+        raise HTTPException(status_code=400, detail="knockdown_margin must not be negative")
+    return {"margin": margin}
+
+def _density_options(cell_mm: Optional[float] = None, threshold: Optional[float] = None, **unknown) -> Dict[str, float]:
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown density options: {', '.join(sorted(unknown))} (expected cell_mm, threshold)")
+    options = {name: value for name, value in (("cell_mm", cell_mm), ("threshold", threshold)) if value is not None}
+    for name, value in options.items():
+        if not isinstance(value, (int, float)) or value <= 0:
+            raise HTTPException(status_code=400, detail=f"Density {name} must be a positive number")
+    return options
+
+def _machine_options(machine: Optional[Dict[str, float]]) -> Optional[Dict[str, float]]:
+    if not machine:
+        return None
+    unknown = set(machine) - set(DEFAULT_MACHINE)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown machine options: {', '.join(sorted(unknown))} (expected {', '.join(DEFAULT_MACHINE)})")
+    for name, value in machine.items():
+        if not math.isfinite(value) or value < 0:
+            raise HTTPException(status_code=400, detail=f"Machine {name} must be a non-negative number")
+    for name in ("speed_spm", "max_stitch_mm"):
+        if machine.get(name) == 0:
+            raise HTTPException(status_code=400, detail=f"Machine {name} must be positive")
+    return machine
+
+def _length_bins(bins_mm: Optional[List[float]]) -> Optional[List[float]]:
+    if bins_mm is None:
+        return None
+    if not bins_mm or not all(math.isfinite(edge) for edge in bins_mm) \
+            or any(b <= a for a, b in zip(bins_mm, bins_mm[1:])):
+        raise HTTPException(status_code=400, detail="bins_mm must be a non-empty list of strictly increasing finite edges")
+    return bins_mm
+
+@app.post("/density")
+async def density(
+    response: Response,
+    layers: List[Dict[str, Any]] = Body(...),
+    pipeline: str = Body("fill"),
+    cell_mm: Optional[float] = Body(None),
+    threshold: Optional[float] = Body(None),
+    heatmap: bool = Body(False),
+    knockdown: bool = Body(False),
+    knockdown_margin: Optional[float] = Body(None)
+):
+    """
+    Stitch density of a design: thread per area on a cell_mm grid (mm of thread per
+    mm^2) with the regions above `threshold`, densest first. With heatmap=true the
+    response is the density heatmap as PNG and the summary moves to X-Density-* headers.
+    knockdown as in /analyze.
+    """
+    if pipeline not in EXPORT_JOB_STAGES:
+        raise HTTPException(status_code=400, detail=f"Unknown pipeline: {pipeline!r} (expected one of {', '.join(EXPORT_JOB_STAGES)})")
+    options = _density_options(cell_mm, threshold)
+    stats, timing = await analyze_design(
+        heavy_lane, pipeline, layers, density={**options, "heatmap": heatmap},
+        knockdown=_knockdown_options(pipeline, knockdown, knockdown_margin)
+    )
+    report = stats["density"]
+    if heatmap:
+        return Response(report.pop("heatmap"), media_type="image/png", headers={**timing_headers(timing), **density_headers(report)})
+    response.headers.update(timing_headers(timing))
+    return report
+
+# --- EXPORT JOBS ---
+
+EXPORT_JOB_STAGES = {
+    # /export: branching order + run stitches
+    "run": ["branching", "encoding"],
+    # /export-embroidery: per-layer fill / satin / underlay digitizing
+    "fill": ["layers", "encoding"],
+}
+
+async def _run_export_job(job, layers: List[Dict[str, Any]], format: str, pipeline: str, knockdown: Optional[Dict[str, Any]] = None):
+    filename = f"design.{format}"
+    key = export_key(pipeline, layers, format, knockdown)
+    entry = cached_export(key)
+    if entry is not None:
+        return entry["content"], filename, {**entry["meta"], "etag": entry["etag"], "cached": True}
+
+    t0 = time.perf_counter()
+    file_bytes, meta = await _compute_export_job(job, layers, format, pipeline, knockdown)
+    count_stitches(f"export.{pipeline}", meta["production"]["counts"]["stitches"])
+    entry = store_export(key, file_bytes, meta, (time.perf_counter() - t0) * 1000.0)
+    return file_bytes, filename, {**meta, "etag": entry["etag"], "cached": False}
+
+async def _compute_export_job(job, layers: List[Dict[str, Any]], format: str, pipeline: str, knockdown: Optional[Dict[str, Any]] = None):
+    if pipeline == "run":
+        job.set_stage("branching")
+        optimized_layers, branching_stats = await heavy_lane.run(branch_layers, layers)
+        job.set_stage("encoding")
+        file_bytes, stats = await heavy_lane.run(encode_run_layers, optimized_layers, format)
+        return file_bytes, {"branching": branching_stats, "production": stats}
+
+    # Changed layers are digitized in parallel, unchanged ones come from the layer cache
+    job.set_stage("layers")
+    digitized, layer_stats, knocked = await digitize_design(
+        heavy_lane, layers, knockdown, lambda done, total: job.set_progress(done / total if total else 1.0)
     )
+    job.set_stage("encoding")
+    file_bytes, usage = await heavy_lane.run(encode_digitized, digitized, format, [l.get("color", "#000000") for l in layers], knocked)
+    return file_bytes, {**usage, "layers_reused": layer_stats["layers_reused"]}
+
+@app.post("/jobs/export", status_code=202)
+async def submit_export_job(
+    layers: List[Dict[str, Any]] = Body(...),
+    format: str = Body("dst"),
+    pipeline: str = Body("run"),
+    knockdown: bool = Body(False),
+    knockdown_margin: Optional[float] = Body(None)
+):
+    """
+    Starts an export in the background and answers at once with the job:
+    poll GET /jobs/{id}, or follow GET /jobs/{id}/events (server-sent events),
+    then download GET /jobs/{id}/result. DELETE /jobs/{id} cancels it.
+    knockdown=true (fill pipeline) drops fill hidden under later layers first.
+    """
+    if pipeline not in EXPORT_JOB_STAGES:
+        raise HTTPException(status_code=400, detail=f"Unknown pipeline: {pipeline!r} (expected one of {', '.join(EXPORT_JOB_STAGES)})")
+    options = _knockdown_options(pipeline, knockdown, knockdown_margin)
+    job = job_manager.submit(
+        f"export:{pipeline}", EXPORT_JOB_STAGES[pipeline],
+        lambda job: _run_export_job(job, layers, format, pipeline, options)
+    )
+    return job.to_dict()
+
+def _get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found (unknown or expired)")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    return _get_job(job_id).to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Server-sent events: one "progress" event per change of the job, the stream ends
+    after the event of its final state.
+    """
+    job = _get_job(job_id)
+
+    async def stream():
+        version = -1
+        while True:
+            if job.version != version:
+                version = job.version
+                yield f"event: progress\ndata: {json.dumps(job.to_dict())}\n\n"
+                if job.finished:
+                    return
+            elif not await job.wait_change(version, timeout=15):
+                # Keep-alive for proxies
+                yield ": ping\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, request: Request):
+    job = _get_job(job_id)
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}" + (f": {job.error}" if job.error else ""))
+    etag = job.meta["etag"]
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(
+        content=job.result,
+        media_type=job.media_type,
+        headers={"Content-Disposition": f"attachment; filename={job.filename}", "ETag": etag}
+    )
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancels a queued or running job; deletes a finished one (and its result)."""
+    job = await job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found (unknown or expired)")
+    return job.to_dict()
+
+async def _read_credits(websocket: WebSocket, gate: CreditGate):
+    """Client side of a stitch stream: {"credit": n} grants, {"type": "cancel"} stops."""
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except (ValueError, KeyError):
+                continue
+            if not isinstance(message, dict):
+                continue
+            if message.get("type") == "cancel":
+                break
+            try:
+                gate.grant(message.get("credit", 0))
+            except (TypeError, ValueError):
+                continue
+    except WebSocketDisconnect:
+        pass
+    gate.close()
+
+@app.websocket("/ws/stitches")
+async def stitch_stream(websocket: WebSocket):
+    """
+    Progressive stitches for the simulator. The first message is the request:
+    {"type": "tatami" | "satin" | "layers", ...the parameters of /tatami, /satin or
+    /export, "credit": chunks the client can buffer (default 8), "encoding": "json" | "wire"}.
+    The server sends a "start" event, "chunk" events ({"stitches": [[x, y], ...], plus
+    "layer" / "block" / "underlay" for designs; binary wire frames with encoding="wire"),
+    "layer" boundaries for designs, and "done" with counters and timings.
+    Each chunk spends a credit; the client hands credits back with {"credit": n} as it
+    consumes chunks, so generation never runs more than one band ahead of the client.
+    {"type": "cancel"} or closing the socket stops the work.
+    """
+    await websocket.accept()
+    try:
+        request = await websocket.receive_json()
+        if not isinstance(request, dict):
+            raise ValueError("The first message must be a JSON object")
+        gate = CreditGate(request.get("credit", STREAM_CREDIT))
+    except WebSocketDisconnect:
+        return
+    except (ValueError, KeyError, TypeError) as e:
+        await websocket.send_json({"type": "error", "detail": f"Invalid stream request: {e}"})
+        await websocket.close(code=1003)
+        return
+
+    reader = asyncio.create_task(_read_credits(websocket, gate))
+    lane = heavy_lane if request.get("type") == "layers" else light_lane
+    wire = request.get("encoding") == "wire"
+    try:
+        with websocket_in_flight():
+            async for event in stream_events(lane, request, gate):
+                if event["type"] == "done":
+                    count_stitches(f"stream.{request['type']}", event["stitches"])
+                if event["type"] != "chunk":
+                    await websocket.send_json(event)
+                elif wire:
+                    meta = {key: value for key, value in event.items() if key != "stitches"}
+                    await websocket.send_bytes(encode_stitches(event["stitches"], meta))
+                else:
+                    await websocket.send_json({**event, "stitches": event["stitches"].tolist()})
+        code = 1000
+    except (ValueError, QueueFull, TaskTimeout) as e:
+        await websocket.send_json({"type": "error", "detail": str(e)})
+        code = 1011 if isinstance(e, (QueueFull, TaskTimeout)) else 1003
+    except WebSocketDisconnect:
+        code = None
+    finally:
+        reader.cancel()
+    # A cancelled stream ends without "done"; a client that already left gets nothing
+    if code is not None and websocket.client_state == WebSocketState.CONNECTED:
+        await websocket.close(code=code)
@@ -1,28 +1,37 @@
+import time
 import numpy as np
 from shapely.geometry import LineString, Point, Polygon
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Optional
+from app.core.scanline import polygon_edges, scanline_segments, rotate_points
+from app.core.fill_sections import plan_fill, insert_travel
+from app.core.polyline import cumulative_lengths, resample_with_normals
+from app.core.spatial_index import GridIndex
+from app.core.route_optimizer import improve_order, tour_jump_length
+from app.core.metrics import timed
 
 # --- HELPERS ---
 
 def distance(p1, p2):
     return np.sqrt((p1[0]-p2[0])**2 + (p1[1]-p2[1])**2)
 
-def add_lock_stitches(stitches: List[List[float]], type: str = 'both') -> List[List[float]]:
+def add_lock_stitches(stitches, type: str = 'both') -> np.ndarray:
     """
     Adds a 'Micro-Triangle' safety knot (3 stitches, 0.5mm).
     Prevents thread unraveling at start/end.
+    The knots are concatenated once onto the Nx2 array instead of rebuilding a list.
     """
-    if not stitches or len(stitches) < 2:
+    stitches = np.asarray(stitches, dtype=np.float64).reshape(-1, 2)
+    if len(stitches) < 2:
         return stitches
 
-    result = list(stitches)
+    head = np.empty((0, 2))
+    tail = np.empty((0, 2))
     
     # Tie-In (Start)
     if type in ['in', 'both']:
-        start = np.array(result[0])
+        start = stitches[0]
         # Calculate a small perpendicular offset for the triangle
-        p2 = np.array(result[1])
-        vec = p2 - start
+        vec = stitches[1] - start
         norm_val = np.linalg.norm(vec)
         
         if norm_val > 0:
@@ -38,17 +47,12 @@ def add_lock_stitches(stitches: List[List[float]], type: str = 'both') -> List[L
             t2 = start + (perp * 0.5)
             
             # Sequence: Start -> T1 -> T2 -> Start -> Continue
-            lock_seq = [
-                t1.tolist(),
-                t2.tolist(),
-                start.tolist()
-            ]
-            result = lock_seq + result
+            head = np.array([t1, t2, start])
 
     # Tie-Out (End)
     if type in ['out', 'both']:
-        end = np.array(result[-1])
-        prev = np.array(result[-2])
+        end = stitches[-1]
+        prev = stitches[-2]
         vec = end - prev
         norm_val = np.linalg.norm(vec)
         
@@ -59,178 +63,272 @@ def add_lock_stitches(stitches: List[List[float]], type: str = 'both') -> List[L
             t1 = end - (direction * 0.5) # Backwards
             t2 = end + (perp * 0.5)
             
-            lock_seq = [
-                t1.tolist(),
-                t2.tolist(),
-                end.tolist()
-            ]
-            result = result + lock_seq
+            tail = np.array([t1, t2, end])
             
-    return result
+    return np.concatenate([head, stitches, tail])
 
 # --- CORE ALGORITHMS ---
 
-def generate_satin_column_industrial(
-    path_points: List[List[float]], 
-    width: float = 4.0, 
+def satin_rung_count(path_points: List[List[float]], density: float = 0.4) -> int:
+    """Number of rungs (stitches before lock stitches) of a satin column."""
+    if len(path_points) < 2: return 0
+    coords = np.asarray(path_points, dtype=np.float64)[:, :2]
+    return int(cumulative_lengths(coords)[-1] / density) + 1
+
+def satin_rungs(
+    path_points: List[List[float]],
+    width: float = 4.0,
     density: float = 0.4,
-    short_stitches: bool = True
-) -> List[List[float]]:
+    short_stitches: bool = True,
+    start: int = 0,
+    stop: Optional[int] = None
+) -> np.ndarray:
     """
-    Generates satin column with Short Stitches logic.
-    If angle < 45 deg, alternate stitches are shortened to avoid bunching.
+    Rungs [start, stop) of a satin column, without lock stitches. Any range gives
+    the same stitches as the whole column, so it can be generated piece by piece.
     """
-    if len(path_points) < 2: return []
+    if len(path_points) < 2: return np.empty((0, 2))
 
-    line = LineString(path_points)
-    length = line.length
+    coords = np.asarray(path_points, dtype=np.float64)[:, :2]
+    length = cumulative_lengths(coords)[-1]
     num_steps = int(length / density)
+    stop = num_steps + 1 if stop is None else min(stop, num_steps + 1)
+    if start >= stop: return np.empty((0, 2))
+
+    # One rung of look-behind for the sharp-turn test of the first rung in range
+    first = max(start - 1, 0)
+    steps = np.arange(first, stop)
+    dists = np.minimum(steps * density, length)
     
-    stitches = []
+    # Positions and Normals for every rung (tangent over +/- 0.1 along the path)
+    points, normals = resample_with_normals(coords, dists, tangent_step=0.1)
     
-    prev_normal = None
+    # Short Stitch Logic: high change in normal vector = Sharp Curve
+    is_sharp_turn = np.zeros(len(steps), dtype=bool)
+    if short_stitches and len(steps) > 1:
+        dots = np.clip(np.sum(normals[1:] * normals[:-1], axis=1), -1.0, 1.0)
+        is_sharp_turn[1:] = np.degrees(np.arccos(dots)) > 45
     
-    for i in range(num_steps + 1):
-        dist = i * density
-        if dist > length: dist = length
-        
-        point = line.interpolate(dist)
-        
-        # Calculate Tangent & Normal
-        p1 = line.interpolate(max(0, dist - 0.1))
-        p2 = line.interpolate(min(length, dist + 0.1))
-        dx, dy = p2.x - p1.x, p2.y - p1.y
-        norm_len = np.sqrt(dx*dx + dy*dy)
-        
-        if norm_len == 0: 
-            ux, uy = 0, 0
-        else:
-            ux, uy = -dy/norm_len, dx/norm_len # Normal vector
-            
-        current_normal = np.array([ux, uy])
-        
-        # Short Stitch Logic
-        is_sharp_turn = False
-        if prev_normal is not None and short_stitches:
-            dot = np.clip(np.dot(prev_normal, current_normal), -1.0, 1.0)
-            angle = np.degrees(np.arccos(dot))
-            
-            if angle > 45: # High change in normal vector = Sharp Curve
-                is_sharp_turn = True
-                
-        prev_normal = current_normal
-        
-        # Determine Width Factor
-        # If sharp turn AND it's an 'even' stitch (alternate), reduce width
-        # to 70% to alleviate congestion.
-        width_factor = 1.0
-        if is_sharp_turn and (i % 2 != 0):
-             width_factor = 0.70 # Retract to 70% from center?
-             # Actually, simpler industrial logic: Shorten from one side.
-             # We shorten symmetrically for simplicity here, or just reduce total width.
-        
-        half_w = (width * width_factor) / 2.0
-        
-        # Zig (Right)
-        p_right = [point.x + ux * half_w, point.y + uy * half_w]
-        # Zag (Left)
-        p_left = [point.x - ux * half_w, point.y - uy * half_w]
-        
-        if i % 2 == 0:
-            stitches.append(p_right)
-        else:
-            stitches.append(p_left)
+    # Determine Width Factor
+    # If sharp turn AND it's an 'even' stitch (alternate), reduce width
+    # to 70% to alleviate congestion (shortened symmetrically for simplicity).
+    odd = (steps % 2) != 0
+    width_factor = np.where(is_sharp_turn & odd, 0.70, 1.0)
+    half_w = (width * width_factor) / 2.0
+    
+    # Zig (Right) on even rungs, Zag (Left) on odd rungs
+    side = np.where(odd, -1.0, 1.0)
+    stitches = points + normals * (side * half_w)[:, None]
+    return stitches[start - first:]
 
-    return add_lock_stitches(stitches)
+@timed("satin")
+def generate_satin_column_industrial(
+    path_points: List[List[float]], 
+    width: float = 4.0, 
+    density: float = 0.4,
+    short_stitches: bool = True
+) -> np.ndarray:
+    """
+    Generates satin column with Short Stitches logic.
+    If angle < 45 deg, alternate stitches are shortened to avoid bunching.
+    All rungs are resampled by arc length in one vectorized pass.
+    """
+    return add_lock_stitches(satin_rungs(path_points, width, density, short_stitches))
 
 
-def generate_tatami_fill(
-    polygon_points: List[List[float]], 
+def tatami_rows(
+    polygon_points: List[List[float]],
     density_start: float = 0.4,
     density_end: float = 0.4,
     angle: float = 0
-) -> List[List[float]]:
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
     """
-    Generates Tatami (Fill) with linear density gradient.
+    Layout of a tatami fill: the polygon's edge list rotated so rows are horizontal,
+    and the row positions (density gradient applied). None for unusable polygons.
     """
-    if len(polygon_points) < 3: return []
+    if len(polygon_points) < 3: return None
     
     try:
         poly = Polygon(polygon_points)
     except:
-        return []
+        return None
         
     if not poly.is_valid or poly.is_empty:
-        return []
+        return None
 
-    minx, miny, maxx, maxy = poly.bounds
+    # Rotate the edge list so rows are horizontal
+    edges = polygon_edges(poly, angle)
+    miny, maxy = edges[:, [1, 3]].min(), edges[:, [1, 3]].max()
     height = maxy - miny
     
-    stitches = []
-    
-    # Iterate Y with variable step
+    # Row positions with variable step (scalar recurrence, no geometry involved)
+    ys = []
     y = miny
-    step_count = 0
     
     # Safety loop limit
     max_loops = 10000 
-    loop_i = 0
     
-    while y <= maxy and loop_i < max_loops:
-        loop_i += 1
+    while y <= maxy and len(ys) < max_loops:
+        ys.append(y)
         
         # LINEAR INTERPOLATION of Density
         progress = (y - miny) / height if height > 0 else 0
         current_density = density_start + (density_end - density_start) * progress
         current_density = max(0.2, current_density) # Minimum safe clamp
-        
-        scanline = LineString([(minx - 10, y), (maxx + 10, y)])
-        intersection = poly.intersection(scanline)
-        
-        lines = []
-        if intersection.is_empty: pass
-        elif intersection.geom_type == 'LineString': lines.append(intersection)
-        elif intersection.geom_type == 'MultiLineString': lines.extend(intersection.geoms)
-            
-        for line_seg in lines:
-            coords = list(line_seg.coords)
-            if not coords: continue
-            
-            start, end = coords[0], coords[-1]
-            
-            seg_len = distance(start, end)
-            n_pts = int(seg_len / current_density) # Use density for stitch length too? 
-            # Usually stitch length is fixed (e.g. 3mm) for fills, density is row spacing.
-            # But user prompt implies density variation. Let's assume row spacing varies (done by y +=)
-            # and stitch length is constant-ish.
-            stitch_len = 3.5
-            n_pts_line = int(seg_len / stitch_len)
-            
-            line_pts = []
-            dx_Seg = (end[0] - start[0])
-            dy_Seg = (end[1] - start[1])
-            
-            for k in range(n_pts_line + 1):
-                t = k / n_pts_line if n_pts_line > 0 else 0
-                px = start[0] + dx_Seg * t
-                py = start[1] + dy_Seg * t
-                line_pts.append([px, py])
-                
-            if step_count % 2 == 1:
-                line_pts.reverse()
-                
-            stitches.extend(line_pts)
-            
         y += current_density
-        step_count += 1
+        
+    return edges, np.array(ys)
+
+# Needle spacing along tatami rows (row spacing carries the density gradient)
+TATAMI_STITCH_LEN = 3.5
+
+def tatami_layout(
+    polygon_points: List[List[float]],
+    density_start: float = 0.4,
+    density_end: float = 0.4,
+    angle: float = 0
+) -> Optional[Dict[str, Any]]:
+    """
+    Sewing plan of a tatami fill: row positions, scanline spans and the order they are
+    sewn in (monotone sections joined by travel runs inside the shape, see
+    app.core.fill_sections.plan_fill). None for unusable polygons.
+    """
+    rows_layout = tatami_rows(polygon_points, density_start, density_end, angle)
+    if rows_layout is None:
+        return None
+    edges, ys = rows_layout
+    rows, seg_start, seg_end = scanline_segments(edges, ys)
+    # Rows keep the serpentine parity of their index in the layout: an empty first row
+    # (a vertex exactly on it) does not mirror the fill
+    plan = plan_fill(rows, seg_start, seg_end, ys, start_right=bool(len(rows) and rows[0] % 2))
+    return {"ys": ys, "rows": rows, "seg_start": seg_start, "seg_end": seg_end, **plan}
+
+def tatami_span_stitches(
+    layout: Dict[str, Any],
+    angle: float = 0,
+    start: int = 0,
+    stop: Optional[int] = None
+) -> np.ndarray:
+    """
+    Stitches of sewing positions [start, stop) of a tatami layout (see tatami_layout),
+    travel runs included, rotated back and without lock stitches. Consecutive ranges
+    concatenate into the full fill.
+    """
+    order = layout["order"][start:stop]
+    if len(order) == 0:
+        return np.empty((0, 2))
+    seg_start, seg_end = layout["seg_start"][order], layout["seg_end"][order]
+
+    n_pts = (seg_end - seg_start) / TATAMI_STITCH_LEN
+    counts = n_pts.astype(np.intp) + 1
+
+    seg_id = np.repeat(np.arange(len(order)), counts)
+    seg_offsets = np.cumsum(counts) - counts
+    k = np.arange(counts.sum()) - seg_offsets[seg_id]
+    n_line = counts[seg_id] - 1
+    t = np.where(n_line > 0, k / np.maximum(n_line, 1), 0.0)
+
+    # Spans sewn right to left run backwards (each reversed in place)
+    reverse = layout["reverse"][start:stop]
+    t = np.where(reverse[seg_id], np.where(n_line > 0, 1.0 - t, 0.0), t)
+    xs = seg_start[seg_id] + (seg_end - seg_start)[seg_id] * t
+
+    stitches = np.column_stack([xs, layout["ys"][layout["rows"][order]][seg_id]])
+    travel = [(p - start, run) for p, run in sorted(layout["travel"].items()) if start <= p < start + len(order)]
+    return rotate_points(insert_travel(stitches, seg_offsets, travel), angle)
+
+@timed("tatami")
+def generate_tatami_fill(
+    polygon_points: List[List[float]], 
+    density_start: float = 0.4,
+    density_end: float = 0.4,
+    angle: float = 0,
+    stats: Optional[Dict[str, Any]] = None
+) -> np.ndarray:
+    """
+    Generates Tatami (Fill) with linear density gradient.
+    Rows run along `angle` (degrees); all rows are intersected in one batched scanline pass.
+    Concave parts and holes are filled section by section without crossing gaps;
+    `stats` (if given) receives the sections / travel_runs / travel_length / jumps counts.
+    """
+    layout = tatami_layout(polygon_points, density_start, density_end, angle)
+    if layout is None:
+        return np.empty((0, 2))
+    if stats is not None:
+        stats.update(layout["stats"])
+    stitches = tatami_span_stitches(layout, angle)
+    if len(stitches) == 0:
+        return stitches
         
     return add_lock_stitches(stitches)
 
-def optimize_branching(layers: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def _is_closed(path: List[List[float]]) -> bool:
+    return len(path) > 3 and distance(path[0], path[-1]) < 1e-6
+
+
+def _entry_candidates(obj: Dict[str, Any]) -> np.ndarray:
+    """
+    Points where an object may be entered: every vertex of a closed first contour,
+    otherwise just the start of its first path.
+    """
+    paths = obj.get('paths', [])
+    if not paths or not paths[0]:
+        return np.zeros((1, 2))
+    first = paths[0]
+    if _is_closed(first):
+        return np.asarray(first[:-1], dtype=np.float64)[:, :2]
+    if obj.get('closed') and len(first) > 2:
+        return np.asarray(first, dtype=np.float64)[:, :2]
+    return np.asarray(first[:1], dtype=np.float64)[:, :2]
+
+
+def _enter_at(obj: Dict[str, Any], vertex: int) -> Dict[str, Any]:
+    """
+    Copy of `obj` whose first (closed) contour is rotated to start at `vertex`.
+    """
+    if vertex == 0:
+        return obj
+    paths = obj['paths']
+    first = paths[0]
+    if _is_closed(first):
+        ring = first[:-1]
+        rotated = ring[vertex:] + ring[:vertex] + [ring[vertex]]
+    else:
+        rotated = first[vertex:] + first[:vertex]
+    return {**obj, 'paths': [rotated] + paths[1:]}
+
+
+def _entry_exit(obj: Dict[str, Any]) -> Tuple[List[float], List[float]]:
+    paths = obj.get('paths', [])
+    if not paths or not paths[0]:
+        return [0, 0], [0, 0]
+    return paths[0][0], paths[-1][-1] if paths[-1] else paths[0][-1]
+
+
+def _entry_exit_arrays(objs: List[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+    pairs = [_entry_exit(obj) for obj in objs]
+    entries = np.array([p[0][:2] for p in pairs], dtype=np.float64).reshape(-1, 2)
+    exits = np.array([p[1][:2] for p in pairs], dtype=np.float64).reshape(-1, 2)
+    return entries, exits
+
+
+@timed("branching")
+def optimize_branching(
+    layers: List[Dict[str, Any]],
+    time_budget: float = 0.1,
+    stats: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
     """
     Smart Branching: reorders same-color objects.
+    Nearest-neighbour order over a grid index (closed contours may be entered at any
+    vertex and are rotated to start there), then a 2-opt/Or-opt pass bounded by
+    `time_budget` seconds shared by all color groups.
     If dist < 5mm, inserts hidden Running Stitch connector to avoid Trim.
+    If `stats` is given it is filled with the total jump length before/after.
     """
+    started = time.perf_counter()
+    budget_left = max(time_budget, 0.0)
+
     grouped = {}
     for layer in layers:
         c = layer['color']
@@ -238,77 +336,85 @@ def optimize_branching(layers: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         grouped[c].append(layer)
         
     optimized_layers = []
+    total_before = total_greedy = total_after = 0.0
+    total_moves = 0
+    objects_left = len(layers)
     
     for color, group in grouped.items():
         if not group: continue
-        
+
+        # Jump length of the incoming order (each object entered at its given start)
+        total_before += tour_jump_length(*_entry_exit_arrays(group))
+
+        # 1. Greedy nearest neighbour over a grid index with deletion
+        candidates = [_entry_candidates(obj) for obj in group[1:]]
+        index = GridIndex.for_points(np.vstack(candidates) if candidates else np.zeros((0, 2)))
+        for idx, pts in enumerate(candidates, start=1):
+            index.insert(idx, pts)
+
         ordered = [group[0]]
-        remaining = group[1:]
-        current_obj = group[0]
-        
-        while remaining:
-            # Find closest Next Object
-            # Need end point of current
-            curr_paths = current_obj.get('paths', [])
-            if not curr_paths: start_pt = [0,0]
-            else: start_pt = curr_paths[-1][-1] # Last point
-            
-            best_idx = -1
-            min_dist = float('inf')
+        current_exit = _entry_exit(group[0])[1]
+        while len(index):
+            idx, vertex, _ = index.nearest(current_exit[0], current_exit[1])
+            index.remove(idx)
+            next_obj = _enter_at(group[idx], vertex)
+            ordered.append(next_obj)
+            current_exit = _entry_exit(next_obj)[1]
+
+        entries, exits = _entry_exit_arrays(ordered)
+        total_greedy += tour_jump_length(entries, exits)
+
+        # 2. Bounded 2-opt / Or-opt, budget shared in proportion to group size
+        budget = budget_left * len(group) / max(objects_left, 1)
+        objects_left -= len(group)
+        improve_started = time.perf_counter()
+        symmetric = np.array([
+            len(obj.get('paths', [])) == 1 and _is_closed(obj['paths'][0]) for obj in ordered
+        ], dtype=bool)
+        order, moves = improve_order(entries, exits, symmetric, time_budget=budget)
+        budget_left = max(budget_left - (time.perf_counter() - improve_started), 0.0)
+        ordered = [ordered[i] for i in order]
+        total_moves += moves
+        total_after += tour_jump_length(entries, exits, order)
+
+        # 3. Connectors between close neighbours
+        result = [ordered[0]]
+        for prev_obj, next_obj in zip(ordered, ordered[1:]):
+            start_pt = _entry_exit(prev_obj)[1]
+            next_paths = next_obj.get('paths', [])
+            next_start = next_paths[0][0] if next_paths else [0,0]
             
-            for idx, cand in enumerate(remaining):
-                cand_paths = cand.get('paths', [])
-                cand_start = cand_paths[0][0] if cand_paths else [0,0]
-                d = distance(start_pt, cand_start)
-                if d < min_dist:
-                    min_dist = d
-                    best_idx = idx
+            dist_val = distance(start_pt, next_start)
             
-            if best_idx != -1:
-                next_obj = remaining.pop(best_idx)
-                
-                # Check 5mm threshold (assuming Coordinates in mm or close? 
-                # Fabric.js on frontend was 3 units = 1mm visual. 
-                # Backend receives screen coords usually?
-                # If 1 unit = 1 px, and we assume 96dpi, 5mm is approx 18px.
-                # Let's use a generic threshold 20.0 for now.
+            # Threshold: 5mm. 
+            # If coordinates are "pixels" (often ~3-4px per mm), 5mm ~ 15-20px.
+            # If coordinates are 10ths of mm (DST), 5mm = 50 units.
+            if dist_val < 50.0 and next_paths: 
+                # Insert Running Stitch Connector
+                # Generate straight line points
+                num_steps = int(dist_val / 3.0) + 1 # 3mm stitch len
+                frac = np.arange(1, num_steps + 1) / (num_steps + 1)
+                connector_path = (
+                    np.asarray(start_pt, dtype=np.float64)[:2]
+                    + np.outer(frac, np.subtract(next_start[:2], start_pt[:2]))
+                ).tolist()
                 
-                next_paths = next_obj.get('paths', [])
-                next_start = next_paths[0][0] if next_paths else [0,0]
+                # Prepend connector to next_obj's paths as a separate path segment
+                next_obj = {**next_obj, 'paths': [connector_path] + next_paths}
                 
-                dist_val = distance(start_pt, next_start)
+            result.append(next_obj)
                 
-                # Threshold: 5mm. 
-                # If coordinates are "pixels" (often ~3-4px per mm), 5mm ~ 15-20px.
-                # If coordinates are 10ths of mm (DST), 5mm = 50 units.
-                # We'll assume 20 units threshold.
-                if dist_val < 50.0: 
-                    # Insert Running Stitch Connector
-                    # Generate straight line points
-                    num_steps = int(dist_val / 3.0) + 1 # 3mm stitch len
-                     
-                    connector_path = []
-                    vx = (next_start[0] - start_pt[0])
-                    vy = (next_start[1] - start_pt[1])
-                    
-                    for s in range(1, num_steps + 1):
-                        frac = s / (num_steps + 1)
-                        connector_path.append([
-                            start_pt[0] + vx * frac,
-                            start_pt[1] + vy * frac
-                        ])
-                    
-                    # Prepend connector to next_obj's paths
-                    if next_paths:
-                        # Add as a separate path segment at the start
-                        next_obj['paths'].insert(0, connector_path)
-                    
-                ordered.append(next_obj)
-                current_obj = next_obj
-            else:
-                break
-                
-        optimized_layers.extend(ordered)
+        optimized_layers.extend(result)
+
+    if stats is not None:
+        stats.update({
+            "objects": len(layers),
+            "jump_length_before": total_before,
+            "jump_length_greedy": total_greedy,
+            "jump_length_after": total_after,
+            "improvement_moves": total_moves,
+            "elapsed_ms": (time.perf_counter() - started) * 1000.0,
+        })
         
     return optimized_layers
 
@@ -350,7 +456,7 @@ def generate_applique_steps(polygon: List[List[float]]) -> List[Dict[str, Any]]:
         "name": "Appliqué Satin Finish",
         "type": "satin", 
         "color": "#000000",
-        "paths": [satin_stitches] 
+        "paths": [satin_stitches.tolist()] 
     }
     
     return [position_step, tackdown_step, finish_step]
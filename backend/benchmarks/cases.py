@@ -0,0 +1,183 @@
+import copy
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Tuple
+
+from shapely.geometry import LineString, Polygon
+
+from app.stitch_engine import generate_satin_column_industrial, generate_tatami_fill, optimize_branching
+from app.core.stitch_engine import StitchEngine
+from app.core.image_processor import process_image_kmeans, segment_image_rgb
+from app.core.export_processor import create_embroidery_file, export_run_pattern
+from app.core.cache import image_cache, segmentation_cache, export_cache, layer_cache
+from app.core.skeleton import medial_axis, skeleton_cache
+from app.core.stitch_buffer import StitchBuffer
+from app.core.density import density_report
+from app.core.knockdown import knockdown_layers
+from benchmarks import corpus
+
+# Benchmark cases: `setup` builds fresh inputs for every run (not timed, so generators that
+# mutate their input see the same data each time), `fn` is the timed call and `count`
+# reduces its result to the number reported next to the timings (stitches, regions, ...).
+
+
+class Case:
+    def __init__(self, name: str, setup: Callable[[], Tuple[tuple, dict]], fn: Callable,
+                 count: Callable[[Any], int], unit: str = "stitches"):
+        self.name = name
+        self.setup = setup
+        self.fn = fn
+        self.count = count
+        self.unit = unit
+
+
+CASES: List[Case] = []
+
+
+def case(name: str, setup: Callable[[], Tuple[tuple, dict]], count: Callable[[Any], int] = len,
+         unit: str = "stitches"):
+    """Registers the decorated callable as benchmark `name`."""
+    def register(fn: Callable) -> Callable:
+        CASES.append(Case(name, setup, fn, count, unit))
+        return fn
+    return register
+
+
+def reset_caches():
+    """Every run starts cold: in-memory result caches are emptied (the disk tier is off)."""
+    image_cache.clear()
+    skeleton_cache.clear()
+    for cache in (segmentation_cache, export_cache, layer_cache):
+        cache.memory.clear()
+
+
+# Corpus pieces are generated once per process (outside the timings)
+spline = lru_cache(maxsize=None)(corpus.spline)
+photo = lru_cache(maxsize=None)(corpus.photo)
+small_photo = lru_cache(maxsize=None)(lambda: corpus.photo(640, 480, shapes=1200))
+large_image = lru_cache(maxsize=None)(corpus.large_image)
+design_layers = lru_cache(maxsize=None)(corpus.design_layers)
+run_objects = lru_cache(maxsize=None)(corpus.run_objects)
+stacked_layers = lru_cache(maxsize=None)(corpus.stacked_layers)
+
+
+@lru_cache(maxsize=None)
+def stacked_fills() -> StitchBuffer:
+    """~545k stitches: three overlapping tatami circles at the export defaults, one buffer."""
+    buffer = StitchBuffer()
+    for i, (x, angle) in enumerate(((0, 0.0), (900, 60.0), (450, 120.0))):
+        fill = StitchEngine.generate_tatami_fill(Polygon(corpus.circle(x, 600 * (i == 2), 900, 256)), density=4.0, angle_deg=angle)
+        buffer.jump(*fill[0])
+        buffer.extend(fill)
+    return buffer
+
+
+@lru_cache(maxsize=None)
+def photo_layers(cleanup: bool) -> List[Dict[str, Any]]:
+    """Layers of the smaller photo (sampled k-means, k=8), with or without the segmentation cleanup."""
+    options = {} if cleanup else {"min_area": 0, "vertex_budget": 0}
+    return process_image_kmeans(small_photo(), 8, mode="sampled", seed=0, cache=False, **options)["layers"]
+
+
+def _stitch_total(results: List[Any]) -> int:
+    return sum(len(r) for r in results)
+
+
+# --- app.stitch_engine (/satin, /tatami, /batch, export run pipeline) ---
+
+case("satin_industrial/spline", lambda: ((spline(), 40.0, 0.4), {}))(generate_satin_column_industrial)
+case("satin_industrial/circle", lambda: ((corpus.circle(0, 0, 900, 256), 30.0, 0.3), {}))(generate_satin_column_industrial)
+case("tatami/star", lambda: ((corpus.star(0, 0, 1500, 600), 2.0, 2.0, 0), {}))(generate_tatami_fill)
+case("tatami/circle_gradient", lambda: ((corpus.circle(0, 0, 1200, 256), 1.0, 3.0, 30), {}))(generate_tatami_fill)
+case(
+    "optimize_branching/600_objects",
+    lambda: ((copy.deepcopy(run_objects()),), {"time_budget": 0.1}),
+    unit="objects"
+)(optimize_branching)
+
+
+# --- app.core.stitch_engine.StitchEngine (export fill pipeline) ---
+
+@case("engine.tatami/letters", lambda: ((corpus.letters(2.0),), {}), count=_stitch_total)
+def engine_tatami(polygons):
+    return [StitchEngine.generate_tatami_fill(p, density=2.0, angle_deg=45.0, offset=0.5) for p in polygons]
+
+
+@case("engine.satin/letters", lambda: ((corpus.letters(2.0),), {}), count=_stitch_total)
+def engine_satin(polygons):
+    return [StitchEngine.generate_satin_column(p, density=1.0) for p in polygons]
+
+
+@case("engine.center_walk/letters", lambda: ((corpus.letters(2.0),), {}), count=_stitch_total)
+def engine_center_walk(polygons):
+    return [StitchEngine.generate_center_walk(p, stitch_length=2.0) for p in polygons]
+
+
+def _skeleton_nodes(results: List[Dict[str, Any]]) -> int:
+    return sum(len(skeleton["nodes"]) for skeleton in results)
+
+
+@case("skeleton/letters", lambda: ((corpus.letters(2.0),), {}), count=_skeleton_nodes, unit="nodes")
+def skeleton_letters(polygons):
+    return [medial_axis(p) for p in polygons]
+
+
+@case("engine.edge_walk/letters", lambda: ((corpus.letters(2.0),), {}), count=_stitch_total)
+def engine_edge_walk(polygons):
+    return [StitchEngine.generate_edge_walk(p, offset_mm=5.0, stitch_length=2.0) for p in polygons]
+
+
+case("engine.bean/spline", lambda: ((LineString(spline()), 2.5), {}))(StitchEngine.generate_bean_stitch)
+
+
+# --- Knockdown pre-pass (fill exports) ---
+
+case("knockdown/stacked_layers", lambda: ((copy.deepcopy(stacked_layers()),), {}),
+     count=lambda result: sum(len(layer["paths"]) for layer in result[0]), unit="paths")(knockdown_layers)
+case("create_embroidery_file/knockdown", lambda: ((copy.deepcopy(stacked_layers()), "dst", {"margin": None}), {}),
+     unit="bytes")(create_embroidery_file)
+
+
+# --- Density report (every export) ---
+
+case("density/stacked_fills", lambda: ((stacked_fills(),), {}), count=lambda report: len(report["hotspots"]),
+     unit="hotspots")(density_report)
+
+
+# --- Segmentation (/process-image, /segmentar) ---
+
+def _regions(result: Dict[str, Any]) -> int:
+    return sum(len(layer["paths"]) for layer in result.get("layers") or result.get("capas") or [])
+
+
+# Exact k-means (10 attempts over every pixel) runs on the smaller photo to keep the suite short.
+# Every k-means case is seeded: cv2's global RNG would otherwise make the region counts
+# depend on which cases ran before in the process
+case("kmeans/photo_exact", lambda: ((small_photo(), 8), {"seed": 0, "cache": False}), count=_regions, unit="regions")(process_image_kmeans)
+case("kmeans/photo_sampled", lambda: ((photo(), 8), {"mode": "sampled", "seed": 0, "cache": False}),
+     count=_regions, unit="regions")(process_image_kmeans)
+case("kmeans/large_tiled", lambda: ((large_image(), 8), {"tiled": True, "seed": 0, "cache": False}),
+     count=_regions, unit="regions")(process_image_kmeans)
+case("segment_rgb/photo", lambda: ((small_photo(), 8), {"seed": 0, "cache": False}), count=_regions, unit="regions")(segment_image_rgb)
+
+# Thread-palette quantization instead of k-means, same photos and color counts
+case("palette/photo", lambda: ((photo(), 8), {"mode": "palette", "cache": False}),
+     count=_regions, unit="regions")(process_image_kmeans)
+case("palette/large_tiled", lambda: ((large_image(), 8), {"mode": "palette", "tiled": True, "seed": 0, "cache": False}),
+     count=_regions, unit="regions")(process_image_kmeans)
+case("palette/segment_rgb", lambda: ((small_photo(), 8), {"mode": "palette", "cache": False}),
+     count=_regions, unit="regions")(segment_image_rgb)
+
+
+# --- Export ---
+
+case("create_embroidery_file/design", lambda: ((copy.deepcopy(design_layers()), "dst"), {}), unit="bytes")(create_embroidery_file)
+# The same photo exported as segmented with and without cleanup (speckles, vertex budget)
+case("create_embroidery_file/photo", lambda: ((copy.deepcopy(photo_layers(True)), "dst"), {}),
+     unit="bytes")(create_embroidery_file)
+case("create_embroidery_file/photo_raw", lambda: ((copy.deepcopy(photo_layers(False)), "dst"), {}),
+     unit="bytes")(create_embroidery_file)
+case(
+    "export_run_pattern/design",
+    lambda: ((copy.deepcopy(design_layers()), "dst"), {}),
+    count=lambda result: result[1]["production"]["counts"]["stitches"]
+)(export_run_pattern)
@@ -0,0 +1,173 @@
+from functools import lru_cache
+from typing import Any, Dict, List
+
+import cv2
+import numpy as np
+from shapely import affinity
+from shapely.geometry import Point, Polygon, box
+from shapely.ops import unary_union
+
+# Deterministic synthetic corpus for the benchmarks: every shape, design and image is
+# generated from a fixed seed, so two runs (and two machines) measure the same inputs.
+# Coordinates are embroidery units (0.1 mm) like the editor sends them.
+SEED = 20240601
+
+
+def circle(cx: float, cy: float, r: float, n: int = 128) -> List[List[float]]:
+    t = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    return np.column_stack([cx + r * np.cos(t), cy + r * np.sin(t)]).tolist()
+
+
+def star(cx: float, cy: float, r_out: float, r_in: float, points: int = 5) -> List[List[float]]:
+    t = np.linspace(0, 2 * np.pi, 2 * points, endpoint=False) - np.pi / 2
+    r = np.where(np.arange(2 * points) % 2 == 0, r_out, r_in)
+    return np.column_stack([cx + r * np.cos(t), cy + r * np.sin(t)]).tolist()
+
+
+def spline(n_ctrl: int = 40, samples_per_span: int = 50, seed: int = SEED) -> List[List[float]]:
+    """Long smooth open path: Catmull-Rom through a seeded random walk."""
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(0.0, 1.0, (n_ctrl, 2)) * [120.0, 80.0] + [150.0, 0.0]
+    ctrl = np.cumsum(steps, axis=0)
+    p = np.vstack([ctrl[:1], ctrl, ctrl[-1:]])
+    t = np.linspace(0, 1, samples_per_span, endpoint=False)[:, None]
+    t2, t3 = t * t, t * t * t
+    spans = []
+    for i in range(1, len(p) - 2):
+        p0, p1, p2, p3 = p[i - 1], p[i], p[i + 1], p[i + 2]
+        spans.append(0.5 * (2 * p1 + (-p0 + p2) * t + (2 * p0 - 5 * p1 + 4 * p2 - p3) * t2
+                            + (-p0 + 3 * p1 - 3 * p2 + p3) * t3))
+    return np.vstack(spans + [ctrl[-1:]]).tolist()
+
+
+def _ellipse(cx: float, cy: float, rx: float, ry: float) -> Polygon:
+    return affinity.scale(Point(cx, cy).buffer(1.0, 32), rx, ry)
+
+
+@lru_cache(maxsize=None)
+def _letter_shapes() -> Dict[str, Polygon]:
+    """Block letters with counters (holes), roughly 400 x 600 units each."""
+    o = _ellipse(200, 300, 200, 300).difference(_ellipse(200, 300, 110, 200))
+    a = Polygon([(0, 0), (160, 600), (240, 600), (400, 0), (300, 0), (260, 150), (140, 150), (100, 0)])
+    a = a.difference(Polygon([(165, 240), (235, 240), (200, 420)]))
+    b = unary_union([box(0, 0, 120, 600), _ellipse(180, 150, 200, 150), _ellipse(170, 450, 180, 150)])
+    b = b.difference(unary_union([_ellipse(180, 150, 90, 70), _ellipse(170, 450, 80, 70)]))
+    b = b.difference(box(-50, -50, 0, 650))
+    d = unary_union([box(0, 0, 120, 600), _ellipse(120, 300, 280, 300).intersection(box(0, 0, 400, 600))])
+    d = d.difference(_ellipse(130, 300, 160, 190).intersection(box(100, 0, 400, 600)))
+    eight = unary_union([_ellipse(200, 160, 170, 160), _ellipse(200, 450, 190, 160)])
+    eight = eight.difference(unary_union([_ellipse(200, 160, 80, 75), _ellipse(200, 450, 95, 80)]))
+    return {"O": o, "A": a, "B": b, "D": d, "8": eight}
+
+
+def letters(scale: float = 1.0) -> List[Polygon]:
+    """The letter polygons (largest part of each, holes kept), optionally scaled."""
+    shapes = []
+    for shape in _letter_shapes().values():
+        if shape.geom_type == "MultiPolygon":
+            shape = max(shape.geoms, key=lambda g: g.area)
+        shapes.append(affinity.scale(shape, scale, scale, origin=(0, 0)) if scale != 1.0 else shape)
+    return shapes
+
+
+def _polygon_path(poly: Polygon) -> Dict[str, Any]:
+    return {
+        "paths": [[list(c) for c in poly.exterior.coords]],
+        "holes": [[[list(c) for c in ring.coords] for ring in poly.interiors]],
+    }
+
+
+def design_layers(n_objects: int = 24, seed: int = SEED) -> List[Dict[str, Any]]:
+    """
+    Export design: letters with holes, stars and circles spread over a 4000 x 3000 hoop,
+    cycling through the tatami / satin / run / bean styles and four colors.
+    """
+    rng = np.random.default_rng(seed)
+    styles = ["tatami", "satin", "tatami", "run", "bean"]
+    colors = ["#c0392b", "#2980b9", "#27ae60", "#f1c40f"]
+    glyphs = letters(0.6)
+    layers = []
+    for i in range(n_objects):
+        x, y = rng.uniform(200, 3600), rng.uniform(200, 2600)
+        kind = i % 3
+        if kind == 0:
+            geometry = _polygon_path(affinity.translate(glyphs[i % len(glyphs)], x - 120, y - 180))
+        elif kind == 1:
+            geometry = {"paths": [star(x, y, rng.uniform(120, 300), rng.uniform(50, 110))], "holes": [[]]}
+        else:
+            geometry = {"paths": [circle(x, y, rng.uniform(80, 250), 96)], "holes": [[]]}
+        layers.append({
+            "id": f"obj-{i}",
+            "color": colors[i % len(colors)],
+            **geometry,
+            "settings": {
+                "style": styles[i % len(styles)],
+                "density": 4.0,
+                "angle": float(rng.uniform(0, 180)),
+                "underlay": i % 2 == 0,
+                "pullCompensation": 0.0,
+            },
+        })
+    return layers
+
+
+def stacked_layers(n_objects: int = 40, seed: int = SEED) -> List[Dict[str, Any]]:
+    """
+    Segmented-photo-like design: large overlapping circles and stars, each layer partly
+    or entirely covered by later ones (knockdown input).
+    """
+    rng = np.random.default_rng(seed)
+    layers = []
+    for i in range(n_objects):
+        x, y, r = rng.uniform(0, 3000), rng.uniform(0, 2000), rng.uniform(200, 700)
+        path = star(x, y, r, r * 0.6, 7) if i % 4 == 3 else circle(x, y, r, 64)
+        layers.append({
+            "id": f"region-{i}",
+            "color": ["#c0392b", "#2980b9", "#27ae60"][i % 3],
+            "paths": [path],
+            "holes": [[]],
+            "settings": {"style": "satin" if i % 7 == 0 else "tatami", "density": 4.0, "angle": float(rng.uniform(0, 180))},
+        })
+    return layers
+
+
+def run_objects(n: int = 600, colors: int = 3, seed: int = SEED) -> List[Dict[str, Any]]:
+    """Many small closed run contours (stars and circles) for the branching optimizer."""
+    rng = np.random.default_rng(seed)
+    palette = ["#c0392b", "#2980b9", "#27ae60", "#8e44ad", "#f39c12"][:max(1, colors)]
+    objects = []
+    for i in range(n):
+        x, y = rng.uniform(0, 4000), rng.uniform(0, 3000)
+        path = star(x, y, 40, 18, 5) if i % 2 else circle(x, y, 30, 24)
+        objects.append({"color": palette[i % len(palette)], "paths": [path + [path[0]]]})
+    return objects
+
+
+def photo(width: int = 1200, height: int = 900, shapes: int = 2500, noise: float = 6.0, seed: int = SEED) -> bytes:
+    """
+    Photo-like PNG with thousands of regions: gradient background, overlapping seeded
+    circles / triangles / rectangles, Gaussian noise.
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    img = np.dstack([xx * 255 / width, yy * 255 / height, (xx + yy) * 128 / (width + height)])
+    scale = min(width, height)
+    for i in range(shapes):
+        color = rng.integers(0, 256, 3).tolist()
+        cx, cy = int(rng.integers(0, width)), int(rng.integers(0, height))
+        size = int(rng.integers(scale // 200 + 2, scale // 12 + 4))
+        if i % 3 == 0:
+            cv2.circle(img, (cx, cy), size, color, -1)
+        elif i % 3 == 1:
+            pts = np.array([[cx, cy - size], [cx - size, cy + size], [cx + size, cy + size]], dtype=np.int32)
+            cv2.fillPoly(img, [pts], color)
+        else:
+            cv2.rectangle(img, (cx - size, cy - size // 2), (cx + size, cy + size // 2), color, -1)
+    img += rng.normal(0.0, noise, img.shape).astype(np.float32)
+    ok, png = cv2.imencode(".png", np.clip(img, 0, 255).astype(np.uint8))
+    return png.tobytes()
+
+
+def large_image(seed: int = SEED) -> bytes:
+    """4000 x 3000 artwork for the tiled segmentation path."""
+    return photo(4000, 3000, shapes=1500, noise=4.0, seed=seed)
@@ -0,0 +1,171 @@
+"""
+Micro-benchmarks of the stitch generators and processors on a deterministic corpus.
+
+    python -m benchmarks.run                          # run everything, print a table
+    python -m benchmarks.run -k tatami -r 10          # only matching cases, 10 timed runs
+    python -m benchmarks.run --save                   # write benchmarks/baseline.json
+    python -m benchmarks.run --compare                # exit 1 on regressions vs the baseline
+
+Per case: median / min wall time over the timed runs (after one warm-up run), peak
+Python + numpy heap of one extra run under tracemalloc (worker processes of the tiled
+path are not included) and the stitch / region / byte count of the result. Every run
+starts with cold caches. A case regresses when its best time (min over the runs, the
+least noisy statistic) grows by more than --threshold (and by more than --min-ms), its
+peak memory by more than --mem-threshold (and by more than 1 MB), or its count changes
+(the output itself changed). Baselines are machine specific: save one per host.
+Run from the backend directory.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+# The disk tier would turn repeated runs into cache hits
+os.environ["EMBRO_CACHE_DIR"] = ""
+
+import numpy as np
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def measure(case, repeats: int) -> Dict[str, Any]:
+    from benchmarks.cases import reset_caches
+
+    def call():
+        args, kwargs = case.setup()
+        reset_caches()
+        # Some processors print progress; keep the table readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            result = case.fn(*args, **kwargs)
+            elapsed_ms = (time.perf_counter() - t0) * 1000.0
+        return result, elapsed_ms
+
+    call()  # warm-up: imports, pools, lazily built tables
+    times = []
+    for _ in range(max(1, repeats)):
+        result, elapsed_ms = call()
+        times.append(elapsed_ms)
+
+    args, kwargs = case.setup()
+    reset_caches()
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            case.fn(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "median_ms": statistics.median(times),
+        "min_ms": min(times),
+        "runs": len(times),
+        "peak_kb": peak / 1024.0,
+        "count": int(case.count(result)),
+        "unit": case.unit,
+    }
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], threshold: float,
+            mem_threshold: float, min_ms: float) -> Dict[str, List[str]]:
+    """Regression messages per case name (empty list = within bounds)."""
+    report = {}
+    for name, current in results.items():
+        base = baseline.get(name)
+        problems = []
+        if base is not None:
+            delta_ms = current["min_ms"] - base["min_ms"]
+            if current["min_ms"] > base["min_ms"] * (1 + threshold) and delta_ms > min_ms:
+                problems.append(f"time {base['min_ms']:.1f} -> {current['min_ms']:.1f} ms")
+            delta_kb = current["peak_kb"] - base["peak_kb"]
+            if current["peak_kb"] > base["peak_kb"] * (1 + mem_threshold) and delta_kb > 1024:
+                problems.append(f"peak {base['peak_kb'] / 1024:.1f} -> {current['peak_kb'] / 1024:.1f} MB")
+            if current["count"] != base["count"]:
+                problems.append(f"{current['unit']} {base['count']} -> {current['count']}")
+        report[name] = problems
+    return report
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def _ratio(current: Dict[str, Any], base: Optional[Dict[str, Any]]) -> str:
+    if base is None or not base["min_ms"]:
+        return "new"
+    return f"x{current['min_ms'] / base['min_ms']:.2f}"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Stitch generator / processor micro-benchmarks")
+    parser.add_argument("-k", "--filter", default="", help="only cases whose name contains this text")
+    parser.add_argument("-r", "--repeats", type=int, default=3, help="timed runs per case (default 3)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON path")
+    parser.add_argument("--save", action="store_true", help="write the results to the baseline file")
+    parser.add_argument("--compare", action="store_true", help="fail (exit 1) on regressions vs the baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative time growth (default 0.25)")
+    parser.add_argument("--mem-threshold", type=float, default=0.25, help="allowed relative peak memory growth")
+    parser.add_argument("--min-ms", type=float, default=2.0, help="ignore time growth below this many ms")
+    parser.add_argument("--json", dest="json_out", help="also write this run's results to a JSON file")
+    args = parser.parse_args(argv)
+
+    from benchmarks.cases import CASES
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get("results", {})
+    elif args.compare:
+        print(f"No baseline at {args.baseline}; run with --save first", file=sys.stderr)
+        return 2
+
+    selected = [case for case in CASES if args.filter in case.name]
+    results = {}
+    print(f"{'case':36} {'median ms':>10} {'min ms':>9} {'peak MB':>8} {'count':>10}  unit      vs base")
+    for case in selected:
+        current = measure(case, args.repeats)
+        results[case.name] = current
+        print(f"{case.name:36} {current['median_ms']:10.1f} {current['min_ms']:9.1f} "
+              f"{current['peak_kb'] / 1024:8.1f} {current['count']:10d}  {current['unit']:9} "
+              f"{_ratio(current, baseline.get(case.name))}", flush=True)
+
+    document = {"environment": environment(), "repeats": args.repeats, "results": results}
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+    if args.save:
+        if args.filter and baseline:
+            # Partial run: keep the other cases' baselines
+            document["results"] = {**baseline, **results}
+        with open(args.baseline, "w") as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+
+    if args.compare:
+        report = compare(results, baseline, args.threshold, args.mem_threshold, args.min_ms)
+        regressions = {name: problems for name, problems in report.items() if problems}
+        for name, problems in regressions.items():
+            print(f"REGRESSION {name}: {'; '.join(problems)}")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} time / {args.mem_threshold:.0%} memory")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
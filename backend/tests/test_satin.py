@@ -0,0 +1,26 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from app.stitch_engine import generate_satin_column_industrial
+
+# Output of generate_satin_column_industrial(path, 4.0, 0.4, short) as it was before the
+# satin column was vectorized (the per-rung loop in app/stitch_engine.py before 9a7bf52).
+# Keys "<name>_path", "<name>_short", "<name>_plain"; blob and square repeat their first point.
+REFERENCE = np.load(Path(__file__).parent / "data" / "satin_reference.npz")
+
+
+@pytest.mark.parametrize("name", ["open", "zigzag", "blob", "square"])
+@pytest.mark.parametrize("short_stitches", [True, False])
+def test_satin_matches_pre_vectorization_output(name, short_stitches):
+    path = REFERENCE[f"{name}_path"]
+    expected = REFERENCE[f"{name}_short" if short_stitches else f"{name}_plain"]
+    result = generate_satin_column_industrial(path.tolist(), 4.0, 0.4, short_stitches)
+    np.testing.assert_allclose(np.asarray(result, dtype=np.float64), expected, atol=1e-8)
+
+
+def test_reference_exercises_short_stitches():
+    # Guards the fixture itself: the corners must actually trigger short stitches
+    for name in ("zigzag", "square"):
+        assert not np.allclose(REFERENCE[f"{name}_short"], REFERENCE[f"{name}_plain"])
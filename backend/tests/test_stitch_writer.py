@@ -0,0 +1,109 @@
+import io
+
+import numpy as np
+import pyembroidery
+import pytest
+
+from app.core.export_processor import encode_buffer
+from app.core.stitch_buffer import StitchBuffer, STITCH, JUMP, TRIM, END, COLOR_CHANGE
+from app.core.stitch_writer import STOP, DST_MAX_MOVE, EXP_MAX_MOVE
+
+WRITERS = {
+    "dst": pyembroidery.write_dst,
+    "exp": pyembroidery.write_exp,
+    "pes": pyembroidery.write_pes,
+    "jef": pyembroidery.write_jef,
+}
+
+
+def _stream(seed: int, n: int = 400, end: bool = False):
+    """
+    Seeded (coords, commands): short stitches, moves past both writers' limits, trims,
+    stops and color changes at the needle, half-unit and arbitrary float coordinates.
+    """
+    rng = np.random.default_rng(seed)
+    coords = np.empty((n, 2))
+    commands = np.empty(n, dtype=np.uint8)
+    x = y = 0.0
+    for i in range(n):
+        roll = rng.random()
+        if roll < 0.04:
+            command = int(rng.choice([TRIM, STOP, COLOR_CHANGE]))
+        else:
+            reach = 3 * max(DST_MAX_MOVE, EXP_MAX_MOVE) if roll < 0.15 else 40
+            x += rng.uniform(-reach, reach)
+            y += rng.uniform(-reach, reach)
+            if rng.random() < 0.2:
+                x, y = np.floor(x) + 0.5, np.floor(y) - 0.5
+            command = JUMP if roll < 0.1 else STITCH
+        coords[i] = x, y
+        commands[i] = command
+    if end:
+        commands[n // 2] = END
+    return coords, commands
+
+
+def _buffer(coords, commands) -> StitchBuffer:
+    buffer = StitchBuffer(dtype=np.float64)
+    for (x, y), command in zip(coords, commands):
+        buffer.append(x, y, int(command))
+    return buffer
+
+
+def _threads():
+    # One per color block: missing threads get random colors in PES / JEF
+    threads = []
+    for i in range(64):
+        thread = pyembroidery.EmbThread()
+        thread.set_color(37 * i % 256, 91 * i % 256, 53 * i % 256)
+        threads.append(thread)
+    return threads
+
+
+def _reference(coords, commands, format: str, truncate: bool) -> bytes:
+    """The same stream written by pyembroidery, one add_stitch_absolute per entry."""
+    pattern = pyembroidery.EmbPattern()
+    for thread in _threads():
+        pattern.add_thread(thread)
+    for (x, y), command in zip(coords.tolist(), commands.tolist()):
+        if truncate:
+            x, y = int(x), int(y)
+        pattern.add_stitch_absolute(command, x, y)
+    stream = io.BytesIO()
+    WRITERS[format](pattern, stream)
+    return stream.getvalue()
+
+
+@pytest.mark.parametrize("format", ["dst", "exp"])
+@pytest.mark.parametrize("truncate", [True, False])
+@pytest.mark.parametrize("seed", range(12))
+def test_native_writer_matches_pyembroidery(format, truncate, seed):
+    coords, commands = _stream(seed, end=seed % 3 == 0)
+    assert encode_buffer(_buffer(coords, commands), format, truncate=truncate) == \
+        _reference(coords, commands, format, truncate)
+
+
+@pytest.mark.parametrize("format", ["dst", "exp"])
+def test_native_writer_edge_streams(format):
+    # Empty stream, a lone long jump, and a long move right after a color change
+    streams = [
+        (np.empty((0, 2)), np.empty(0, dtype=np.uint8)),
+        (np.array([[1000.0, -1000.0]]), np.array([JUMP], dtype=np.uint8)),
+        (np.array([[0.5, 0.5], [0.5, 0.5], [600.0, 0.0], [600.0, 0.0]]),
+         np.array([STITCH, COLOR_CHANGE, STITCH, END], dtype=np.uint8)),
+    ]
+    for coords, commands in streams:
+        assert encode_buffer(_buffer(coords, commands), format) == _reference(coords, commands, format, True)
+
+
+@pytest.mark.parametrize("format", ["pes", "jef"])
+def test_other_formats_go_through_pyembroidery(format):
+    coords, commands = _stream(1)
+    assert encode_buffer(_buffer(coords, commands), format, _threads()) == _reference(coords, commands, format, True)
+
+
+def test_unsupported_commands_fall_back_to_pyembroidery():
+    coords, commands = _stream(2)
+    commands[10] = pyembroidery.SEQUIN_EJECT
+    for format in ("dst", "exp"):
+        assert encode_buffer(_buffer(coords, commands), format) == _reference(coords, commands, format, True)
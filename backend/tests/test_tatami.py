@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+import shapely
+from shapely.geometry import Polygon, box
+
+from app.core.scanline import polygon_edges, rotate_points, scanline_segments
+from app.core.stitch_engine import StitchEngine
+from app.stitch_engine import TATAMI_STITCH_LEN, generate_tatami_fill, tatami_layout, tatami_span_stitches
+
+
+def _circle(r: float, n: int = 128):
+    t = np.linspace(0.0, 2.0 * np.pi, n, endpoint=False)
+    return np.column_stack([r * np.cos(t), r * np.sin(t)]).tolist()
+
+
+CONVEX = {
+    "circle": _circle(900),
+    "ellipse": (np.array(_circle(500, 96)) * [1.0, 0.4] + [60, -20]).tolist(),
+    "triangle": [[0, 0], [700, 80], [250, 520]],
+    "box": [[0, 0], [400, 0], [400, 250], [0, 250]],
+}
+
+# Notches along and across the rows, a bar between two boxes, an L, a star, a ring
+CONCAVE = {
+    "c": box(0, 0, 300, 300).difference(box(80, 80, 400, 220)),
+    "bar": box(0, 0, 100, 100).union(box(200, 0, 300, 100)).union(box(100, 40, 200, 60)),
+    "l": box(0, 0, 300, 100).union(box(0, 0, 100, 300)),
+    "star": Polygon([
+        (np.cos(a) * r, np.sin(a) * r)
+        for a, r in zip(np.linspace(0, 2 * np.pi, 10, endpoint=False), [400, 160] * 5)
+    ]),
+    "ring": Polygon(_circle(300), [_circle(150)[::-1]]),
+}
+
+ANGLES = [0, 30, 45, 90, 117]
+
+
+def _row_by_row(polygon_points, density_start, density_end, angle):
+    """app.stitch_engine tatami before fill sections: every row in order, odd rows backwards."""
+    layout = tatami_layout(polygon_points, density_start, density_end, angle)
+    ys = layout["ys"]
+    edges = polygon_edges(Polygon(polygon_points), angle)
+    rows, seg_start, seg_end = scanline_segments(edges, ys)
+    counts = ((seg_end - seg_start) / TATAMI_STITCH_LEN).astype(np.intp) + 1
+    seg_id = np.repeat(np.arange(len(rows)), counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    n_line = counts[seg_id] - 1
+    t = np.where(n_line > 0, k / np.maximum(n_line, 1), 0.0)
+    t = np.where(rows[seg_id] % 2 == 1, np.where(n_line > 0, 1.0 - t, 0.0), t)
+    xs = seg_start[seg_id] + (seg_end - seg_start)[seg_id] * t
+    return rotate_points(np.column_stack([xs, ys[rows[seg_id]]]), angle)
+
+
+def _engine_row_by_row(polygon, density, angle, stitch_length, offset):
+    """StitchEngine tatami before fill sections: every non-empty row in order, every other one backwards."""
+    edges = polygon_edges(polygon, angle)
+    miny, maxy = edges[:, [1, 3]].min(), edges[:, [1, 3]].max()
+    y_lines = np.arange(miny, maxy, density)
+    rows, seg_start, seg_end = scanline_segments(edges, y_lines)
+    row_shift = (rows * offset * stitch_length) % stitch_length
+    first = np.where(row_shift > 0, seg_start + row_shift, seg_start + stitch_length)
+    counts = np.maximum(np.ceil((seg_end - first) / stitch_length), 0).astype(np.intp) + 2
+    seg_id = np.repeat(np.arange(len(rows)), counts)
+    local = np.arange(counts.sum()) - (np.cumsum(counts) - counts)[seg_id]
+    xs = first[seg_id] + (local - 1) * stitch_length
+    xs = np.where(local == 0, seg_start[seg_id], xs)
+    xs = np.where(local == counts[seg_id] - 1, seg_end[seg_id], xs)
+    point_rows = rows[seg_id]
+    uniq, row_first, row_counts = np.unique(point_rows, return_index=True, return_counts=True)
+    row_of_point = np.repeat(np.arange(len(uniq)), row_counts)
+    idx = np.arange(len(xs))
+    mirrored = 2 * row_first[row_of_point] + row_counts[row_of_point] - 1 - idx
+    order = np.where(((np.arange(len(uniq)) % 2) == 1)[row_of_point], mirrored, idx)
+    return rotate_points(np.column_stack([xs[order], y_lines[point_rows[order]]]), angle)
+
+
+def _leaves(stitches: np.ndarray, polygon: Polygon, tolerance: float) -> int:
+    """Stitches (segments between consecutive points) not within `tolerance` of the shape."""
+    segments = shapely.linestrings(np.stack([stitches[:-1], stitches[1:]], axis=1))
+    return int(np.count_nonzero(~shapely.covered_by(segments, polygon.buffer(tolerance))))
+
+
+@pytest.mark.parametrize("name", CONVEX)
+@pytest.mark.parametrize("angle", ANGLES)
+def test_convex_fill_is_the_row_by_row_serpentine(name, angle):
+    points = CONVEX[name]
+    layout = tatami_layout(points, 4.0, 7.0, angle)
+    assert layout["stats"]["sections"] == 1
+    np.testing.assert_allclose(tatami_span_stitches(layout, angle), _row_by_row(points, 4.0, 7.0, angle), atol=1e-9)
+
+    polygon = Polygon(points)
+    np.testing.assert_allclose(
+        StitchEngine.generate_tatami_fill(polygon, density=4.0, angle_deg=angle, offset=0.5),
+        _engine_row_by_row(polygon, 4.0, angle, 3.5, 0.5), atol=1e-9)
+
+
+@pytest.mark.parametrize("name", CONCAVE)
+@pytest.mark.parametrize("angle", ANGLES)
+def test_concave_fill_crosses_no_gap(name, angle):
+    polygon = CONCAVE[name]
+    stats = {}
+    stitches = StitchEngine.generate_tatami_fill(polygon, density=4.0, angle_deg=angle, stitch_length=35.0, stats=stats)
+    assert _leaves(stitches, polygon, 3.0) == 0
+    assert np.hypot(*np.diff(stitches, axis=0).T).max() <= 35.0 + 1e-6
+
+    if not polygon.interiors:
+        points = np.asarray(polygon.exterior.coords)[:-1].tolist()
+        assert _leaves(generate_tatami_fill(points, 4.0, 4.0, angle), polygon, 3.0) == 0
@@ -0,0 +1,91 @@
+import json
+import struct
+
+import numpy as np
+import pytest
+
+from app.core.export_processor import export_key
+from app.core.wire import MAGIC, WIRE_VERSION, decode, encode_layers, encode_stitches
+
+LAYERS = [
+    {
+        "color": "#ff0000",
+        "settings": {"angle": 45},
+        "paths": [[[0, 0], [120, 0], [120, 80], [0, 80]], [[300, 300], [310, 300], [305, 320]]],
+        "holes": [[[[10, 10], [20, 10], [15, 20]]], []],
+    },
+    {"color": "#00ff00", "paths": [], "holes": []},
+    # Far-apart points: deltas that do not fit in int16 fall back to f32
+    {"color": "#0000ff", "paths": [[[5, 5], [40000, 7], [8, 9]]]},
+]
+
+
+def _expected(layers):
+    """Layers as decode returns them: every path has its hole list."""
+    result = []
+    for layer in layers:
+        holes = layer.get("holes") or []
+        result.append({
+            **{key: value for key, value in layer.items() if key not in ("paths", "holes")},
+            "paths": layer["paths"],
+            "holes": [holes[i] if i < len(holes) else [] for i in range(len(layer["paths"]))],
+        })
+    return result
+
+
+@pytest.mark.parametrize("encoding", ["i16", "f32"])
+def test_layers_round_trip(encoding):
+    layers = LAYERS[:2]
+    payload = decode(encode_layers(layers, {"k": 2}, encoding=encoding, field="capas"))
+    assert payload["k"] == 2
+    assert payload["capas"] == _expected(layers)
+
+
+def test_layers_fall_back_to_f32():
+    payload = decode(encode_layers(LAYERS))
+    assert payload["layers"] == _expected(LAYERS)
+
+
+def test_stitches_round_trip():
+    stitches = np.array([[0.5, 1.25], [3.33, 4.01], [-12.75, 80.0]])
+    payload = decode(encode_stitches(stitches, {"type": "chunk", "layer": 3}))
+    assert payload["type"] == "chunk" and payload["layer"] == 3
+    np.testing.assert_allclose(payload["stitches"], stitches, atol=0.005)
+
+
+def test_wire_body_has_json_export_key():
+    for pipeline in ("run", "fill"):
+        json_key = export_key(pipeline, LAYERS, "dst")
+        assert export_key(pipeline, decode(encode_layers(LAYERS))["layers"], "dst") == json_key
+        floats = [{**layer, "paths": [[[float(x), float(y)] for x, y in path] for path in layer["paths"]]} for layer in LAYERS]
+        assert export_key(pipeline, floats, "dst") == json_key
+
+
+@pytest.mark.parametrize("data", [b"", b"EMBW", b"XXXX" + bytes(8), encode_stitches([[1, 2]])[:-4]])
+def test_malformed_payloads(data):
+    with pytest.raises(ValueError):
+        decode(data)
+
+
+def _payload(header) -> bytes:
+    """A wire prefix and `header` (any JSON), no arrays."""
+    text = json.dumps(header).encode()
+    text += b" " * (-len(text) % 4)
+    return struct.pack("<4sBBHI", MAGIC, WIRE_VERSION, 2, 0, len(text)) + text
+
+
+@pytest.mark.parametrize("header", [
+    [],
+    {"arrays": 5},
+    {"arrays": [1]},
+    {"arrays": [{"name": "points", "count": 0}]},
+    {"arrays": [{"dtype": "<f4", "count": 0}]},
+    {"arrays": [{"name": "points", "dtype": "bogus", "count": 0}]},
+    {"arrays": [{"name": "points", "dtype": "O", "count": 0}]},
+    {"arrays": [{"name": "points", "dtype": "<U4", "count": 0}]},
+    {"arrays": [{"name": "points", "dtype": "<f4", "count": -1}]},
+    {"arrays": [{"name": "points", "dtype": "<f4", "count": "2"}]},
+])
+def test_malformed_array_specs(header):
+    with pytest.raises(ValueError):
+        decode(_payload(header))
@@ -1,7 +1,18 @@
 // import { Layer } from '@/types/embroidery'; // Unused
+import { WIRE_MEDIA_TYPE, decodeWire } from '@/services/wireFormat';
+
 // API_URL logic updated for production
 const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
 
+// Geometry responses: the binary wire format when the backend offers it, JSON otherwise
+const GEOMETRY_ACCEPT = `${WIRE_MEDIA_TYPE}, application/json;q=0.5`;
+
+// eslint-disable-next-line @typescript-eslint/no-explicit-any
+const readGeometry = async (res: Response): Promise<Record<string, any>> =>
+    res.headers.get('content-type')?.startsWith(WIRE_MEDIA_TYPE)
+        ? decodeWire(await res.arrayBuffer())
+        : res.json();
+
 export interface AppliqueStep {
     name: string;
     type: 'run' | 'satin';
@@ -9,6 +20,36 @@ export interface AppliqueStep {
     paths: number[][][]; // List of contours, each contour is list of [x,y]
 }
 
+export type BatchJob =
+    | { type: 'satin'; path: { x: number, y: number }[]; width?: number; density?: number }
+    | { type: 'tatami'; polygon: { x: number, y: number }[]; densityStart?: number; densityEnd?: number; angle?: number }
+    | { type: 'applique'; polygon: { x: number, y: number }[] };
+
+export type BatchResult =
+    | { stitches: { x: number, y: number }[] }
+    | { steps: AppliqueStep[] }
+    | { error: string };
+
+export type StitchStreamRequest =
+    | { type: 'tatami'; polygon: { x: number, y: number }[]; densityStart?: number; densityEnd?: number; angle?: number }
+    | { type: 'satin'; path: { x: number, y: number }[]; width?: number; density?: number }
+    // eslint-disable-next-line @typescript-eslint/no-explicit-any
+    | { type: 'layers'; layers: any[] };
+
+export interface StitchChunk {
+    stitches: { x: number, y: number }[];
+    layer?: number; // design streams: layer index, block within the layer, underlay or fill
+    block?: number;
+    underlay?: boolean;
+}
+
+export interface StitchStreamHandlers {
+    onChunk: (chunk: StitchChunk) => void;
+    onLayer?: (layer: { index: number; color: string; blocks: number }) => void;
+    onDone?: (stats: { chunks: number; stitches: number; first_chunk_ms: number | null; elapsed_ms: number }) => void;
+    onError?: (detail: string) => void;
+}
+
 export const stitchService = {
     /**
      * Generate satin stitches from a path (polyline)
@@ -20,10 +61,10 @@ export const stitchService = {
         try {
             const res = await fetch(`${API_URL}/satin`, {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', 'Accept': GEOMETRY_ACCEPT },
                 body: JSON.stringify({ path: pathArray, width, density })
             });
-            const data = await res.json();
+            const data = await readGeometry(res);
             // data.stitches is [[x,y]...]
             return data.stitches.map((p: number[]) => ({ x: p[0], y: p[1] }));
         } catch (error) {
@@ -50,5 +91,111 @@ export const stitchService = {
             console.error("Error generating applique:", error);
             throw error;
         }
+    },
+
+    /**
+     * Generate stitches for many objects in one round trip.
+     * Results come back in input order; a failed job yields { error } without failing the rest.
+     */
+    generateBatch: async (jobs: BatchJob[]): Promise<BatchResult[]> => {
+        const toArray = (points: { x: number, y: number }[]) => points.map(p => [p.x, p.y]);
+        const payload = jobs.map(job => {
+            switch (job.type) {
+                case 'satin':
+                    return { type: 'satin', path: toArray(job.path), width: job.width ?? 4.0, density: job.density ?? 0.4 };
+                case 'tatami':
+                    return {
+                        type: 'tatami',
+                        polygon: toArray(job.polygon),
+                        density_start: job.densityStart ?? 0.4,
+                        density_end: job.densityEnd ?? 0.4,
+                        angle: job.angle ?? 0
+                    };
+                case 'applique':
+                    return { type: 'applique', polygon: toArray(job.polygon) };
+            }
+        });
+
+        try {
+            const res = await fetch(`${API_URL}/batch`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ jobs: payload })
+            });
+            const data = await res.json();
+            return data.results.map((result: any) =>
+                result.stitches
+                    ? { stitches: result.stitches.map((p: number[]) => ({ x: p[0], y: p[1] })) }
+                    : result
+            );
+        } catch (error) {
+            console.error("Error generating batch:", error);
+            throw error;
+        }
+    },
+
+    /**
+     * Stream stitches as the backend generates them (tatami row bands, satin rung batches,
+     * design layers in order) so the simulator can start drawing right away.
+     * Each handled chunk hands one credit back, so the server never runs ahead of the client.
+     * Returns a function that cancels the stream.
+     */
+    streamStitches: (request: StitchStreamRequest, handlers: StitchStreamHandlers, credit: number = 8): (() => void) => {
+        const toArray = (points: { x: number, y: number }[]) => points.map(p => [p.x, p.y]);
+        let payload;
+        switch (request.type) {
+            case 'tatami':
+                payload = {
+                    type: 'tatami',
+                    polygon: toArray(request.polygon),
+                    density_start: request.densityStart ?? 0.4,
+                    density_end: request.densityEnd ?? 0.4,
+                    angle: request.angle ?? 0
+                };
+                break;
+            case 'satin':
+                payload = { type: 'satin', path: toArray(request.path), width: request.width ?? 4.0, density: request.density ?? 0.4 };
+                break;
+            case 'layers':
+                payload = { type: 'layers', layers: request.layers };
+                break;
+        }
+
+        // Chunks arrive as binary wire frames, the other events as JSON
+        const ws = new WebSocket(`${API_URL.replace(/^http/, 'ws')}/ws/stitches`);
+        ws.binaryType = 'arraybuffer';
+        ws.onopen = () => ws.send(JSON.stringify({ ...payload, credit, encoding: 'wire' }));
+        ws.onmessage = (message) => {
+            const event = typeof message.data === 'string' ? JSON.parse(message.data) : decodeWire(message.data);
+            switch (event.type) {
+                case 'chunk':
+                    handlers.onChunk({
+                        stitches: event.stitches.map((p: number[]) => ({ x: p[0], y: p[1] })),
+                        layer: event.layer,
+                        block: event.block,
+                        underlay: event.underlay
+                    });
+                    ws.send(JSON.stringify({ credit: 1 }));
+                    break;
+                case 'layer':
+                    handlers.onLayer?.(event);
+                    break;
+                case 'done':
+                    handlers.onDone?.(event);
+                    break;
+                case 'error':
+                    console.error("Error streaming stitches:", event.detail);
+                    handlers.onError?.(event.detail);
+                    break;
+            }
+        };
+        ws.onerror = () => handlers.onError?.('Stitch stream connection failed');
+
+        return () => {
+            if (ws.readyState === WebSocket.OPEN) {
+                ws.send(JSON.stringify({ type: 'cancel' }));
+            }
+            ws.close();
+        };
     }
 };
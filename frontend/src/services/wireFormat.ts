@@ -0,0 +1,157 @@
+// Decoder for the backend's binary geometry format (application/x-embro-geometry,
+// see backend/app/core/wire.py). Layout, little-endian:
+//   0   "EMBW" magic, u8 version, u8 encoding, u16 reserved, u32 header length
+//   12  JSON header, space-padded to 4 bytes
+//   then every array listed in header.arrays, each starting on a 4-byte boundary,
+//   so typed-array views are taken straight over the response buffer.
+
+export const WIRE_MEDIA_TYPE = 'application/x-embro-geometry';
+
+const MAGIC = 'EMBW';
+const WIRE_VERSION = 1;
+const PREFIX_SIZE = 12;
+
+type TypedArray = Uint32Array | Int32Array | Int16Array | Float32Array;
+
+const DTYPES: Record<string, { bytes: number; view: (buffer: ArrayBuffer, offset: number, count: number) => TypedArray }> = {
+    '<u4': { bytes: 4, view: (b, o, n) => new Uint32Array(b, o, n) },
+    '<i4': { bytes: 4, view: (b, o, n) => new Int32Array(b, o, n) },
+    '<i2': { bytes: 2, view: (b, o, n) => new Int16Array(b, o, n) },
+    '<f4': { bytes: 4, view: (b, o, n) => new Float32Array(b, o, n) },
+};
+
+const sum = (values: ArrayLike<number>): number => {
+    let total = 0;
+    for (let i = 0; i < values.length; i++) total += values[i];
+    return total;
+};
+
+interface WireHeader {
+    shape: 'stitches' | 'layers';
+    encoding: 'f32' | 'i16';
+    quantum?: number;
+    field?: string;
+    // eslint-disable-next-line @typescript-eslint/no-explicit-any
+    meta?: Record<string, any>;
+    // eslint-disable-next-line @typescript-eslint/no-explicit-any
+    layers?: Record<string, any>[];
+    arrays: { name: string; dtype: string; count: number }[];
+}
+
+export interface WireLayer {
+    paths: number[][][];
+    holes: number[][][][];
+    // eslint-disable-next-line @typescript-eslint/no-explicit-any
+    [key: string]: any;
+}
+
+/**
+ * Inverse of the backend's encode_stitches / encode_layers: the header meta plus
+ * "stitches" ([[x, y], ...]) or the layers ({ ...info, paths, holes }) under their field
+ * name ("layers", or "capas" for /segmentar). Throws on malformed payloads.
+ */
+// eslint-disable-next-line @typescript-eslint/no-explicit-any
+export function decodeWire(buffer: ArrayBuffer): Record<string, any> {
+    if (buffer.byteLength < PREFIX_SIZE) {
+        throw new Error('Wire payload too short');
+    }
+    const prefix = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    if (magic !== MAGIC || prefix.getUint8(4) !== WIRE_VERSION) {
+        throw new Error('Not a wire payload (bad magic or version)');
+    }
+    const headerLength = prefix.getUint32(8, true);
+    const header: WireHeader = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, PREFIX_SIZE, headerLength)));
+
+    const arrays: Record<string, TypedArray> = {};
+    let offset = PREFIX_SIZE + headerLength;
+    for (const spec of header.arrays) {
+        const dtype = DTYPES[spec.dtype];
+        if (!dtype) {
+            throw new Error(`Unsupported wire dtype ${spec.dtype}`);
+        }
+        if (offset + dtype.bytes * spec.count > buffer.byteLength) {
+            throw new Error(`Wire payload truncated in array ${spec.name}`);
+        }
+        arrays[spec.name] = dtype.view(buffer, offset, spec.count);
+        offset += dtype.bytes * spec.count;
+        offset += (4 - (offset % 4)) % 4;
+    }
+
+    const ringPoints = arrays.ring_points;
+    const flat = arrays.points;
+    if (!ringPoints || !flat) {
+        throw new Error('Wire payload is missing its points');
+    }
+    const rings = decodeRings(header, ringPoints, flat, arrays.ring_starts);
+
+    // eslint-disable-next-line @typescript-eslint/no-explicit-any
+    const result: Record<string, any> = { ...(header.meta ?? {}) };
+    if (header.shape === 'stitches') {
+        result.stitches = rings[0] ?? [];
+        return result;
+    }
+
+    const layerPaths = arrays.layer_paths ?? new Uint32Array(0);
+    const pathHoles = arrays.path_holes ?? new Uint32Array(0);
+    const infos = header.layers ?? Array.from(layerPaths, () => ({}));
+    if (infos.length !== layerPaths.length || sum(layerPaths) !== pathHoles.length || pathHoles.length + sum(pathHoles) !== rings.length) {
+        throw new Error('Wire payload layer structure does not match its rings');
+    }
+
+    const layers: WireLayer[] = [];
+    let ring = 0;
+    let path = 0;
+    infos.forEach((info, i) => {
+        const paths: number[][][] = [];
+        const holes: number[][][][] = [];
+        for (let p = 0; p < layerPaths[i]; p++) {
+            const nHoles = pathHoles[path];
+            paths.push(rings[ring]);
+            holes.push(rings.slice(ring + 1, ring + 1 + nHoles));
+            ring += 1 + nHoles;
+            path += 1;
+        }
+        layers.push({ ...info, paths, holes });
+    });
+    result[header.field || 'layers'] = layers;
+    return result;
+}
+
+/** Rings as [[x, y], ...] lists; "i16" deltas are integrated from each ring's start. */
+function decodeRings(header: WireHeader, ringPoints: TypedArray, flat: TypedArray, ringStarts?: TypedArray): number[][][] {
+    if (flat.length !== 2 * sum(ringPoints)) {
+        throw new Error('Wire payload point count does not match ring sizes');
+    }
+    const deltas = header.encoding === 'i16';
+    const quantum = header.quantum ?? 1;
+    let nonEmpty = 0;
+    for (let r = 0; r < ringPoints.length; r++) if (ringPoints[r] > 0) nonEmpty++;
+    if (deltas && (!ringStarts || ringStarts.length !== 2 * nonEmpty)) {
+        throw new Error('Wire payload ring starts do not match ring sizes');
+    }
+
+    const rings: number[][][] = [];
+    let point = 0;
+    let start = 0;
+    for (let r = 0; r < ringPoints.length; r++) {
+        const count = ringPoints[r];
+        const ring: number[][] = new Array(count);
+        if (deltas && count > 0) {
+            let x = ringStarts![2 * start];
+            let y = ringStarts![2 * start + 1];
+            start += 1;
+            for (let i = 0; i < count; i++, point++) {
+                x += flat[2 * point];
+                y += flat[2 * point + 1];
+                ring[i] = [x * quantum, y * quantum];
+            }
+        } else {
+            for (let i = 0; i < count; i++, point++) {
+                ring[i] = [flat[2 * point], flat[2 * point + 1]];
+            }
+        }
+        rings.push(ring);
+    }
+    return rings;
+}